@@ -0,0 +1,321 @@
+""" Benchmarks each stage of the pipeline on synthetic histories
+
+Generates a git repository with a history of the given size, with Bitbucket pull request merges
+("Merged in ... (pull request #N)") and "Approved-by:" trailers. Then it times each stage separately, for each backend:
+- fetch: run git log
+- parse: extract commits and pull requests
+- dataframe: build the typed dataframes
+- aggregate: build the cubes
+- site: write the pages and chart data
+- render: render the charts
+
+The timings are written as JSON. Pass the JSON of a previous version as baseline to compare the two; the command fails
+if a stage got slower than the tolerance allows.
+
+> python3 bench/pipeline.py --commits 10000 --commits 100000 --authors 50 --output after.json --baseline before.json
+"""
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import formatparser  # noqa: E402
+import gitlog  # noqa: E402
+import gitparser  # noqa: E402
+import main  # noqa: E402
+
+STAGES = ['fetch', 'parse', 'dataframe', 'aggregate', 'site', 'render']
+HOME_URL = 'http://localhost/'
+# stages faster than this in the baseline are too noisy to compare
+MIN_COMPARED_SECONDS = 0.1
+
+WORDS = ['fix', 'add', 'remove', 'refactor', 'update', 'parser', 'widget', 'cache', 'report', 'config', 'tests',
+         'docs', 'handler', 'query', 'index', 'layout']
+PATHS = ['src/module_{i}.py', 'src/package_{i}/views.py', 'tests/test_module_{i}.py', 'docs/page_{i}.md',
+         'templates/page_{i}.html', 'static/style_{i}.css']
+
+
+def format_date(date):
+    # as git log --date=raw prints dates, in a single timezone
+    return '{seconds:d} +0000'.format(seconds=int(date.replace(tzinfo=datetime.timezone.utc).timestamp()))
+
+
+def generate_title(rnd):
+    return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 6))).capitalize() + ' {n:d}'.format(
+        n=rnd.randint(1, 9999))
+
+
+def change_file(rnd, lines, counter, max_lines=100):
+    """ Changes the lines of a file as a commit would, removing some and appending new ones
+    :param list[str] lines: the lines of the file, changed in place
+    :param itertools.count counter: numbers the new lines, so that every line is unique and diffs are exact
+    :param int max_lines: the maximum length of the file, older lines are removed beyond it
+    """
+    for _ in range(min(rnd.randint(0, 40), len(lines))):
+        del lines[rnd.randrange(len(lines))]
+    lines += ['line {n:d}\n'.format(n=next(counter)) for _ in range(rnd.randint(1, 80))]
+    del lines[:-max_lines]
+
+
+def write_data(stream, text):
+    data = text.encode('utf-8')
+    stream.write('data {size:d}\n'.format(size=len(data)).encode('ascii') + data + b'\n')
+
+
+def generate_repository(directory, no_commits, no_authors, merge_ratio=0.2, max_reviewers=3, years=10, seed=0,
+                        now=None):
+    """ Generates a git repository with a synthetic history, using git fast-import
+    Regular commits change a few files on a feature branch, pull request merges join the feature branch with the
+    previous merge, so git log computes the diffs of a realistic history.
+    :param str directory: the directory to create the repository in
+    :param int no_commits: the number of commits, merges included
+    :param int no_authors: the number of distinct authors, who also review
+    :param float merge_ratio: the fraction of commits merging a pull request
+    :param int max_reviewers: the maximum number of approvals per pull request
+    :param int years: the number of years the history spans
+    :param int seed: the random seed, equal seeds generate equal histories
+    :param datetime.datetime now: the date of the newest commit in naive UTC, defaults to now
+    """
+    rnd = random.Random(seed)
+    now = now or gitparser.utcnow()
+    authors = ['Author {i:03d}'.format(i=i) for i in range(no_authors)]
+    span = years * 365 * 86400
+    offsets = sorted((rnd.randrange(span) for _ in range(no_commits)), reverse=True)
+    files = {}
+    counter = itertools.count()
+    subprocess.check_call(['git', 'init', '-q', '-b', 'master', directory])
+    process = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=directory, stdin=subprocess.PIPE)
+    stream = process.stdin
+    # the marks of the last merge and of the last commit, the tip of the feature branch
+    base = tip = None
+    no_prs = 0
+    for mark, offset in enumerate(offsets, 1):
+        author = rnd.choice(authors)
+        ident = '{author} <{email}@example.com> {date}\n'.format(
+            author=author, email=author.replace(' ', '.'), date=format_date(now - datetime.timedelta(seconds=offset)))
+        stream.write('commit refs/heads/master\nmark :{mark:d}\nauthor {ident}committer {ident}'.format(
+            mark=mark, ident=ident).encode('utf-8'))
+        # a merge needs a feature branch to merge
+        if base is not None and tip != base and rnd.random() < merge_ratio:
+            no_prs += 1
+            reviewers = rnd.sample(authors, min(rnd.randint(0, max_reviewers), len(authors)))
+            write_data(stream, 'Merged in feature/branch-{n:d} (pull request #{n:d})\n\n{title}\n\n{trailers}'.format(
+                n=no_prs, title=generate_title(rnd),
+                trailers=''.join('Approved-by: {reviewer}\n'.format(reviewer=r) for r in reviewers)))
+            stream.write('from :{tip:d}\nmerge :{base:d}\n'.format(tip=tip, base=base).encode('ascii'))
+            base = mark
+        else:
+            write_data(stream, generate_title(rnd) + '\n')
+            if tip is not None:
+                stream.write('from :{tip:d}\n'.format(tip=tip).encode('ascii'))
+            for _ in range(rnd.randint(1, 6)):
+                path = rnd.choice(PATHS).format(i=rnd.randint(0, 200))
+                lines = files.setdefault(path, [])
+                change_file(rnd, lines, counter)
+                stream.write('M 644 inline {path}\n'.format(path=path).encode('utf-8'))
+                write_data(stream, ''.join(lines))
+            base = base or mark
+        stream.write(b'\n')
+        tip = mark
+    stream.close()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, 'git fast-import')
+    subprocess.check_call(['git', 'checkout', '-q', 'master'], cwd=directory)
+
+
+def fetch_logs(backend, directory):
+    """ Runs git log for the pull requests and the commits, as main.stream_pull_requests and main.stream_commits do
+    :param str backend: 'stat' to read the human readable log, 'format' to read machine readable records
+    :param str directory: the repository
+    :return: the pull request log and the commit log, as lines or records
+    :rtype: tuple[list[str], list[str]]
+    """
+    if 'format' == backend:
+        return (list(gitlog.stream_records(gitlog.FORMAT_PR_LOG_ARGS, gitlog.RECORD_SEPARATOR, directory)),
+                list(gitlog.stream_records(gitlog.FORMAT_COMMIT_LOG_ARGS, gitlog.RECORD_SEPARATOR, directory)))
+    return list(gitlog.stream_log(gitlog.PR_LOG_ARGS, directory)), list(gitlog.stream_log(gitlog.COMMIT_LOG_ARGS,
+                                                                                            directory))
+
+
+def parse_logs(backend, pr_log, commit_log, jobs=1):
+    """ Parses the logs read by fetch_logs
+    :return: the pull requests and the commits
+    :rtype: tuple[list[gitparser.PullRequest], list[gitparser.Commit]]
+    """
+    if 'format' == backend:
+        return list(formatparser.stream_pull_requests(pr_log)), list(formatparser.stream_commits(commit_log))
+    return (list(gitparser.stream_pull_requests(iter(pr_log), jobs)),
+            list(gitparser.stream_commits(iter(commit_log), jobs)))
+
+
+class Timer(object):
+    """ Times the stages of one run """
+
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.stages[stage] = {'seconds': round(time.perf_counter() - start, 4)}
+        return result
+
+    def count(self, stage, rows):
+        self.stages[stage]['rows'] = rows
+
+
+def run_pipeline(backend, directory, workdir, jobs=1, plotgraphs=True, render_authors=10):
+    """ Runs and times each stage of the pipeline
+    :param str backend: the log format to read and parse, 'stat' or 'format', see main.stream_commits
+    :param str directory: the repository to log
+    :param str workdir: the directory to write the site to
+    :param int jobs: the maximum number of worker processes to parse and render with
+    :param bool plotgraphs: False to skip rendering the charts
+    :param int render_authors: the number of author views to write, besides the team views
+    :return: seconds and row counts per stage
+    :rtype: dict[str, dict]
+    """
+    timer = Timer()
+    pr_log, commit_log = timer.time('fetch', fetch_logs, backend, directory)
+    timer.count('fetch', len(pr_log) + len(commit_log))
+
+    prs, commits = timer.time('parse', parse_logs, backend, pr_log, commit_log, jobs)
+    timer.count('parse', len(prs) + len(commits))
+    del pr_log, commit_log
+
+    def build_dfs():
+        import storage
+        return (storage.apply_dtypes(main.convert_prs_to_dateframe(prs)).sort_index(),
+                storage.apply_dtypes(main.convert_commits_to_dateframe(commits)).sort_index())
+    pr_df, commit_df = timer.time('dataframe', build_dfs)
+    timer.count('dataframe', len(pr_df) + len(commit_df))
+    del prs, commits
+
+    now = gitparser.utcnow()
+    dateranges = main.compute_dateranges(now)
+    start_date = min(date_from for date_from, _, _ in dateranges)
+    cubes = timer.time('aggregate', main.compute_cubes, pr_df, commit_df, start_date, now)
+
+    recent_authors = main.compute_recent_authors(pr_df)
+    output = os.path.join(workdir, 'site')
+    charts = timer.time('site', main.write_static_site, cubes, dateranges, output, ROOT_DIR, 'bench', HOME_URL,
+                        recent_authors, plotgraphs, recent_authors[:render_authors])
+
+    if plotgraphs:
+        import graphs
+        timer.count('site', len(charts))
+        timer.time('render', graphs.render_jobs, charts, jobs, os.path.join(output, graphs.RENDER_CACHE_FILENAME))
+        timer.count('render', len(charts))
+    return timer.stages
+
+
+def read_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT_DIR,
+                                       universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """ Prints the ratio of each stage's time to the baseline's
+    :return: the number of stages slower than the tolerance allows
+    :rtype: int
+    """
+    # baselines from before the format backend was benchmarked ran the stat backend only
+    baseline_runs = {(run['commits'], run['authors'], run.get('backend', 'stat')): run for run in baseline['runs']}
+    no_regressions = 0
+    for run in results['runs']:
+        base = baseline_runs.get((run['commits'], run['authors'], run['backend']))
+        if base is None:
+            continue
+        for stage, timing in run['stages'].items():
+            base_seconds = base['stages'].get(stage, {}).get('seconds')
+            if base_seconds is None or base_seconds < MIN_COMPARED_SECONDS:
+                continue
+            ratio = timing['seconds'] / base_seconds
+            regressed = ratio > tolerance
+            no_regressions += regressed
+            click.echo('{commits:>9} commits {backend:<6} {stage:<10} {base:8.3f}s -> {seconds:8.3f}s  x{ratio:.2f}'
+                       '{flag}'.format(commits=run['commits'], backend=run['backend'], stage=stage, base=base_seconds, seconds=timing['seconds'], ratio=ratio,
+                flag='  REGRESSION' if regressed else ''))
+    return no_regressions
+
+
+@click.command()
+@click.option('--commits', type=int, multiple=True, default=[10000],
+              help='Number of commits of the synthetic history, repeat to benchmark several sizes')
+@click.option('--authors', type=int, default=10, help='Number of distinct authors')
+@click.option('--merge-ratio', type=float, default=0.2, help='Fraction of commits merging a pull request')
+@click.option('--max-reviewers', type=int, default=3, help='Maximum number of approvals per pull request')
+@click.option('--years', type=int, default=10, help='Number of years the history spans')
+@click.option('--seed', type=int, default=0)
+@click.option('--repository', help='Benchmark the logs of this repository instead of synthetic ones')
+@click.option('--backend', type=click.Choice(['stat', 'format']), multiple=True, default=['stat', 'format'],
+              help='Log format to read and parse, repeat to benchmark several, defaults to all')
+@click.option('--jobs', type=int, default=1, help='Number of worker processes to parse and render with')
+@click.option('--plotgraphs/--no-plotgraphs', default=True, help='Also time rendering the charts')
+@click.option('--render-authors', type=int, default=10,
+              help='Number of author views to write and render, besides the team views')
+@click.option('--output', help='Write the results to this JSON file, defaults to stdout')
+@click.option('--baseline', help='Compare with the results of this JSON file')
+@click.option('--tolerance', type=float, default=1.25, help='Maximum ratio of a stage\'s time to the baseline\'s')
+def benchmark(commits=(10000,), authors=10, merge_ratio=0.2, max_reviewers=3, years=10, seed=0, repository=None,
+              backend=('stat', 'format'), jobs=1, plotgraphs=True, render_authors=10, output=None, baseline=None,
+              tolerance=1.25):
+    results = {'version': read_version(), 'date': gitparser.utcnow().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'parameters': {'merge_ratio': merge_ratio, 'max_reviewers': max_reviewers, 'years': years,
+                              'seed': seed, 'jobs': jobs, 'plotgraphs': plotgraphs,
+                              'render_authors': render_authors, 'repository': repository},
+               'runs': []}
+    for no_commits in ([None] if repository else commits):
+        workdir = tempfile.mkdtemp(prefix='git-quality-bench-')
+        try:
+            if repository:
+                directory = repository
+            else:
+                start = time.perf_counter()
+                directory = os.path.join(workdir, 'repository')
+                generate_repository(directory, no_commits, authors, merge_ratio, max_reviewers, years, seed)
+                click.echo('Generated {no_commits:d} commits in {seconds:.1f}s'.format(
+                    no_commits=no_commits, seconds=time.perf_counter() - start), err=True)
+            for name in backend:
+                run = {'commits': no_commits, 'authors': None if repository else authors, 'backend': name,
+                       'stages': run_pipeline(name, directory, os.path.join(workdir, name), jobs, plotgraphs,
+                                              render_authors)}
+                run['seconds'] = round(sum(timing['seconds'] for timing in run['stages'].values()), 4)
+                results['runs'].append(run)
+                click.echo('{backend}: '.format(backend=name) + ', '.join(
+                    '{stage} {seconds:.3f}s'.format(stage=stage, seconds=timing['seconds'])
+                    for stage, timing in run['stages'].items()), err=True)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+
+    if baseline:
+        with open(baseline, 'r') as f:
+            no_regressions = compare(results, json.load(f), tolerance)
+        sys.exit(1 if no_regressions else 0)
+
+
+if __name__ == '__main__':
+    benchmark()
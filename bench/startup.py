@@ -0,0 +1,65 @@
+""" Benchmarks the startup of the command line interface
+
+Runs `main.py --help` a number of times and fails if the median wall time exceeds the budget, or if parsing the
+arguments imports any of the heavy dependencies, which are only to be imported by the code paths needing them.
+
+> python3 bench/startup.py --budget 0.5
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+HEAVY_MODULES = ['cairocffi', 'html2text', 'matplotlib', 'numpy', 'pandas', 'pyarrow', 'seaborn', 'sklearn']
+
+# imports main as `main.py --help` does and lists the heavy modules imported on the way
+IMPORT_CHECK = '''
+import sys
+sys.path.insert(0, {src!r})
+import main
+print(','.join(m for m in {modules!r} if m in sys.modules))
+'''
+
+
+def time_help(python):
+    start = time.perf_counter()
+    subprocess.run([python, os.path.join(SRC_DIR, 'main.py'), '--help'], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def find_heavy_imports(python):
+    output = subprocess.check_output([python, '-c', IMPORT_CHECK.format(src=SRC_DIR, modules=HEAVY_MODULES)],
+                                     universal_newlines=True)
+    return [m for m in output.strip().split(',') if m]
+
+
+@click.command()
+@click.option('--budget', type=float, default=1.0, help='Maximum median seconds for main.py --help')
+@click.option('--runs', type=int, default=5, help='Number of timed runs')
+@click.option('--python', default=sys.executable, help='Python interpreter to run main.py with')
+def benchmark(budget=1.0, runs=5, python=sys.executable):
+    # the first run warms the file system cache and compiles the byte code
+    time_help(python)
+    timings = [time_help(python) for _ in range(runs)]
+    median = statistics.median(timings)
+    click.echo('main.py --help: median {median:.3f}s, min {min:.3f}s, max {max:.3f}s over {runs:d} runs, '
+               'budget {budget:.3f}s'.format(median=median, min=min(timings), max=max(timings), runs=runs,
+                                             budget=budget))
+
+    failed = False
+    if median > budget:
+        click.echo('FAIL: startup exceeds the budget by {excess:.3f}s'.format(excess=median - budget), err=True)
+        failed = True
+    heavy_imports = find_heavy_imports(python)
+    if heavy_imports:
+        click.echo('FAIL: importing main imports {modules}'.format(modules=', '.join(heavy_imports)), err=True)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    benchmark()
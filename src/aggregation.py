@@ -0,0 +1,244 @@
+""" Functions for bucketing commits by date and aggregating them once for all views """
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import gitparser
+import profiling
+import punchcard
+
+
+def generate_xtick(i, dt, frequency):
+    if 'M' == frequency:
+        n = 3
+    elif 'W' == frequency:
+        n = 9
+    else:
+        n = 70
+    return dt.strftime("%b'%y") if (i % n == 0) else ''
+
+
+def compute_next_datetime(dt, frequency):
+    if frequency == 'M':
+        next_d = datetime.datetime(dt.year, dt.month, 1) - datetime.timedelta(seconds=1)
+        return next_d
+    elif frequency == 'W':
+        return dt - datetime.timedelta(days=7)
+    elif frequency == 'D':
+        return dt - datetime.timedelta(days=1)
+    else:
+        raise NotImplementedError('Not implemented for frequency {}'.format(frequency))
+
+
+def compute_penultimate_datetime(dt, frequency):
+    if frequency == 'M':
+        return datetime.datetime(dt.year, dt.month, 1, 0) - datetime.timedelta(seconds=1)
+    elif frequency == 'W':
+        # the start of the week of dt, which may fall in the previous month
+        return datetime.datetime(dt.year, dt.month, dt.day) - datetime.timedelta(days=dt.weekday(), seconds=1)
+    elif frequency == 'D':
+        return datetime.datetime(dt.year, dt.month, dt.day, 0) - datetime.timedelta(seconds=1)
+    else:
+        raise NotImplementedError('Not implemented for frequency {}'.format(frequency))
+
+
+def generate_xticks(start_date, frequency, now=None):
+    ticks = []
+    dt = now or gitparser.utcnow()
+    ticks += [dt]
+    dt = compute_penultimate_datetime(dt, frequency)
+
+    while dt > start_date:
+        ticks += [dt]
+        dt = compute_next_datetime(dt, frequency)
+    ticks += [dt]
+    ticks = ticks[::-1]
+    ranges = list(zip(ticks[:-1], ticks[1:]))
+    ticks = ticks[1:]
+    tick_labels = [generate_xtick(i, d, frequency) for i, d in enumerate(ticks)]
+    return ticks, ranges, tick_labels
+
+
+def daterange_buckets(index, labels, ranges):
+    """ Labels each date with the label of the range containing it, for use as a groupby key
+    :param pd.DatetimeIndex index: the dates to bucket
+    :param list[datetime.datetime] labels: a label per range
+    :param list[tuple[datetime.datetime, datetime.datetime]] ranges: contiguous, sorted [from, to) ranges
+    :return: the label per date, NaT for dates outside of all ranges
+    :rtype: np.ndarray
+    """
+    edges = np.array([from_dt for from_dt, _ in ranges] + [ranges[-1][1]], dtype='datetime64[ns]')
+    positions = np.searchsorted(edges, index.values.astype('datetime64[ns]'), side='right') - 1
+    inside = (positions >= 0) & (positions < len(ranges))
+    buckets = np.full(len(index), np.datetime64('NaT'), dtype='datetime64[ns]')
+    buckets[inside] = np.array(labels, dtype='datetime64[ns]')[positions[inside]]
+    return buckets
+
+
+def review_edges(pr_df):
+    """ Expands the reviewer lists of a pull request dataframe to a long form table with a row per review
+    :param pd.DataFrame pr_df: the pull request dataframe
+    :return: frame indexed by the date of the pull request with columns hash, author and reviewer
+    :rtype: pd.DataFrame
+    """
+    columns = [c for c in [gitparser.REPO, gitparser.HASH, gitparser.AUTHOR, gitparser.REVIEWERS] if c in pr_df.columns]
+    edges = pr_df[columns].explode(gitparser.REVIEWERS).rename(columns={gitparser.REVIEWERS: gitparser.REVIEWER})
+    edges = edges[edges[gitparser.REVIEWER].notna()]
+    # a reviewer approving twice counts once
+    return edges[~edges.duplicated([c for c in [gitparser.REPO, gitparser.HASH, gitparser.REVIEWER]
+                                    if c in edges.columns])]
+
+
+def compute_local_dates(df):
+    """ Computes the dates of the records in the local time of their authors, e.g. for punchcards of working hours
+    :param pd.DataFrame df: a commit or pull request dataframe, indexed by UTC date
+    :return: the local dates, or the UTC dates of dataframes saved without the timezone offsets
+    :rtype: pd.DatetimeIndex
+    """
+    if gitparser.TZ_OFFSET not in df.columns:
+        return df.index
+    return df.index + pd.to_timedelta(df[gitparser.TZ_OFFSET].to_numpy(dtype=np.int64), unit='m')
+
+
+def sum_by_bucket(df, authors):
+    """ Sums a (bucket, author) indexed frame over the given authors
+    :rtype: pd.DataFrame
+    """
+    if df.empty:
+        return df.droplevel(gitparser.AUTHOR)
+    df = df[df.index.get_level_values(gitparser.AUTHOR).isin(authors)]
+    return df.groupby(level=0).sum()
+
+
+def compute_mean_std(stats, xticks):
+    """ Computes the mean and sample standard deviation per bucket from summed count, sum and sum of squares
+    :param pd.DataFrame stats: frame indexed by bucket with columns 'count', 'sum' and 'sumsq'
+    :param list[datetime.datetime] xticks: the buckets to compute for
+    :return: frame indexed by xticks with columns 'mean' and 'std', NaN where undefined
+    :rtype: pd.DataFrame
+    """
+    stats = stats.reindex(xticks)
+    n = stats['count']
+    mean = stats['sum'] / n.where(n > 0)
+    var = (stats['sumsq'] - stats['sum'] * mean) / (n - 1).where(n > 1)
+    return pd.DataFrame({'mean': mean, 'std': np.sqrt(var.clip(lower=0))}, index=xticks)
+
+
+def author_matrix(series, xticks, authors, level=gitparser.AUTHOR):
+    """ Unstacks a (bucket, author) indexed series into a bucket x author frame
+    :param str level: the index level holding the authors, e.g. gitparser.REVIEWER
+    :rtype: pd.DataFrame
+    """
+    df = series.unstack(level, fill_value=0) if not series.empty else pd.DataFrame()
+    return df.reindex(index=xticks, columns=authors, fill_value=0)
+
+
+class Cube(object):
+    """ Per (bucket, author) counts and sums of the pull request and commit dataframes for one frequency
+
+    Built once over the widest date range, any narrower view is a slice of it: the buckets of a narrower range
+    are the most recent buckets of the widest one.
+    """
+
+    def __init__(self, pr_df, commit_df, frequency, start_date, now=None):
+        """
+        :param pd.DataFrame pr_df: the pull request dataframe
+        :param pd.DataFrame commit_df: the commit dataframe
+        :param str frequency: the bucket frequency, one of 'M', 'W' or 'D'
+        :param datetime.datetime start_date: the start of the widest range to aggregate
+        :param datetime.datetime now: the end of all ranges, in UTC, defaults to now
+        """
+        self.frequency = frequency
+        self.now = now or gitparser.utcnow()
+        with profiling.span('aggregate', rows=len(pr_df) + len(commit_df), frequency=frequency):
+            xticks, ranges, _ = generate_xticks(start_date, frequency, self.now)
+            self.pr_authors = set(pr_df[gitparser.AUTHOR].astype(str))
+
+            pr_keys = [daterange_buckets(pr_df.index, xticks, ranges), pr_df[gitparser.AUTHOR].astype(str).values]
+            pr_grouped = pr_df.groupby(pr_keys)
+            no_reviews = pr_df[gitparser.NO_REVIEWS]
+            self.prs = pr_grouped.size().rename_axis(['bucket', gitparser.AUTHOR])
+            self.no_reviews = pd.DataFrame({
+                'count': pr_grouped[gitparser.NO_REVIEWS].count(),
+                'sum': pr_grouped[gitparser.NO_REVIEWS].sum(),
+                'sumsq': (no_reviews ** 2).groupby(pr_keys).sum()}).rename_axis(['bucket', gitparser.AUTHOR])
+            edges = review_edges(pr_df)
+            self.reviews = edges.groupby([daterange_buckets(edges.index, xticks, ranges),
+                                          edges[gitparser.AUTHOR].astype(str).values,
+                                          edges[gitparser.REVIEWER].astype(str).values]).size().rename_axis(
+                ['bucket', gitparser.AUTHOR, gitparser.REVIEWER])
+
+            commit_keys = [daterange_buckets(commit_df.index, xticks, ranges),
+                           commit_df[gitparser.AUTHOR].astype(str).values]
+            commit_grouped = commit_df.groupby(commit_keys)
+            code_changes = commit_df[gitparser.CODE_CHANGES]
+            self.commits = pd.DataFrame({
+                'count': commit_grouped.size(),
+                gitparser.INSERTIONS: commit_grouped[gitparser.INSERTIONS].sum(),
+                gitparser.DELETIONS: commit_grouped[gitparser.DELETIONS].sum(),
+                gitparser.CODE_CHANGES: commit_grouped[gitparser.CODE_CHANGES].sum()}).rename_axis(
+                ['bucket', gitparser.AUTHOR])
+            self.code_changes = pd.DataFrame({
+                'count': commit_grouped[gitparser.CODE_CHANGES].count(),
+                'sum': commit_grouped[gitparser.CODE_CHANGES].sum(),
+                'sumsq': (code_changes ** 2).groupby(commit_keys).sum()}).rename_axis(['bucket', gitparser.AUTHOR])
+
+        # punchcards span all history, in the local time of the authors
+        self.commit_dates = compute_local_dates(commit_df)
+        self.commit_authors = commit_df[gitparser.AUTHOR].astype(str).values
+        self.punchcards = {}
+
+    def xticks(self, start_date):
+        """ Computes the buckets and tick labels of a view starting at the given date
+        :rtype: tuple[list[datetime.datetime], list[str]]
+        """
+        xticks, _, xticklabels = generate_xticks(start_date, self.frequency, self.now)
+        return xticks, xticklabels
+
+    def pr_frames(self, authors, review_authors, start_date):
+        """ Slices the pull request statistics of a view
+        :param list[str] authors: the pull request authors to include
+        :param list[str] review_authors: the reviewers to include
+        :param datetime.datetime start_date: the start of the view
+        :return: frames keyed by chart name, or None if the authors have no pull requests
+        :rtype: dict[str, pd.DataFrame]
+        """
+        if not self.pr_authors.intersection(authors):
+            return None
+        xticks, _ = self.xticks(start_date)
+        df_prs = author_matrix(self.prs, xticks, authors)
+        reviews = self.reviews[self.reviews.index.get_level_values(gitparser.AUTHOR).isin(authors)]
+        df_reviews = author_matrix(reviews.groupby(level=['bucket', gitparser.REVIEWER]).sum(), xticks,
+                                   review_authors, level=gitparser.REVIEWER)
+        df_avg_reviews = compute_mean_std(sum_by_bucket(self.no_reviews, authors), xticks)
+        return {'prs': df_prs, 'authors': df_prs.clip(upper=1), 'reviews': df_reviews,
+                'avg_reviews': df_avg_reviews}
+
+    def commit_frames(self, authors, start_date):
+        """ Slices the commit statistics of a view
+        :param list[str] authors: the commit authors to include
+        :param datetime.datetime start_date: the start of the view
+        :return: frames keyed by chart name
+        :rtype: dict[str, pd.DataFrame]
+        """
+        xticks, _ = self.xticks(start_date)
+        commits = self.commits[self.commits.index.get_level_values(gitparser.AUTHOR).isin(authors)]
+        insertions = author_matrix(commits[gitparser.INSERTIONS], xticks, authors)
+        deletions = author_matrix(commits[gitparser.DELETIONS], xticks, authors)
+        return {'commits': author_matrix(commits['count'], xticks, authors),
+                'insertions': (insertions - deletions).clip(lower=0),
+                'deletions': (deletions - insertions).clip(lower=0),
+                'code': author_matrix(commits[gitparser.CODE_CHANGES], xticks, authors),
+                'avg_changes': compute_mean_std(sum_by_bucket(self.code_changes, authors), xticks)}
+
+    def punchcard_grid(self, authors):
+        """ Counts all commits by the given authors per day of week and hour, once per set of authors
+        :rtype: np.ndarray
+        """
+        key = tuple(sorted(authors))
+        if key not in self.punchcards:
+            dates = self.commit_dates[np.isin(self.commit_authors, authors)]
+            with profiling.span('punchcard', rows=len(dates), authors=len(key)):
+                self.punchcards[key] = punchcard.compute_punchcard(dates)
+        return self.punchcards[key]
@@ -0,0 +1,309 @@
+""" HTTP api answering metric queries over the pull request and commit dataframes
+
+GET /api/<metric>?authors=<a,b>&frequency=<M|W|D>&start=<YYYY-MM-DD>&end=<YYYY-MM-DD> returns the metric per bucket,
+e.g. /api/prs?authors=Ann%20Bee&frequency=W&start=2024-01-01 for the pull requests merged by Ann Bee per week since
+2024. GET /api/ lists the metrics and authors. Responses are cached until new commits are ingested.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import click
+import numpy as np
+import pandas as pd
+
+import aggregation
+import gitparser
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+API_PREFIX = '/api/'
+DATE_FORMAT = '%Y-%m-%d'
+FREQUENCIES = ['M', 'W', 'D']
+DEFAULT_FREQUENCY = 'W'
+DEFAULT_DAYS = 365
+CACHE_SIZE = 1024
+
+# metrics summed per bucket and author: the dataframe, and the column to sum or None to count rows
+SUM_METRICS = {
+    'prs': ('prs', None),
+    'commits': ('commits', None),
+    gitparser.INSERTIONS: ('commits', gitparser.INSERTIONS),
+    gitparser.DELETIONS: ('commits', gitparser.DELETIONS),
+    gitparser.CODE_CHANGES: ('commits', gitparser.CODE_CHANGES),
+}
+# metrics averaged per bucket: the dataframe and the column to average
+MEAN_METRICS = {
+    'avg_reviews': ('prs', gitparser.NO_REVIEWS),
+    'avg_changes': ('commits', gitparser.CODE_CHANGES),
+}
+# reviews received per bucket and reviewer
+REVIEW_METRIC = 'reviews'
+METRICS = sorted(list(SUM_METRICS) + list(MEAN_METRICS) + [REVIEW_METRIC])
+
+
+class QueryError(ValueError):
+    """ Raised for queries which cannot be answered, with the http status to respond with """
+
+    def __init__(self, message, status=400):
+        super(QueryError, self).__init__(message)
+        self.status = status
+
+
+def parse_date(value, name):
+    try:
+        return datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise QueryError('{name} must be a date formatted as YYYY-MM-DD, not {value!r}'.format(name=name, value=value))
+
+
+def parse_query(path, today=None):
+    """ Parses and normalises a metric query, so that equal queries have equal keys
+    :param str path: the request path including the query string
+    :param datetime.date today: the date to default the date range to, defaults to today in UTC
+    :return: tuple of metric, sorted authors, frequency, start and end date
+    :rtype: tuple[str, tuple[str], str, datetime.datetime, datetime.datetime]
+    """
+    url = urlsplit(path)
+    metric = url.path[len(API_PREFIX):].strip('/')
+    if metric not in METRICS:
+        raise QueryError('Unknown metric {metric!r}, expected one of {metrics}'.format(
+            metric=metric, metrics=', '.join(METRICS)), status=404)
+    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+    authors = tuple(sorted({a.strip() for a in params.get('authors', '').split(',') if a.strip()}))
+    frequency = params.get('frequency', DEFAULT_FREQUENCY)
+    if frequency not in FREQUENCIES:
+        raise QueryError('frequency must be one of {frequencies}'.format(frequencies=', '.join(FREQUENCIES)))
+    # the end of the range defaults to the end of today, so that repeated queries share a cache entry for the day
+    today = today or gitparser.utcnow().date()
+    end = parse_date(params['end'], 'end') if 'end' in params else \
+        datetime.datetime(today.year, today.month, today.day) + datetime.timedelta(days=1)
+    start = parse_date(params['start'], 'start') if 'start' in params else \
+        end - datetime.timedelta(days=DEFAULT_DAYS)
+    if start >= end:
+        raise QueryError('start must be before end')
+    return metric, authors, frequency, start, end
+
+
+def to_list(series):
+    return [None if pd.isna(value) else value.item() if hasattr(value, 'item') else value for value in series]
+
+
+def compute_metric(pr_df, commit_df, metric, authors, frequency, start, end):
+    """ Computes a metric per bucket, as plotted by graphs
+    :param pd.DataFrame pr_df: the pull request dataframe
+    :param pd.DataFrame commit_df: the commit dataframe
+    :param str metric: one of METRICS
+    :param tuple[str] authors: the authors to include, all if empty
+    :param str frequency: the bucket frequency, one of FREQUENCIES
+    :param datetime.datetime start: the start of the date range
+    :param datetime.datetime end: the end of the date range
+    :return: a json serialisable dict holding the buckets and the values per author, reviewer or statistic
+    :rtype: dict
+    """
+    xticks, ranges, _ = aggregation.generate_xticks(start, frequency, end)
+    name, _ = MEAN_METRICS.get(metric) or SUM_METRICS.get(metric) or ('prs', None)
+    df = pr_df if 'prs' == name else commit_df
+    # compare as in aggregation.daterange_buckets, whether or not the index is timezone aware
+    dates = df.index.values.astype('datetime64[ns]')
+    df = df[(dates >= np.datetime64(start)) & (dates < np.datetime64(end))]
+    author_column = df[gitparser.AUTHOR].astype(str)
+    if authors:
+        selected = author_column.isin(authors).values
+        df, author_column = df[selected], author_column[selected]
+    buckets = aggregation.daterange_buckets(df.index, xticks, ranges)
+    result = {'metric': metric, 'frequency': frequency, 'buckets': [x.strftime(DATE_FORMAT) for x in xticks]}
+
+    if metric in MEAN_METRICS:
+        grouped = df.groupby(buckets)[MEAN_METRICS[metric][1]]
+        result['mean'] = to_list(grouped.mean().reindex(xticks))
+        result['std'] = to_list(grouped.std().reindex(xticks))
+    elif REVIEW_METRIC == metric:
+        edges = aggregation.review_edges(df)
+        reviewers = edges[gitparser.REVIEWER].astype(str)
+        reviews = edges.groupby([aggregation.daterange_buckets(edges.index, xticks, ranges), reviewers.values]).size()
+        reviews = aggregation.author_matrix(reviews.rename_axis([None, gitparser.REVIEWER]), xticks,
+                                            sorted(set(reviewers)), level=gitparser.REVIEWER)
+        result['values'] = {reviewer: to_list(reviews[reviewer]) for reviewer in reviews.columns
+                            if reviews[reviewer].any()}
+    else:
+        column = SUM_METRICS[metric][1]
+        grouped = df.groupby([buckets, author_column.values])
+        values = grouped.size() if column is None else grouped[column].sum()
+        values = aggregation.author_matrix(values.rename_axis([None, gitparser.AUTHOR]), xticks,
+                                           sorted(set(author_column)))
+        result['values'] = {author: to_list(values[author]) for author in values.columns}
+    return result
+
+
+class MetricStore(object):
+    """ The dataframes the api queries, with a least recently used cache of responses which is cleared whenever the
+    dataframes change
+    """
+
+    def __init__(self, output=None, maxsize=CACHE_SIZE):
+        """
+        :param str output: optional directory of the saved dataframes, which are reloaded when they change on disk
+        :param int maxsize: the maximum number of cached responses
+        """
+        self.output = output
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        # held while reloading, so that concurrent requests reload at most once, see refresh
+        self.reload_lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.version = 0
+        self.mtimes = None
+        self.pr_df = None
+        self.commit_df = None
+        self.no_hits = self.no_misses = 0
+
+    def update(self, pr_df, commit_df):
+        """ Replaces the dataframes, e.g. after ingesting new commits, and invalidates all cached responses """
+        with self.lock:
+            self.pr_df, self.commit_df = pr_df, commit_df
+            self.cache.clear()
+            self.version += 1
+
+    def read_mtimes(self):
+        """ Reads the modification times of the saved dataframes
+        :return: the times, or None if a dataframe is missing
+        :rtype: tuple[float, float]
+        """
+        try:
+            return tuple(os.path.getmtime(storage.compute_path(self.output, name)) for name in ['prs', 'commits'])
+        except OSError:
+            return None
+
+    def refresh(self):
+        """ Reloads the saved dataframes if they changed on disk since they were loaded, keeping the loaded ones if the
+        saved ones cannot be read, e.g. while they are replaced
+        """
+        if self.output is None or self.read_mtimes() in (None, self.mtimes):
+            return
+        with self.reload_lock:
+            # another request may have reloaded them meanwhile
+            mtimes = self.read_mtimes()
+            if mtimes in (None, self.mtimes):
+                return
+            logging.info('Loading dataframes from {output}'.format(output=self.output))
+            try:
+                pr_df, commit_df = storage.load_df(self.output, 'prs'), storage.load_df(self.output, 'commits')
+            except (OSError, ValueError) as e:
+                logging.warning('Could not load the dataframes from {output}: {error}'.format(output=self.output,
+                                                                                                error=e))
+                return
+            if pr_df is None or commit_df is None:
+                return
+            self.update(storage.apply_dtypes(pr_df).sort_index(), storage.apply_dtypes(commit_df).sort_index())
+            self.mtimes = mtimes
+
+    def index(self):
+        """ Lists the metrics and authors which can be queried
+        :rtype: dict
+        """
+        self.refresh()
+        pr_df, commit_df = self.pr_df, self.commit_df
+        if pr_df is None:
+            raise QueryError('No commits have been ingested yet', status=503)
+        authors = set(pr_df[gitparser.AUTHOR].astype(str)) | set(commit_df[gitparser.AUTHOR].astype(str))
+        return {'metrics': METRICS, 'frequencies': FREQUENCIES, 'authors': sorted(authors)}
+
+    def query(self, key):
+        """ Answers a query from the cache, computing and caching it on a miss
+        :param tuple key: the normalised query, see parse_query
+        :return: the json encoded response
+        :rtype: bytes
+        """
+        self.refresh()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.no_hits += 1
+                return self.cache[key]
+            version, pr_df, commit_df = self.version, self.pr_df, self.commit_df
+            self.no_misses += 1
+        if pr_df is None:
+            raise QueryError('No commits have been ingested yet', status=503)
+
+        response = json.dumps(compute_metric(pr_df, commit_df, *key)).encode('utf-8')
+        with self.lock:
+            # responses computed from replaced dataframes are not cached
+            if version == self.version:
+                self.cache[key] = response
+                if len(self.cache) > self.maxsize:
+                    self.cache.popitem(last=False)
+        return response
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """ Answers GET requests from the MetricStore of its server """
+
+    def do_GET(self):
+        try:
+            if urlsplit(self.path).path.rstrip('/') + '/' == API_PREFIX:
+                body = json.dumps(self.server.store.index()).encode('utf-8')
+            else:
+                body = self.server.store.query(parse_query(self.path))
+            self.respond(200, body)
+        except QueryError as e:
+            self.respond(e.status, json.dumps({'error': str(e)}).encode('utf-8'))
+        except Exception:
+            logging.exception('Could not answer {path}'.format(path=self.path))
+            self.respond(500, json.dumps({'error': 'Internal error'}).encode('utf-8'))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+def create_server(store, host='127.0.0.1', port=8080):
+    """ Creates a server answering api requests from the given store in a thread per request
+    :param MetricStore store: the dataframes to query
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def start_server(store, host='127.0.0.1', port=8080):
+    """ Serves api requests from the given store in a background thread
+    :param MetricStore store: the dataframes to query
+    :rtype: ThreadingHTTPServer
+    """
+    server = create_server(store, host, port)
+    threading.Thread(target=server.serve_forever, name='api', daemon=True).start()
+    logging.info('Serving api at http://{host}:{port}{prefix}'.format(host=host, port=port, prefix=API_PREFIX))
+    return server
+
+
+@click.command()
+@click.option('--output', required=True, help='Serve the dataframes saved to the given directory')
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', type=int, default=8080, help='Port to listen on')
+def serve(output, host='127.0.0.1', port=8080):
+    store = MetricStore(output)
+    store.refresh()
+    if store.pr_df is None:
+        raise click.ClickException('No dataframes found in {output}'.format(output=output))
+    logging.info('Serving api at http://{host}:{port}{prefix}'.format(host=host, port=port, prefix=API_PREFIX))
+    create_server(store, host, port).serve_forever()
+
+
+if __name__ == '__main__':
+    serve()
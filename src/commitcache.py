@@ -0,0 +1,109 @@
+""" An on-disk cache of parsed commit and pull request records, keyed by commit hash
+
+A commit never changes once its hash exists, so its record is parsed once and reused by every later run, and by every
+repository sharing its history. git is only asked to log the commits missing from the cache, see stream_cached.
+Commits which git logged but which yielded no record, e.g. merges without a pull request, are cached as such. Nothing
+is cached from a git log which failed, as it may have ended early.
+"""
+import json
+import logging
+import sqlite3
+
+import gitlog
+import gitparser
+import profiling
+
+CACHE_FILENAME = 'records.sqlite'
+# bumped whenever the records change, which empties caches of earlier versions
+SCHEMA_VERSION = 2
+# seconds to wait for another process writing to the cache
+TIMEOUT = 60
+# hashes per query, below the limit of sqlite on bound parameters
+QUERY_SIZE = 500
+RECORD_TYPES = {'prs': gitparser.PullRequest, 'commits': gitparser.Commit}
+
+
+class CommitCache(object):
+    """ Records per kind and commit hash in a sqlite database """
+
+    def __init__(self, path):
+        """
+        :param str path: the database file, created if missing
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=TIMEOUT)
+        # readers do not block the writer, e.g. runs of the scheduler sharing a cache
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        with self.connection:
+            if version != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS records')
+                self.connection.execute('PRAGMA user_version = {version:d}'.format(version=SCHEMA_VERSION))
+            self.connection.execute('CREATE TABLE IF NOT EXISTS records '
+                                    '(kind TEXT NOT NULL, hash TEXT NOT NULL, record TEXT, PRIMARY KEY (kind, hash)) '
+                                    'WITHOUT ROWID')
+
+    def load(self, kind, hashes):
+        """ Loads the cached records of the given commits
+        :param str kind: the kind of records, e.g. 'commits:stat'
+        :param list[str] hashes: the commit hashes
+        :return: the record per cached hash, None for commits which yielded no record
+        :rtype: dict[str, list]
+        """
+        records = {}
+        for i in range(0, len(hashes), QUERY_SIZE):
+            chunk = hashes[i:i + QUERY_SIZE]
+            rows = self.connection.execute(
+                'SELECT hash, record FROM records WHERE kind = ? AND hash IN ({params})'.format(
+                    params=', '.join('?' * len(chunk))), [kind] + chunk)
+            records.update((commit_hash, None if record is None else json.loads(record))
+                           for commit_hash, record in rows)
+        return records
+
+    def store(self, kind, records):
+        """ Stores the records of the given commits
+        :param str kind: the kind of records, e.g. 'commits:stat'
+        :param dict[str, list] records: the fields of the record per hash, None for commits which yielded no record
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO records (kind, hash, record) VALUES (?, ?, ?)',
+                [(kind, commit_hash, None if record is None else json.dumps(list(record)))
+                 for commit_hash, record in records.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+def stream_cached(cache_path, kind, rev_list_args, stream_fn, directory=None):
+    """ Reads the records of the commits selected by the given rev-list arguments, from the cache where possible
+    :param str cache_path: the cache database, see CommitCache
+    :param str kind: the kind of records, one of RECORD_TYPES, optionally suffixed with the parser, e.g. 'commits:stat'
+    :param list[str] rev_list_args: the git rev-list arguments selecting the commits, e.g. gitlog.COMMIT_REV_LIST_ARGS
+    :param stream_fn: function streaming the records of the given list of hashes and recording the outcome of git in the
+        given gitlog.LogStatus, e.g. main.stream_commits
+    :param str directory: the repository, defaults to the current directory
+    :return: the records, in the order of rev-list
+    :rtype: list
+    """
+    record_type = RECORD_TYPES[kind.split(':')[0]]
+    hashes = gitlog.list_commits(rev_list_args, directory)
+    cache = CommitCache(cache_path)
+    try:
+        with profiling.span('cache', rows=len(hashes), kind=kind):
+            records = cache.load(kind, hashes)
+        missing = [commit_hash for commit_hash in hashes if commit_hash not in records]
+        logging.info('Found {no_cached:d} of {no_commits:d} {kind} in the cache'.format(
+            no_cached=len(hashes) - len(missing), no_commits=len(hashes), kind=kind))
+        if missing:
+            status = gitlog.LogStatus()
+            parsed = {record.commit_hash: list(record) for record in stream_fn(hashes=missing, status=status)}
+            records.update(parsed)
+            if status.succeeded:
+                cache.store(kind, {commit_hash: parsed.get(commit_hash) for commit_hash in missing
+                                   if commit_hash in status.hashes})
+            else:
+                logging.warning('Not caching the {kind} of a failed git log'.format(kind=kind))
+    finally:
+        cache.close()
+    return [record_type(*records[commit_hash]) for commit_hash in hashes if records.get(commit_hash) is not None]
@@ -0,0 +1,217 @@
+""" Long running mode: keeps the dataframes in memory and regenerates the site as soon as a repository changes """
+import logging
+import os
+import time
+
+import click
+
+import api
+import gitlog
+import gitparser
+import main
+import profiling
+import util
+
+logging.basicConfig(level=logging.INFO)
+
+
+def compute_changed_authors(old_df, new_df):
+    """ Finds the authors of records which were added or removed between two versions of a dataframe
+    :param pd.DataFrame old_df: the previous dataframe, or None
+    :param pd.DataFrame new_df: the updated dataframe
+    :return: the date of the latest changed record per changed author, or None if there is no previous dataframe to
+        compare with
+    :rtype: dict[str, datetime.datetime]
+    """
+    if old_df is None:
+        return None
+    added = new_df[~new_df[gitparser.HASH].isin(old_df[gitparser.HASH])]
+    removed = old_df[~old_df[gitparser.HASH].isin(new_df[gitparser.HASH])]
+    return merge_changed_authors(*[df.index.to_series().groupby(df[gitparser.AUTHOR].astype(str).values).max().to_dict()
+                                   for df in [added, removed]])
+
+
+def merge_changed_authors(*changes):
+    """ Merges the changed authors of several dataframes or runs, see compute_changed_authors
+    :param dict[str, datetime.datetime] changes: the date of the latest changed record per author
+    :rtype: dict[str, datetime.datetime]
+    """
+    merged = {}
+    for change in changes:
+        for author, date in change.items():
+            merged[author] = max(date, merged.get(author, date))
+    return merged
+
+
+class Daemon(object):
+    """ Watches the refs of the given repositories, ingests new commits incrementally and regenerates the views of the
+    authors they affect, along with the team views
+    """
+
+    def __init__(self, directory, output, srcpath, backend='stat', output_mode='static', plotgraphs=True,
+                 csv=False, jobs=1, store=None, titles=True, cache_path=None):
+        """
+        :param str directory: comma separated repository paths
+        :param str output: the directory to write the site and dataframes to
+        :param str srcpath: the installation directory holding the templates
+        :param str backend: the git log parser, see main.stream_commits
+        :param str output_mode: the site to generate, see main.generate_site
+        :param bool plotgraphs: False to write the pages only
+        :param bool csv: True to also export the dataframes as csv
+        :param int jobs: the maximum number of worker processes to ingest repositories and render charts with
+        :param api.MetricStore store: optional api store to update with the ingested dataframes
+        :param bool titles: False to drop the commit and pull request titles from the dataframes
+        :param str cache_path: optional cache of parsed commits, see commitcache
+        """
+        self.directory = directory
+        self.repos = [os.path.abspath(d) for d in directory.split(',')]
+        self.output = output
+        self.srcpath = srcpath
+        self.backend = backend
+        self.output_mode = output_mode
+        self.plotgraphs = plotgraphs
+        self.csv = csv
+        self.jobs = jobs
+        self.store = store
+        self.titles = titles
+        self.cache_path = cache_path
+        self.pr_df = None
+        self.commit_df = None
+        # pull requests ingested by a run whose commits could not be ingested, see ingest
+        self.pending_pr_df = None
+        self.refs = {}
+        self.recent_authors = None
+        self.generated_on = None
+        # the latest changed record per author whose records changed since the site was last generated, None for all
+        self.changed_authors = None
+
+    def poll_refs(self):
+        """ Reads the ref tips of all repositories
+        :return: the refs per repository
+        :rtype: dict[str, dict[str, str]]
+        """
+        return {repo: gitlog.read_refs(repo) for repo in self.repos}
+
+    def ingest(self):
+        """ Ingests the commits made since the last ingestion, see main.update_df
+        The dataframes are only replaced once both are ingested, so that a failed run is compared with the dataframes
+        of the last successful one when retried.
+        :return: the date of the latest changed record per changed author, or None if all records are new
+        :rtype: dict[str, datetime.datetime]
+        """
+        # the ingestion state already covers the pull requests of a run which failed to ingest the commits
+        pr_df = self.pr_df if self.pending_pr_df is None else self.pending_pr_df
+        pr_df = main.fetch_pr_df(self.directory, self.output, False, self.backend, True, self.csv, self.jobs,
+                                 pr_df, self.titles, self.cache_path).sort_index()
+        self.pending_pr_df = pr_df
+        commit_df = main.fetch_commit_df(self.directory, self.output, False, self.backend, True, self.csv,
+                                         self.jobs, self.commit_df, self.titles, self.cache_path).sort_index()
+        self.pending_pr_df = None
+
+        pr_authors = compute_changed_authors(self.pr_df, pr_df)
+        commit_authors = compute_changed_authors(self.commit_df, commit_df)
+        self.pr_df, self.commit_df = pr_df, commit_df
+        if self.store is not None:
+            self.store.update(self.pr_df, self.commit_df)
+        if pr_authors is None or commit_authors is None:
+            return None
+        return merge_changed_authors(pr_authors, commit_authors)
+
+    def generate(self, changed_authors=None):
+        """ Regenerates the team views and the views of the given authors, of the timeframes holding changed records
+        All views are regenerated if the recent authors, and thereby the navigation of every page, changed or if the
+        date changed, which moves the date ranges of every view.
+        :param dict[str, datetime.datetime] changed_authors: the latest changed record per changed author, None for all
+        """
+        recent_authors = main.compute_recent_authors(self.pr_df)
+        today = gitparser.utcnow().date()
+        authors = last_changes = None
+        if changed_authors is not None and recent_authors == self.recent_authors and today == self.generated_on:
+            authors = [author for author in recent_authors if author in changed_authors]
+            last_changes = changed_authors
+        logging.info('Regenerating team views and views of {authors}'.format(
+            authors='all authors' if authors is None else '{no_authors:d} authors'.format(no_authors=len(authors))))
+
+        main.generate_site(self.pr_df, self.commit_df, self.output, self.srcpath,
+                           os.path.basename(self.directory), util.read_config('server')['url'], recent_authors,
+                           self.plotgraphs, self.output_mode, self.jobs, authors, last_changes)
+        self.recent_authors = recent_authors
+        self.generated_on = today
+
+    def run_once(self):
+        """ Regenerates the site if any repository changed, or the date changed, since the last run
+        :return: True if the site was regenerated
+        :rtype: bool
+        """
+        refs = self.poll_refs()
+        refs_changed = refs != self.refs
+        if not refs_changed and self.generated_on == gitparser.utcnow().date():
+            return False
+        # a profile per run, see profiling
+        profiling.reset()
+        try:
+            with profiling.span('run', directory=self.directory):
+                if refs_changed:
+                    changed_authors = self.ingest()
+                    if changed_authors is None or self.changed_authors is None:
+                        self.changed_authors = None
+                    else:
+                        self.changed_authors = merge_changed_authors(self.changed_authors, changed_authors)
+                self.generate(self.changed_authors)
+        finally:
+            profiling.write_profile(self.output)
+        # only now, so that a failed run is retried at the next poll
+        self.changed_authors = {}
+        self.refs = refs
+        return True
+
+    def run(self, interval):
+        """ Polls the repositories until interrupted
+        :param float interval: the number of seconds between polls
+        """
+        logging.info('Watching {no_repos:d} repositories every {interval:g}s'.format(
+            no_repos=len(self.repos), interval=interval))
+        while True:
+            start = time.time()
+            try:
+                if self.run_once():
+                    logging.info('Regenerated site in {duration:.1f}s'.format(duration=time.time() - start))
+            except Exception:
+                # keep serving the last site, e.g. while a repository is being garbage collected
+                logging.exception('Could not regenerate site')
+            time.sleep(max(0.0, interval - (time.time() - start)))
+
+
+@click.command()
+@click.option('--directory', required=True, help='Assess quality of the repo at the given path')
+@click.option('--output', required=True, help='Save graphs and stats to the given directory')
+@click.option('--srcpath')
+@click.option('--interval', type=float, default=60, help='Seconds between polls of the repositories\' refs')
+@click.option('--plotgraphs/--no-plotgraphs', default=True)
+@click.option('--backend', type=click.Choice(['stat', 'format']), default='stat',
+              help='Parse the human readable git log (stat) or machine readable git log output (format)')
+@click.option('--csv', is_flag=True, help='Also export the dataframes as csv')
+@click.option('--jobs', type=int, default=1,
+              help='Number of worker processes to ingest repositories and render charts with')
+@click.option('--output-mode', type=click.Choice(['static', 'dashboard']), default='static',
+              help='Render a page with charts per view, timeframe and author (static) or write a single data file '
+                   'and a page drawing all charts in the browser (dashboard)')
+@click.option('--api-port', type=int, help='Also answer metric queries over http on this port, see api')
+@click.option('--api-host', default='127.0.0.1', help='Address the api listens on')
+@click.option('--titles/--no-titles', default=True,
+              help='Keep the commit and pull request titles in the dataframes, which no chart shows')
+@click.option('--cache', help='Keep the parsed commits in this file, which repositories sharing history can share, '
+                              'defaults to the output directory')
+@click.option('--no-cache', is_flag=True, help='Parse every commit, without reading or writing the cache')
+def serve(directory, output, srcpath='/opt/git-quality', interval=60, plotgraphs=True, backend='stat', csv=False,
+          jobs=1, output_mode='static', api_port=None, api_host='127.0.0.1', titles=True, cache=None, no_cache=False):
+    store = None
+    if api_port is not None:
+        store = api.MetricStore()
+        api.start_server(store, api_host, api_port)
+    Daemon(directory, output, srcpath, backend, output_mode, plotgraphs, csv, jobs, store, titles,
+           main.compute_cache_path(output, cache, no_cache)).run(interval)
+
+
+if __name__ == '__main__':
+    serve()
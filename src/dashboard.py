@@ -0,0 +1,121 @@
+""" Functions for the client side dashboard: a single page which draws the charts of all views from one data file
+
+Instead of a directory with rendered charts per view, timeframe and author, the statistics of the aggregation cubes are
+written once as column oriented tables, see compute_bundle. The page filters and sums them in the browser.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import gitparser
+import sitefiles
+
+DATA_FILENAME = 'data.json'
+# templates copied next to the page, besides sitefiles.STATIC_ASSETS
+DASHBOARD_ASSETS = ['dashboard.js']
+
+
+def compute_timeframe_key(timeframe, timeframe_text):
+    return timeframe.rstrip('/') or timeframe_text.replace(' ', '_')
+
+
+def encode_table(df, buckets, author_ids, key_columns=(gitparser.AUTHOR,)):
+    """ Converts a (bucket, author, ...) indexed frame of counts to columns of integers
+    :param pd.DataFrame df: the frame to convert, e.g. aggregation.Cube.commits
+    :param list[datetime.datetime] buckets: the buckets of the widest range, rows are encoded by their position
+    :param dict[str, int] author_ids: position of each author, key columns are encoded by these
+    :param tuple[str] key_columns: the index levels after the bucket holding names
+    :return: lists keyed by column name, 'bucket' first
+    :rtype: dict[str, list[int]]
+    """
+    df = df.reset_index()
+    bucket_column = df.columns[0]
+    table = {'bucket': pd.Index(buckets).get_indexer(df[bucket_column]).tolist()}
+    for column in key_columns:
+        table[column] = [author_ids[name] for name in df[column].astype(str)]
+    for column in df.columns[1 + len(key_columns):]:
+        table[column] = df[column].fillna(0).astype(np.int64).tolist()
+    return table
+
+
+def compute_frequency_tables(cube, buckets, author_ids):
+    """ Encodes the statistics of a cube, see encode_table
+    :param aggregation.Cube cube: the aggregated statistics of one frequency
+    :rtype: dict[str, dict[str, list[int]]]
+    """
+    return {'prs': encode_table(cube.prs.rename('count'), buckets, author_ids),
+            'no_reviews': encode_table(cube.no_reviews, buckets, author_ids),
+            'reviews': encode_table(cube.reviews.rename('count'), buckets, author_ids,
+                                    (gitparser.AUTHOR, gitparser.REVIEWER)),
+            'commits': encode_table(cube.commits, buckets, author_ids),
+            'code_changes': encode_table(cube.code_changes, buckets, author_ids)}
+
+
+def compute_bundle(cubes, start_date, dateranges, views, recent_authors, name):
+    """ Collects everything the dashboard draws for all views, timeframes and authors
+    :param dict[str, aggregation.Cube] cubes: the aggregated statistics per frequency
+    :param datetime.datetime start_date: the start of the widest timeframe, which the cubes were built for
+    :param dateranges: tuples of start date, directory and text per timeframe, see main.compute_dateranges
+    :param views: tuples of directory, frequency and text per view
+    :param list[str] recent_authors: the authors of the team view, who are also the reviewers shown
+    :param str name: the name of the repository
+    :return: a json serialisable dict
+    :rtype: dict
+    """
+    cube = next(iter(cubes.values()))
+    authors = set(recent_authors) | set(cube.commit_authors)
+    for c in cubes.values():
+        authors.update(c.prs.index.get_level_values(gitparser.AUTHOR).astype(str))
+        authors.update(c.reviews.index.get_level_values(gitparser.REVIEWER))
+    authors = sorted(authors)
+    author_ids = {author: i for i, author in enumerate(authors)}
+
+    frequencies = {}
+    for _, frequency, _ in views:
+        buckets, _ = cubes[frequency].xticks(start_date)
+        frequencies[frequency] = {
+            'buckets': [b.strftime('%Y-%m-%dT%H:%M:%S') for b in buckets],
+            'tables': compute_frequency_tables(cubes[frequency], buckets, author_ids)}
+
+    # a narrower timeframe shows the most recent buckets of the widest one
+    timeframes = [{'key': compute_timeframe_key(timeframe, timeframe_text), 'text': timeframe_text,
+                   'buckets': {frequency: len(cubes[frequency].xticks(date_from)[0]) for _, frequency, _ in views}}
+                  for date_from, timeframe, timeframe_text in dateranges]
+
+    punchcards = {}
+    for author in set(cube.commit_authors):
+        punchcards[author_ids[author]] = cube.punchcard_grid([author]).ravel().tolist()
+
+    return {'name': name,
+            'authors': authors,
+            'recent_authors': [author_ids[author] for author in recent_authors],
+            'views': [{'frequency': frequency, 'text': view_text} for _, frequency, view_text in views],
+            'timeframes': timeframes,
+            'frequencies': frequencies,
+            'punchcards': punchcards}
+
+
+def write_dashboard(bundle, output, srcpath, home_url):
+    """ Writes the data file and the dashboard page to the given directory
+    :param dict bundle: the statistics to draw, see compute_bundle
+    :param str output: the directory to write to
+    :param str srcpath: the installation directory holding the templates
+    :param str home_url: the url the output directory is served at
+    """
+    writer = sitefiles.SiteWriter(output)
+    writer.copy_static_assets(srcpath)
+    data_path = os.path.join(output, DATA_FILENAME)
+    writer.write(data_path, json.dumps(bundle, separators=(',', ':')))
+    logging.info('Wrote dashboard data of {size:d} bytes to {path}'.format(
+        size=os.path.getsize(data_path), path=data_path))
+
+    for asset in DASHBOARD_ASSETS:
+        with open(os.path.join(srcpath, 'templates', asset), 'rb') as f:
+            writer.write(os.path.join(output, asset), f.read())
+    with open(os.path.join(srcpath, 'templates', 'dashboard.html'), 'r') as f:
+        page_text = f.read()
+    writer.write(os.path.join(output, 'index.html'), page_text.format(name=bundle['name'], home_url=home_url))
+    writer.log_stats()
@@ -0,0 +1,149 @@
+""" Functions for parsing machine readable git log output, see gitlog.PRETTY_FORMAT
+
+Each record holds the fields hash, author, date, subject and body separated by gitlog.FIELD_SEPARATOR, followed by
+the NUL separated --numstat -z entries. Fields are split at fixed positions, so no regular expressions are needed.
+"""
+import logging
+
+import gitlog
+import profiling
+from gitparser import Commit, PullRequest, parse_raw_date
+
+logger1 = logging.getLogger('git format parser')
+
+PR_SUBJECT_PREFIX = 'Merged in '
+PR_SUBJECT_MARKER = '(pull request #'
+REVIEWER_PREFIX = 'Approved-by:'
+CODE_FILE_SUFFIX = '.py'
+
+
+def split_record(record):
+    """ Splits a formatted commit record into its fields
+    :param str record: the record to split, without the record separator
+    :return: tuple of hash, author, date, subject, body and the raw numstat text
+    :rtype: tuple[str, str, str, str, str, str]
+    """
+    fields = record.split(gitlog.FIELD_SEPARATOR, 5)
+    if len(fields) != 6:
+        raise ValueError('Expected 6 fields but found {no_fields}'.format(no_fields=len(fields)))
+    return tuple(fields)
+
+
+def parse_reviewers(body):
+    """ Parses the Approved-by trailers of a commit body
+    :param str body: the commit message body
+    :return: the names of the approving reviewers
+    :rtype: list[str]
+    """
+    reviewers = []
+    for line in body.splitlines():
+        line = line.strip()
+        if line.startswith(REVIEWER_PREFIX):
+            reviewers.append(line[len(REVIEWER_PREFIX):].split('<', 1)[0].strip())
+    return reviewers
+
+
+def parse_numstat(text):
+    """ Parses the --numstat -z section of a record
+    :param str text: the numstat text
+    :return: tuple of files, insertions, deletions, code files and code changes
+    :rtype: tuple[int, int, int, int, int]
+    """
+    files = insertions = deletions = code_files = code_changes = 0
+    entries = text.lstrip('\n').split('\0')
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        added, deleted, path = entry.split('\t', 2)
+        if not path:
+            # renames and copies are followed by the source and destination paths
+            path = entries[i + 1] if i + 1 < len(entries) else ''
+            i += 2
+        # binary files are reported as '-'
+        added = 0 if '-' == added else int(added)
+        deleted = 0 if '-' == deleted else int(deleted)
+        files += 1
+        insertions += added
+        deletions += deleted
+        if path.endswith(CODE_FILE_SUFFIX):
+            code_files += 1
+            code_changes += added + deleted
+    return files, insertions, deletions, code_files, code_changes
+
+
+def parse_pull_request(record):
+    """ Parses the given formatted record
+    :param str record: the record to parse
+    :return: a PullRequest with extracted relevant fields, or None if the commit is not a pull request merge
+    :rtype: PullRequest
+    """
+    commit_hash, author, date, subject, body, _ = split_record(record)
+    reviewers = parse_reviewers(body)
+    if subject.startswith(PR_SUBJECT_PREFIX) and PR_SUBJECT_MARKER in subject:
+        # bitbucket merge, the pull request title is the first line of the body
+        title = body.strip().split('\n', 1)[0].strip()
+    elif reviewers:
+        # squash merge
+        title = subject.strip()
+    else:
+        return None
+    # no self reviews allowed in these stats
+    try:
+        reviewers.remove(author)
+    except ValueError:
+        pass
+    return PullRequest(commit_hash, author, *parse_raw_date(date), title, reviewers, len(reviewers))
+
+
+def parse_commit(record):
+    """ Parses the given formatted record
+    :param str record: the record to parse
+    :return: a Commit with extracted relevant fields, or None if the commit is a squash merge
+    :rtype: Commit
+    """
+    commit_hash, author, date, subject, body, numstat = split_record(record)
+    if REVIEWER_PREFIX in body:
+        return None
+    return Commit(commit_hash, author, *parse_raw_date(date), subject.strip(), *parse_numstat(numstat))
+
+
+def _stream(records, parse_fn, name):
+    no_records = no_results = no_errors = 0
+    # only the parsing is timed, as in gitparser.stream_commits
+    with profiling.stopwatch('parse', records=name) as s, profiling.sampling('parse'):
+        for record in records:
+            no_records += 1
+            try:
+                with s.running():
+                    result = parse_fn(record)
+            except ValueError as e:
+                no_errors += 1
+                logger1.warning('Could not parse record {record!r}: {error}'.format(record=record[:40], error=e))
+                continue
+            if result is not None:
+                no_results += 1
+                yield result
+        s.rows = no_records
+    logger1.info('Extracted {no_results} {name} from {no_records} records, {no_errors} malformed'.format(
+        no_results=no_results, name=name, no_records=no_records, no_errors=no_errors))
+
+
+def stream_pull_requests(records):
+    """ Lazily extracts PullRequests from the given formatted records
+    :param collections.Iterable[str] records: the records, e.g. from gitlog.stream_records
+    :return: a generator of pull request merge commits
+    :rtype: collections.Iterator[PullRequest]
+    """
+    return _stream(records, parse_pull_request, 'PRs')
+
+
+def stream_commits(records):
+    """ Lazily extracts Commits from the given formatted records
+    :param collections.Iterable[str] records: the records, e.g. from gitlog.stream_records
+    :return: a generator of commits
+    :rtype: collections.Iterator[Commit]
+    """
+    return _stream(records, parse_commit, 'commits')
@@ -0,0 +1,193 @@
+""" Functions for running git and streaming its output """
+import logging
+import subprocess
+
+import profiling
+
+logger1 = logging.getLogger('git log')
+
+# git log invocations for pull request merges and for regular commits, dates are printed as the seconds since the
+# epoch and the timezone offset, see gitparser.parse_raw_date
+PR_LOG_ARGS = ['log', '--use-mailmap', '--date=raw']
+COMMIT_LOG_ARGS = ['log', '--use-mailmap', '--no-merges', '--all', '--stat', '--date=raw']
+
+# machine readable equivalents, see formatparser
+RECORD_SEPARATOR = '\x1e'
+FIELD_SEPARATOR = '\x1f'
+PRETTY_FORMAT = '--pretty=format:%x1e%H%x1f%aN%x1f%ad%x1f%s%x1f%b%x1f'
+FORMAT_PR_LOG_ARGS = ['log', '--use-mailmap', '-z', '--date=raw', PRETTY_FORMAT]
+FORMAT_COMMIT_LOG_ARGS = ['log', '--use-mailmap', '--no-merges', '--all', '--numstat', '-z', '--date=raw',
+                          PRETTY_FORMAT]
+
+# git rev-list invocations listing the commits the log invocations above read, without computing their diffs
+PR_REV_LIST_ARGS = ['rev-list']
+COMMIT_REV_LIST_ARGS = ['rev-list', '--no-merges', '--all']
+
+
+class LogStatus(object):
+    """ The outcome of a git log streamed by stream_log or stream_records, e.g. to cache the records of complete logs
+    only, see commitcache.stream_cached
+    """
+
+    def __init__(self):
+        # the hashes of the commits git logged, whether or not they are parsed to a record
+        self.hashes = set()
+        self.return_code = None
+
+    @property
+    def succeeded(self):
+        return 0 == self.return_code
+
+
+def select_commits(args):
+    """ Turns git log arguments into ones logging only the commits given on stdin, see stream_log
+    :param list[str] args: the git log arguments, e.g. COMMIT_LOG_ARGS
+    :rtype: list[str]
+    """
+    return [arg for arg in args if '--all' != arg] + ['--no-walk', '--stdin']
+
+
+def list_commits(args, directory=None):
+    """ Lists the hashes of the commits selected by the given rev-list arguments
+    :param list[str] args: the git arguments, e.g. COMMIT_REV_LIST_ARGS with revisions
+    :param str directory: the repository to run git in, defaults to the current directory
+    :rtype: list[str]
+    """
+    with profiling.span('fetch', command=' '.join(args), directory=directory) as s:
+        process = subprocess.run(['git'] + list(args), stdout=subprocess.PIPE, cwd=directory, universal_newlines=True)
+        if process.returncode != 0:
+            # e.g. no commits yet, as git log
+            logger1.warning('git {args} exited with code {code}'.format(args=' '.join(args), code=process.returncode))
+        hashes = process.stdout.split()
+        s.rows = len(hashes)
+    return hashes
+
+
+def start_git(args, directory=None, stdin=None):
+    """ Starts git with the given arguments, writing the given lines to its stdin
+    git reads its revisions from stdin before writing any output, so all lines are written at once.
+    :param list[str] args: the git arguments
+    :param str directory: the repository to run git in, defaults to the current directory
+    :param list[str] stdin: optional lines to write to stdin, e.g. commit hashes for select_commits
+    :rtype: subprocess.Popen
+    """
+    process = subprocess.Popen(['git'] + list(args), stdout=subprocess.PIPE, cwd=directory,
+                               stdin=None if stdin is None else subprocess.PIPE, universal_newlines=True,
+                               errors='replace')
+    if stdin is not None:
+        process.stdin.write(''.join(line + '\n' for line in stdin))
+        process.stdin.close()
+    return process
+
+
+def stream_log(args, directory=None, stdin=None, status=None):
+    """ Runs git with the given arguments and yields its output line by line
+    :param list[str] args: the git arguments, e.g. PR_LOG_ARGS
+    :param str directory: the repository to run git in, defaults to the current directory
+    :param list[str] stdin: optional lines to write to the stdin of git, see start_git
+    :param LogStatus status: optional status to record the logged commits and the exit code of git in
+    :return: a generator over the output lines, including line endings
+    :rtype: collections.Iterator[str]
+    """
+    # only waiting on git is timed, not the consumer parsing the lines, the child cpu time is the cpu time of git
+    with profiling.stopwatch('fetch', command=' '.join(args), directory=directory) as s:
+        with s.running():
+            process = start_git(args, directory, stdin)
+        s.rows = 0
+        try:
+            for line in profiling.timed(s, process.stdout):
+                s.rows += 1
+                if status is not None and line.startswith('commit '):
+                    status.hashes.add(line[7:47])
+                yield line
+        finally:
+            with s.running():
+                process.stdout.close()
+                return_code = process.wait()
+            if status is not None:
+                status.return_code = return_code
+            if return_code != 0:
+                logger1.warning('git {args} exited with code {code}'.format(args=' '.join(args), code=return_code))
+
+
+def stream_records(args, separator, directory=None, chunk_size=1 << 16, stdin=None, status=None):
+    """ Runs git with the given arguments and yields its output split on the given record separator
+    :param list[str] args: the git arguments
+    :param str separator: the string separating records, e.g. an ASCII record separator
+    :param str directory: the repository to run git in, defaults to the current directory
+    :param int chunk_size: the number of characters to read from git at a time
+    :param list[str] stdin: optional lines to write to the stdin of git, see start_git
+    :param LogStatus status: optional status to record the logged commits, the first field of PRETTY_FORMAT, and the
+        exit code of git in
+    :return: a generator over the non-empty records, excluding separators
+    :rtype: collections.Iterator[str]
+    """
+    # as stream_log, only waiting on git is timed
+    with profiling.stopwatch('fetch', command=' '.join(args), directory=directory) as s:
+        with s.running():
+            process = start_git(args, directory, stdin)
+        s.rows = 0
+        try:
+            pending = ''
+            for chunk in profiling.timed(s, iter(lambda: process.stdout.read(chunk_size), '')):
+                records = (pending + chunk).split(separator)
+                pending = records.pop()
+                for record in records:
+                    if record:
+                        s.rows += 1
+                        if status is not None:
+                            status.hashes.add(record.split(FIELD_SEPARATOR, 1)[0].strip())
+                        yield record
+            if pending:
+                s.rows += 1
+                if status is not None:
+                    status.hashes.add(pending.split(FIELD_SEPARATOR, 1)[0].strip())
+                yield pending
+        finally:
+            with s.running():
+                process.stdout.close()
+                return_code = process.wait()
+            if status is not None:
+                status.return_code = return_code
+            if return_code != 0:
+                logger1.warning('git {args} exited with code {code}'.format(args=' '.join(args), code=return_code))
+
+
+def read_refs(directory=None):
+    """ Reads the tips of all refs of the given repository
+    :param str directory: the repository, defaults to the current directory
+    :return: mapping of ref name to commit hash, including HEAD if it exists
+    :rtype: dict[str, str]
+    """
+    output = subprocess.check_output(['git', 'for-each-ref', '--format=%(objectname) %(refname)'],
+                                     cwd=directory, universal_newlines=True)
+    refs = dict(reversed(line.split(' ', 1)) for line in output.splitlines() if line)
+    head = read_head(directory)
+    if head is not None:
+        refs['HEAD'] = head
+    return refs
+
+
+def read_head(directory=None):
+    """ Reads the commit HEAD points to
+    :param str directory: the repository, defaults to the current directory
+    :return: the commit hash, or None if there are no commits yet
+    :rtype: str
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--verify', '-q', 'HEAD'],
+                                       cwd=directory, universal_newlines=True).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def is_ancestor(ancestor, descendant, directory=None):
+    """ Checks whether a commit is reachable from another, e.g. to detect rewritten history
+    :param str ancestor: hash of the older commit
+    :param str descendant: hash of the newer commit
+    :param str directory: the repository, defaults to the current directory
+    :return: True if ancestor is an ancestor of (or equal to) descendant
+    :rtype: bool
+    """
+    return 0 == subprocess.call(['git', 'merge-base', '--is-ancestor', ancestor, descendant],
+                                cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
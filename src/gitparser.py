@@ -1,12 +1,17 @@
 """ Functions for parsing git commit messages """
+import datetime
+import itertools
 import logging
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from operator import is_not
 
-import numpy as np
 from recordclass import recordclass
 
+import profiling
+
 logger1 = logging.getLogger('git log parser')
 
 # regular expressions for parsing git commit messages (bitbucket merges tested)
@@ -16,32 +21,45 @@ pr_regex = re.compile('pull request')
 author_regex = re.compile('Author:\s+([\w\s]*\w)\s?[\<\\n]')
 date_regex = re.compile('Date:\s+(.*)\n')
 pr_title_regex = re.compile('Merged in [\S]+ \(pull request #[\d]+\)\s+((\<[\w+\s]+\>)?[\w\s\d.]*)\s')
-squash_title_regex = re.compile('\+[01]{4}\n\s+([\S\s]+)\s+Approved-by')
-commit_title_regex = re.compile('\+\d{4}\s*(\S[\S\s.]*)\s*\d+\sfile')
+# titles follow the raw date line, whose timezone offset is negative west of UTC
+squash_title_regex = re.compile('Date:\s+\d+\s[+-]\d{4}\n\s+([\S\s]+)\s+Approved-by')
+commit_title_regex = re.compile('Date:\s+\d+\s[+-]\d{4}\s*(\S[\S\s.]*)\s*\d+\sfile')
 commit_files_regex = re.compile('(\d+)\sfile')
 commit_insertions_regex = re.compile('(\d+)\sinsertion')
 commit_deletions_regex = re.compile('(\d+)\sdeletion')
 code_files_regex = re.compile('\.py\s+\|\s(\d+)\s')
 reviewer_regex = re.compile('Approved-by:\s+([\w ]+)')
 
+# logs with fewer commits than this are parsed in-process, see parse_records
+PARALLEL_THRESHOLD = 20000
+# number of commits parsed per task by a worker process
+CHUNK_SIZE = 2000
+
 # indexing constants
 HASH = 'commit_hash'
 AUTHOR = 'author'
 DATE = 'date'
+# seconds since the epoch, and minutes the author's local time is ahead of UTC, see parse_raw_date
+TIMESTAMP = 'timestamp'
+TZ_OFFSET = 'tz_offset'
 NO_REVIEWS = 'no_reviews'
 REVIEWERS = 'reviewers'
+# a single reviewer of a pull request, see aggregation.review_edges
+REVIEWER = 'reviewer'
 TITLE = 'title'
 FILES = 'files'
 INSERTIONS = 'insertions'
 DELETIONS = 'deletions'
 CODE_FILES = 'code_files'
 CODE_CHANGES = 'code_changes'
+REPO = 'repo'
 
 # storage for prs
-PR_COLUMNS = [HASH, AUTHOR, DATE, TITLE, REVIEWERS, NO_REVIEWS]
+PR_COLUMNS = [HASH, AUTHOR, TIMESTAMP, TZ_OFFSET, TITLE, REVIEWERS, NO_REVIEWS]
 pr_structure = recordclass('PullRequest', PR_COLUMNS)
 # storage for commits
-COMMIT_COLUMNS = [HASH, AUTHOR, DATE, TITLE, FILES, INSERTIONS, DELETIONS, CODE_FILES, CODE_CHANGES]
+COMMIT_COLUMNS = [HASH, AUTHOR, TIMESTAMP, TZ_OFFSET, TITLE, FILES, INSERTIONS, DELETIONS, CODE_FILES,
+                  CODE_CHANGES]
 commit_structure = recordclass('Commit', COMMIT_COLUMNS)
 
 
@@ -49,21 +67,39 @@ class PullRequest(pr_structure):
     """ Represents a git pull request merge commit """
 
     def __repr__(self):
-        return 'Commit by {author} on {date}, reviewed by {no_reviews}: {title}'.format(
-            author=self.author, date=self.date, reviewers=self.no_reviews, title=self.title)
+        return 'Commit by {author} at {timestamp}, reviewed by {no_reviews}: {title}'.format(
+            author=self.author, timestamp=self.timestamp, no_reviews=self.no_reviews, title=self.title)
 
 
 class Commit(commit_structure):
     """ Represents a git commit """
 
     def __repr__(self):
-        return 'Commit by {author} on {date}, ' \
+        return 'Commit by {author} at {timestamp}, ' \
                'files={files}, insertions={insertions}, deletions={deletions}' \
                'code_files={code_files}, code changes={code_changes}'.format(
-            author=self.author, date=self.date, title=self.title, files=self.files, insertions=self.insertions,
+            author=self.author, timestamp=self.timestamp, title=self.title, files=self.files, insertions=self.insertions,
             deletions=self.deletions, code_files=self.code_files, code_code_changes=self.code_changes)
 
 
+def parse_raw_date(text):
+    """ Parses a date as git prints it with --date=raw, e.g. '1700000000 -0530'
+    :param str text: the seconds since the epoch and the timezone offset
+    :return: tuple of the seconds since the epoch and the minutes the local time is ahead of UTC
+    :rtype: tuple[int, int]
+    """
+    timestamp, offset = text.split()
+    minutes = int(offset[-4:-2]) * 60 + int(offset[-2:])
+    return int(timestamp), -minutes if offset.startswith('-') else minutes
+
+
+def utcnow():
+    """ The current date in the convention of the date index of the dataframes, naive UTC, e.g. for bucket edges
+    :rtype: datetime.datetime
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
 def parse_pull_requests(commit_hash, text):
     """ Parses the given commit text
     :param str text: the text to parse
@@ -72,7 +108,7 @@ def parse_pull_requests(commit_hash, text):
     """
     try:
         author = author_regex.search(text).group(1)
-        date = date_regex.search(text).group(1)
+        timestamp, tz_offset = parse_raw_date(date_regex.search(text).group(1))
         try:
             title = pr_title_regex.search(text).group(1).strip()
         except AttributeError:
@@ -85,7 +121,7 @@ def parse_pull_requests(commit_hash, text):
             pass
         no_reviews = len(reviewers)
         if no_reviews > -1:
-            return PullRequest(commit_hash, author, date, title, reviewers, no_reviews)
+            return PullRequest(commit_hash, author, timestamp, tz_offset, title, reviewers, no_reviews)
     except:
         pass
     return None
@@ -105,7 +141,7 @@ def parse_commits(commit_hash, text):
             raise Exception('Squash merge found')
 
         author = author_regex.search(text).group(1)
-        date = date_regex.search(text).group(1)
+        timestamp, tz_offset = parse_raw_date(date_regex.search(text).group(1))
         title = commit_title_regex.search(text).group(1).strip()
         files = int(commit_files_regex.search(text).group(1).strip())
         try:
@@ -118,16 +154,18 @@ def parse_commits(commit_hash, text):
             deletions = 0
         code_change_instances = code_files_regex.findall(text)
         code_files = len(code_change_instances)
-        code_changes = int(np.sum([int(fc) for fc in code_change_instances]))
-        return Commit(commit_hash, author, date, title, files, insertions, deletions, code_files, code_changes)
+        code_changes = sum(int(fc) for fc in code_change_instances)
+        return Commit(commit_hash, author, timestamp, tz_offset, title, files, insertions, deletions, code_files,
+                      code_changes)
     except Exception as e:
         pass
     return None
 
 
-def extract_pull_requests(commit_log):
+def extract_pull_requests(commit_log, processes=1):
     """ Extracts Commits from the given log
     :param str commit_log: the log to extract pull request merge commits from
+    :param int processes: the maximum number of worker processes to parse with, see parse_records
     :return: a list of pull request merge commits
     :rtype: list[PullRequest]
     """
@@ -135,7 +173,7 @@ def extract_pull_requests(commit_log):
     # form tuples of commit hash, log
     commits = list(zip(commits[::2], commits[1::2]))
     logger1.info('Extracted {no_merges} commits'.format(no_merges=len(commits)))
-    results = [parse_pull_requests(*c) for c in commits]
+    results = parse_records(commits, parse_pull_requests, processes)
     results = list(filter(partial(is_not, None), results))
 
     logger1.info('Extracted {no_merges} PRs'.format(no_merges=len(results)))
@@ -150,14 +188,128 @@ def regex_extract_variable(text, regex, default=None):
         return default
 
 
-def extract_commits(log_text):
+def extract_commits(log_text, processes=1):
+    """ Extracts Commits from the given log
+    :param str log_text: the log to extract commits from
+    :param int processes: the maximum number of worker processes to parse with, see parse_records
+    :return: a list of commits
+    :rtype: list[Commit]
+    """
     commits = commit_regex.split(log_text)[1:]
     # form tuples of commit hash, log
     commits = list(zip(commits[::2], commits[1::2]))
     logger1.info('Extracted {no_commits} commits'.format(no_commits=len(commits)))
-    results = [parse_commits(*c) for c in commits]
+    results = parse_records(commits, parse_commits, processes)
     results = list(filter(partial(is_not, None), results))
 
     logger1.info('Extracted {no_commits} commits'.format(no_commits=len(results)))
 
     return results
+
+
+def iter_commit_records(lines):
+    """ Groups git log output lines into one record per commit
+    :param collections.Iterable[str] lines: the log lines, e.g. streamed from git
+    :return: a generator of (commit hash, commit text) tuples
+    :rtype: collections.Iterator[tuple[str, str]]
+    """
+    commit_hash = None
+    text = []
+    for line in lines:
+        match = commit_regex.match(line)
+        if match is not None:
+            if commit_hash is not None:
+                yield commit_hash, ''.join(text)
+            commit_hash = match.group(1)
+            text = [line[match.end():]]
+        elif commit_hash is not None:
+            text.append(line)
+    if commit_hash is not None:
+        yield commit_hash, ''.join(text)
+
+
+def stream_pull_requests(lines, processes=1):
+    """ Lazily extracts PullRequests from the given log lines, one commit at a time
+    :param collections.Iterable[str] lines: the log lines to extract pull request merge commits from
+    :param int processes: the maximum number of worker processes to parse with, see parse_records
+    :return: a generator of pull request merge commits
+    :rtype: collections.Iterator[PullRequest]
+    """
+    no_commits = no_results = 0
+    # only the parsing is timed, not git writing the lines nor the consumer of the results
+    with profiling.stopwatch('parse', records='pull requests') as s, profiling.sampling('parse'):
+        for result in profiling.timed(s, parse_records(iter_commit_records(lines), parse_pull_requests, processes)):
+            no_commits += 1
+            if result is not None:
+                no_results += 1
+                yield result
+        s.rows = no_commits
+    logger1.info('Extracted {no_merges} PRs from {no_commits} commits'.format(no_merges=no_results,
+                                                                            no_commits=no_commits))
+
+
+def stream_commits(lines, processes=1):
+    """ Lazily extracts Commits from the given log lines, one commit at a time
+    :param collections.Iterable[str] lines: the log lines to extract commits from
+    :param int processes: the maximum number of worker processes to parse with, see parse_records
+    :return: a generator of commits
+    :rtype: collections.Iterator[Commit]
+    """
+    no_commits = no_results = 0
+    # as stream_pull_requests, only the parsing is timed
+    with profiling.stopwatch('parse', records='commits') as s, profiling.sampling('parse'):
+        for result in profiling.timed(s, parse_records(iter_commit_records(lines), parse_commits, processes)):
+            no_commits += 1
+            if result is not None:
+                no_results += 1
+                yield result
+        s.rows = no_commits
+    logger1.info('Extracted {no_results} of {no_commits} commits'.format(no_results=no_results,
+                                                                       no_commits=no_commits))
+
+
+def parse_chunk(parse_fn, chunk):
+    """ Parses a chunk of (commit hash, commit text) tuples, see parse_records
+    :rtype: list
+    """
+    return [parse_fn(*c) for c in chunk]
+
+
+def parse_records(records, parse_fn, processes=1):
+    """ Lazily parses (commit hash, commit text) tuples, sharding them across worker processes for large logs
+    Logs with fewer than PARALLEL_THRESHOLD commits are parsed in-process to avoid the pool startup cost.
+    :param collections.Iterable[tuple[str, str]] records: the records to parse, e.g. from iter_commit_records
+    :param parse_fn: the function to parse each record with, e.g. parse_commits
+    :param int processes: the maximum number of worker processes
+    :return: a generator of parse_fn results, including Nones, in the order of records
+    :rtype: collections.Iterator
+    """
+    if processes <= 1:
+        # streamed, a single record is held at a time
+        return (parse_fn(*c) for c in records)
+    return parse_records_in_pool(iter(records), parse_fn, processes)
+
+
+def parse_records_in_pool(records, parse_fn, processes):
+    """ Parses records in worker processes once the log holds PARALLEL_THRESHOLD of them, see parse_records
+    :rtype: collections.Iterator
+    """
+    head = list(itertools.islice(records, PARALLEL_THRESHOLD))
+    if len(head) < PARALLEL_THRESHOLD:
+        for c in head:
+            yield parse_fn(*c)
+        return
+
+    records = itertools.chain(head, records)
+    del head
+    chunks = iter(lambda: list(itertools.islice(records, CHUNK_SIZE)), [])
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # bound the number of chunks in flight so memory does not grow with the log
+        pending = deque(executor.submit(parse_chunk, parse_fn, chunk)
+                        for chunk in itertools.islice(chunks, 2 * processes))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(parse_chunk, parse_fn, chunk))
+            for result in results:
+                yield result
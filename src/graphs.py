@@ -1,8 +1,14 @@
 """ Graphing functions """
-import datetime
+import hashlib
+import json
 import logging
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+import matplotlib
+# render to files only, also in worker processes without a display
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
 import numpy as np
@@ -10,17 +16,14 @@ import pandas as pd
 import seaborn as sb
 
 import gitparser
+import profiling
 import punchcard
+import sitefiles
 
-
-def generate_xtick(i, dt, frequency):
-    if 'M' == frequency:
-        n = 3
-    elif 'W' == frequency:
-        n = 9
-    else:
-        n = 70
-    return dt.strftime("%b'%y") if (i % n == 0) else ''
+# a chart to render: the function drawing it, the png to write and the keyword arguments of the function
+RenderJob = namedtuple('RenderJob', ['render_fn', 'path', 'kwargs'])
+# hashes of the rendered charts, relative to the output directory
+RENDER_CACHE_FILENAME = 'render_cache.json'
 
 
 def set_ax_color(ax, textcolor):
@@ -35,259 +38,264 @@ def set_ax_color(ax, textcolor):
     ax.title.set_color(textcolor)
 
 
-def daterange_groupby(labels, ranges):
-    def mapping_fn(index):
-        for i, (from_dt, to_dt) in enumerate(ranges):
-            if from_dt <= index < to_dt:
-                return labels[i]
-    return mapping_fn
-
-
-def plot_pr_stats(df, output, authors, review_authors, start_date, frequency='M', view_text='Monthly',
-                  bgcolor='#FAFAFA', textcolor='#212121'):
-    """ Plots graphs indicating statistics on pull requests and reviews
-    :param pd.DataFrame df: dataframe to plot
-    :param str output: directory to save plots to
-    """
-    sb.set_style('darkgrid')
-    df = df[df[gitparser.AUTHOR].isin(authors)]
-    if df.shape[0] < 1:
-        return
-    freq_str = view_text.lower()[:-2].replace('i', 'y')
-    xticks, ranges, xticklabels = generate_xticks(start_date, frequency)
-    # filter by earliest datetime in range
-    df = df[df.index > ranges[0][0]]
-
-    # groupings
-    time_grouped_df = df.groupby(daterange_groupby(xticks, ranges))
-    time_author_grouped_df = df.groupby([daterange_groupby(xticks, ranges), gitparser.AUTHOR])
-
-    # PRs by author
-    df_prs = pd.DataFrame(index=xticks, columns=authors, data=0)
-    try:
-        df_prs[authors] = time_author_grouped_df[gitparser.AUTHOR].count().unstack(fill_value=0)
-    except Exception:
-        pass
-    df_prs.to_json(os.path.join(output, 'prs.json'))
-
-    fig, ax = plt.subplots(figsize=(7, 4))
-    df_prs[authors[::-1]].plot.bar(colormap='tab10', linewidth=2, ax=ax, stacked=True)
-    ax.set_xticklabels(xticklabels, rotation=0)
-    ax.set_ylabel('no. merged pull requests')
-    ax.set_title('No. merged pull requests by author per {}'.format(freq_str))
-    plt.gca().set_ylim(bottom=0)
-    handles, labels = ax.get_legend_handles_labels()
-    ax.legend(handles[::-1], labels[::-1], loc='upper left')
-    set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'prs.png'), bbox_inches='tight', facecolor=bgcolor)
-    plt.close()
-
-    # authors by month
-    df_authors = df_prs.clip(upper=1)
-    df_authors.to_json(os.path.join(output, 'authors.json'))
-
-    fig, ax = plt.subplots(figsize=(7, 4))
-    df_authors[authors[::-1]].plot.bar(colormap='tab10', linewidth=2, stacked=True, ax=ax)
-    ax.set_xticklabels(xticklabels, rotation=0)
-    ax.set_ylabel('no. authors')
-    ax.set_title('No. authors per {}'.format(freq_str))
-    plt.gca().set_ylim(bottom=0)
-    handles, labels = ax.get_legend_handles_labels()
-    ax.legend(handles[::-1], labels[::-1], loc='upper left')
-    set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'authors.png'), bbox_inches='tight', facecolor=bgcolor)
-    plt.close()
+def compute_freq_str(view_text):
+    return view_text.lower()[:-2].replace('i', 'y')
 
-    # reviews by reviewer
-    df_reviews = pd.DataFrame(index=xticks, columns=review_authors, data=0)
-    try:
-        df_reviews[review_authors] = time_grouped_df[review_authors].sum().loc[:, review_authors]
-    except Exception as e:
-        pass
-    df_reviews.to_json(os.path.join(output, 'reviews.json'))
 
+def render_stacked_bar(df, path, xticklabels, ylabel, title, ylim_bottom=0, yformatter=None,
+                       bgcolor='#FAFAFA', textcolor='#212121'):
     fig, ax = plt.subplots(figsize=(7, 4))
-    df_reviews[review_authors[::-1]].plot.bar(colormap='tab10', linewidth=2, stacked=True, ax=ax)
+    df[df.columns[::-1]].plot.bar(colormap='tab10', linewidth=2, ax=ax, stacked=True)
     ax.set_xticklabels(xticklabels, rotation=0)
-    ax.set_ylabel('no. reviews received')
-    ax.set_title('No. reviews received by reviewer per {}'.format(freq_str))
-    plt.gca().set_ylim(bottom=1)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    if yformatter is not None:
+        ax.yaxis.set_major_formatter(mtick.FuncFormatter(yformatter))
+    else:
+        plt.gca().set_ylim(bottom=ylim_bottom)
     handles, labels = ax.get_legend_handles_labels()
     ax.legend(handles[::-1], labels[::-1], loc='upper left')
     set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'reviews.png'), bbox_inches='tight', facecolor=bgcolor)
+    fig.savefig(path, bbox_inches='tight', facecolor=bgcolor)
     plt.close()
 
-    # avg reviews by month
-    df_avg_reviews = pd.DataFrame(index=xticks, columns=['mean', 'std'], data=0)
-    df_avg_reviews['mean'] = time_grouped_df[gitparser.NO_REVIEWS].mean()
-    df_avg_reviews['std'] = time_grouped_df[gitparser.NO_REVIEWS].std()
-    df_avg_reviews.to_json(os.path.join(output, 'avg_reviews.json'))
 
+def render_errorbar(df, path, xticklabels, ylabel, title, xlabel='date', bgcolor='#FAFAFA', textcolor='#212121'):
     fig, ax = plt.subplots(figsize=(7, 4))
-    ax.errorbar(x=range(len(xticks)), y=df_avg_reviews['mean'], yerr=df_avg_reviews['std'], fmt='o',
+    ax.errorbar(x=range(len(df.index)), y=df['mean'], yerr=df['std'], fmt='o',
                 markersize=8, capsize=8)
     ax.set_xticklabels([], minor=1)
-    ax.set_xticklabels([''] + [l for i, l in enumerate(xticklabels )if i % 2 == 0], rotation=0)
-    ax.set_xlabel('date')
-    ax.set_ylabel(gitparser.NO_REVIEWS)
-    ax.set_title('Avg reviews per {}'.format(freq_str))
+    ax.set_xticklabels([''] + [l for i, l in enumerate(xticklabels) if i % 2 == 0], rotation=0)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
     plt.gca().set_ylim(bottom=0)
     set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'avg_reviews.png'), bbox_inches='tight', facecolor=bgcolor)
+    fig.savefig(path, bbox_inches='tight', facecolor=bgcolor)
     plt.close()
 
 
-def plot_commit_stats(df, output, authors, start_date, frequency='M', view_text='Monthly',
-                      bgcolor='#FAFAFA', textcolor='#212121'):
-    df = df[df[gitparser.AUTHOR].isin(authors)]
-    freq_str = view_text.lower()[:-2].replace('i', 'y')
-    xticks, ranges, xticklabels = generate_xticks(start_date, frequency)
-
-    # groupings
-    time_grouped_df = df.groupby(daterange_groupby(xticks, ranges))
-    time_author_grouped_df = df.groupby([daterange_groupby(xticks, ranges), gitparser.AUTHOR])
-
-    # commits
-    df_commits = pd.DataFrame(index=xticks, columns=authors, data=0)
-    try:
-        df_commits[authors] = time_author_grouped_df[gitparser.TITLE].count().unstack(gitparser.AUTHOR, fill_value=0).loc[:, authors]
-    except Exception as e:
-        pass
-    df_commits.to_json(os.path.join(output, 'commits.json'))
-
-    fig, ax = plt.subplots(figsize=(7, 4))
-    df_commits[df_commits.columns[::-1]].plot.bar(colormap='tab10', linewidth=2, ax=ax, stacked=True)
-    ax.set_xticklabels(xticklabels, rotation=0)
-    ax.set_ylabel('no. commits')
-    ax.set_title('No. commits by author per {}'.format(freq_str))
-    plt.gca().set_ylim(bottom=1)
-    commit_handles, commit_labels = ax.get_legend_handles_labels()
-    ax.legend(commit_handles[::-1], commit_labels[::-1], loc='upper left')
-    set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'commits.png'), bbox_inches='tight', facecolor=bgcolor)
-    plt.close()
-
-    # file changes
-    df_insertions = pd.DataFrame(index=xticks, columns=authors, data=0)
-    try:
-        df_insertions[authors] = (time_author_grouped_df[gitparser.INSERTIONS].sum().unstack(
-            gitparser.AUTHOR, fill_value=0).loc[:, authors] - time_author_grouped_df[gitparser.DELETIONS].sum().unstack(
-            gitparser.AUTHOR, fill_value=0).loc[:, authors]).clip(lower=0)
-    except Exception as e:
-        pass
-    df_insertions.to_json(os.path.join(output, 'insertions.json'))
-
-    df_deletions = pd.DataFrame(index=xticks, columns=authors, data=0)
-    try:
-        df_deletions[authors] = (time_author_grouped_df[gitparser.DELETIONS].sum().unstack(
-            gitparser.AUTHOR, fill_value=0).loc[:, authors] - time_author_grouped_df[gitparser.INSERTIONS].sum().unstack(
-            gitparser.AUTHOR, fill_value=0).loc[:, authors]).clip(lower=0)
-    except Exception as e:
-        pass
-    df_deletions.to_json(os.path.join(output, 'deletions.json'))
-
+def render_changes(df_insertions, df_deletions, path, xticklabels, title, bgcolor='#FAFAFA', textcolor='#212121'):
     fig, ax = plt.subplots(figsize=(7, 4))
     df_insertions[df_insertions.columns[::-1]].plot.bar(colormap='tab10', linewidth=4, ax=ax, stacked=False)
+    # the legend only needs the insertion bars
+    handles, labels = ax.get_legend_handles_labels()
     ax.set_prop_cycle(None)
     (-df_deletions)[df_deletions.columns[::-1]].plot.bar(colormap='tab10', linewidth=4, ax=ax, stacked=False)
     ax.axhline(0, color='white')
     ax.set_xticklabels(xticklabels, rotation=0)
     ax.set_ylabel('lines changed')
     ax.set_yscale('symlog')
-    ax.set_title('Net insertions / deletions by author per {}'.format(freq_str))
+    ax.set_title(title)
     ax.yaxis.set_major_formatter(mtick.FuncFormatter(power_ten_formatter))
-    ax.legend(commit_handles[::-1], commit_labels[::-1], loc='best', fontsize='x-small')
+    ax.legend(handles[::-1], labels[::-1], loc='best', fontsize='x-small')
     set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'changes_by_author.png'), bbox_inches='tight', facecolor=bgcolor)
+    fig.savefig(path, bbox_inches='tight', facecolor=bgcolor)
     plt.close()
 
-    # code changes
-    df_code = pd.DataFrame(index=xticks, columns=authors, data=0)
-    try:
-        df_code[authors] = time_author_grouped_df[gitparser.CODE_CHANGES].sum().unstack(
-            gitparser.AUTHOR, fill_value=0).loc[:, authors]
-    except Exception as e:
-        pass
-    df_code.to_json(os.path.join(output, 'code.json'))
 
-    fig, ax = plt.subplots(figsize=(7, 4))
-    df_code[df_code.columns[::-1]].plot.bar(colormap='tab10', linewidth=2, ax=ax, stacked=True)
-    ax.set_xticklabels(xticklabels, rotation=0)
-    ax.set_ylabel('code lines changed')
-    ax.set_title('LOC changed by author per {}'.format(freq_str))
-    ax.yaxis.set_major_formatter(mtick.FuncFormatter(power_ten_formatter))
-    ax.legend(commit_handles[::-1], commit_labels[::-1], loc='upper left')
-    set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'code.png'), bbox_inches='tight', facecolor=bgcolor)
-    plt.close()
+def render_punchcard(grid, path):
+    plot = punchcard.draw_punchcard(1000, 400, grid)
+    plot.write_to_png(path)
 
-    # avg changes per commit by month
-    df_avg_changes = pd.DataFrame(index=xticks, columns=['mean', 'std'], data=0)
-    df_avg_changes['mean'] = time_grouped_df[gitparser.CODE_CHANGES].mean()
-    df_avg_changes['std'] = time_grouped_df[gitparser.CODE_CHANGES].std()
-    df_avg_changes.to_json(os.path.join(output, 'avg_changes.json'))
 
-    fig, ax = plt.subplots(figsize=(7, 4))
-    ax.errorbar(x=range(len(xticks)), y=df_avg_changes['mean'],
-                yerr=df_avg_changes['std'], fmt='o',
-                markersize=8, capsize=8)
-    # sb.violinplot(x=frequency, y=gitparser.CODE_CHANGES, data=df, ax=ax, color=plt.cm.tab20c(1), cut=0)
-    ax.set_xticklabels([], minor=1)
-    ax.set_xticklabels([''] + [l for i, l in enumerate(xticklabels) if i % 2 == 0], rotation=0)
-    ax.set_ylabel(gitparser.CODE_CHANGES)
-    ax.set_xlabel('date')
-    # ax.set_yscale('log')
-    ax.set_title('Average LOC changed per commit')
-    ax.set_ylabel('code lines changed')
-    plt.gca().set_ylim(bottom=0)
-    set_ax_color(ax, textcolor)
-    fig.savefig(os.path.join(output, 'avg_changes.png'), bbox_inches='tight', facecolor=bgcolor)
-    plt.close()
+def write_frames(frames, output, writer=None):
+    """ Writes the plotted frames as json files named after their charts
+    :param dict[str, pd.DataFrame] frames: frames keyed by chart name
+    :param str output: directory to save the files to
+    :param sitefiles.SiteWriter writer: optional writer deduplicating the files of all views
+    """
+    for name, df in frames.items():
+        path = os.path.join(output, '{name}.json'.format(name=name))
+        if writer is None:
+            sitefiles.write_if_changed(path, df.to_json())
+        else:
+            writer.write(path, df.to_json())
+
+
+def pr_render_jobs(cube, output, authors, review_authors, start_date, view_text='Monthly',
+                   bgcolor='#FAFAFA', textcolor='#212121', writer=None):
+    """ Computes the charts indicating statistics on pull requests and reviews, see render_jobs
+    :param aggregation.Cube cube: the aggregated statistics to plot a view of
+    :param str output: directory to save plots to
+    :param sitefiles.SiteWriter writer: optional writer deduplicating the json files of all views
+    :return: the charts to render
+    :rtype: list[RenderJob]
+    """
+    frames = cube.pr_frames(authors, review_authors, start_date)
+    if frames is None:
+        return []
+    freq_str = compute_freq_str(view_text)
+    _, xticklabels = cube.xticks(start_date)
+    colors = dict(bgcolor=bgcolor, textcolor=textcolor)
+    write_frames(frames, output, writer)
+
+    return [
+        RenderJob(render_stacked_bar, os.path.join(output, 'prs.png'), dict(
+            df=frames['prs'], xticklabels=xticklabels, ylabel='no. merged pull requests',
+            title='No. merged pull requests by author per {}'.format(freq_str), **colors)),
+        RenderJob(render_stacked_bar, os.path.join(output, 'authors.png'), dict(
+            df=frames['authors'], xticklabels=xticklabels, ylabel='no. authors',
+            title='No. authors per {}'.format(freq_str), **colors)),
+        RenderJob(render_stacked_bar, os.path.join(output, 'reviews.png'), dict(
+            df=frames['reviews'], xticklabels=xticklabels, ylabel='no. reviews received',
+            title='No. reviews received by reviewer per {}'.format(freq_str), ylim_bottom=1, **colors)),
+        RenderJob(render_errorbar, os.path.join(output, 'avg_reviews.png'), dict(
+            df=frames['avg_reviews'], xticklabels=xticklabels, ylabel=gitparser.NO_REVIEWS,
+            title='Avg reviews per {}'.format(freq_str), **colors)),
+    ]
+
+
+def commit_render_jobs(cube, output, authors, start_date, view_text='Monthly',
+                       bgcolor='#FAFAFA', textcolor='#212121', writer=None):
+    """ Computes the charts indicating statistics on commits, see render_jobs
+    :param aggregation.Cube cube: the aggregated statistics to plot a view of
+    :param str output: directory to save plots to
+    :param sitefiles.SiteWriter writer: optional writer deduplicating the json files of all views
+    :return: the charts to render
+    :rtype: list[RenderJob]
+    """
+    frames = cube.commit_frames(authors, start_date)
+    freq_str = compute_freq_str(view_text)
+    _, xticklabels = cube.xticks(start_date)
+    colors = dict(bgcolor=bgcolor, textcolor=textcolor)
+    write_frames(frames, output, writer)
+
+    return [
+        RenderJob(render_stacked_bar, os.path.join(output, 'commits.png'), dict(
+            df=frames['commits'], xticklabels=xticklabels, ylabel='no. commits',
+            title='No. commits by author per {}'.format(freq_str), ylim_bottom=1, **colors)),
+        RenderJob(render_changes, os.path.join(output, 'changes_by_author.png'), dict(
+            df_insertions=frames['insertions'], df_deletions=frames['deletions'], xticklabels=xticklabels,
+            title='Net insertions / deletions by author per {}'.format(freq_str), **colors)),
+        RenderJob(render_stacked_bar, os.path.join(output, 'code.png'), dict(
+            df=frames['code'], xticklabels=xticklabels, ylabel='code lines changed',
+            title='LOC changed by author per {}'.format(freq_str), yformatter=power_ten_formatter, **colors)),
+        RenderJob(render_errorbar, os.path.join(output, 'avg_changes.png'), dict(
+            df=frames['avg_changes'], xticklabels=xticklabels, ylabel='code lines changed',
+            title='Average LOC changed per commit', **colors)),
+        RenderJob(render_punchcard, os.path.join(output, 'punchcard.png'), dict(
+            grid=cube.punchcard_grid(authors))),
+    ]
+
+
+def render_job(job):
+    """ Renders a single chart
+    The chart is drawn to a temporary file which only replaces the png if it differs, so the png is never partially
+    written and other files hard linked to it are left untouched.
+    :param RenderJob job: the chart to render
+    :return: the span timing the render, recorded by render_jobs as workers cannot record it
+    :rtype: dict
+    """
+    with profiling.span('render', record=False, chart=job.render_fn.__name__, path=job.path) as s:
+        sb.set_style('darkgrid')
+        tmp_path = sitefiles.temporary_path(job.path)
+        try:
+            job.render_fn(path=tmp_path, **job.kwargs)
+            sitefiles.replace_if_changed(tmp_path, job.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return s.as_dict()
+
+
+def compute_job_hash(job):
+    """ Hashes everything a chart depends on: the render function, the plotted values and the plot parameters
+    The index of plotted frames is left out as the most recent bucket ends at the time of the run, charts only
+    show the tick labels.
+    :param RenderJob job: the chart to hash
+    :return: the hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha1(job.render_fn.__name__.encode())
+    for key, value in sorted(job.kwargs.items()):
+        digest.update(key.encode())
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(value.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(value.tobytes())
+        elif callable(value):
+            digest.update(value.__name__.encode())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def load_render_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_jobs(jobs, processes=1, cache_path=None):
+    """ Renders the given charts, in a pool of worker processes if more than one process is allowed
+    Charts with the same hash as another chart are only rendered once, the others are hard links to it.
+    :param list[RenderJob] jobs: the charts to render
+    :param int processes: the maximum number of worker processes
+    :param str cache_path: optional path of a json file holding the hashes of previously rendered charts, charts
+        whose hash is unchanged and whose png still exists are skipped
+    :return: the number of skipped and rendered charts
+    :rtype: tuple[int, int]
+    """
+    hashes = {job.path: compute_job_hash(job) for job in jobs}
+    cache, sources = {}, {}
+    if cache_path is not None:
+        cache = load_render_cache(cache_path)
+        cache_dir = os.path.dirname(cache_path)
+        keys = {job.path: os.path.relpath(job.path, cache_dir) for job in jobs}
+        hits = [job for job in jobs if cache.get(keys[job.path]) == hashes[job.path] and os.path.exists(job.path)]
+        sources = {hashes[job.path]: job.path for job in hits}
+        jobs = [job for job in jobs if cache.get(keys[job.path]) != hashes[job.path] or not os.path.exists(job.path)]
+    no_hits = len(hashes) - len(jobs)
+
+    # identical charts are linked to the first one rendered, or to an unchanged one
+    unique, duplicates = [], []
+    for job in jobs:
+        source = sources.setdefault(hashes[job.path], job.path)
+        if source == job.path:
+            unique.append(job)
+        else:
+            duplicates.append((source, job.path))
+
+    logging.info('Rendering {no_jobs:d} charts, linking {no_duplicates:d} identical charts'.format(
+        no_jobs=len(unique), no_duplicates=len(duplicates)))
+    if processes <= 1:
+        with profiling.sampling('render'):
+            for job in unique:
+                profiling.record(render_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # consume the results to surface errors raised by the workers
+            for span in executor.map(render_job, unique, chunksize=max(1, len(unique) // (4 * processes))):
+                profiling.record(span)
+    for source, path in duplicates:
+        sitefiles.link_if_changed(source, path)
 
-    # punch card
-    plot = punchcard.plot_punchcard(1000, 400, df.index)
-    plot.write_to_png(os.path.join(output, 'punchcard.png'))
+    if cache_path is not None:
+        cache.update({keys[path]: digest for path, digest in hashes.items()})
+        sitefiles.write_if_changed(cache_path, json.dumps(cache, indent=0, sort_keys=True))
+    return no_hits, len(unique)
 
 
-def compute_next_datetime(dt, frequency):
-    if frequency == 'M':
-        next_d = datetime.datetime(dt.year, dt.month, 1) - datetime.timedelta(seconds=1)
-        return next_d
-    elif frequency == 'W':
-        return dt - datetime.timedelta(days=7)
-    elif frequency == 'D':
-        return dt - datetime.timedelta(days=1)
-    else:
-        raise NotImplementedError('Not implemented for frequency {}'.format(frequency))
+def plot_pr_stats(cube, output, authors, review_authors, start_date, view_text='Monthly',
+                  bgcolor='#FAFAFA', textcolor='#212121'):
+    """ Plots graphs indicating statistics on pull requests and reviews
+    :param aggregation.Cube cube: the aggregated statistics to plot a view of
+    :param str output: directory to save plots to
+    """
+    render_jobs(pr_render_jobs(cube, output, authors, review_authors, start_date, view_text, bgcolor, textcolor))
 
 
-def compute_penultimate_datetime(dt, frequency):
-    if frequency == 'M':
-        return datetime.datetime(dt.year, dt.month, 1, 0) - datetime.timedelta(seconds=1)
-    elif frequency == 'W':
-        return datetime.datetime(dt.year, dt.month, dt.day - datetime.date.today().weekday(), 0) - datetime.timedelta(seconds=1)
-    elif frequency == 'D':
-        return datetime.datetime(dt.year, dt.month, dt.day, 0) - datetime.timedelta(seconds=1)
-    else:
-        raise NotImplementedError('Not implemented for frequency {}'.format(frequency))
-
-
-def generate_xticks(start_date, frequency):
-    ticks = []
-    dt = datetime.datetime.now()
-    ticks += [dt]
-    dt = compute_penultimate_datetime(dt, frequency)
-
-    while dt > start_date:
-        ticks += [dt]
-        dt = compute_next_datetime(dt, frequency)
-    ticks += [dt]
-    ticks = ticks[::-1]
-    ranges = list(zip(ticks[:-1], ticks[1:]))
-    ticks = ticks[1:]
-    tick_labels = [generate_xtick(i, d, frequency) for i, d in enumerate(ticks)]
-    return ticks, ranges, tick_labels
+def plot_commit_stats(cube, output, authors, start_date, view_text='Monthly',
+                      bgcolor='#FAFAFA', textcolor='#212121'):
+    """ Plots graphs indicating statistics on commits
+    :param aggregation.Cube cube: the aggregated statistics to plot a view of
+    :param str output: directory to save plots to
+    """
+    render_jobs(commit_render_jobs(cube, output, authors, start_date, view_text, bgcolor, textcolor))
 
 
 def power_ten_formatter(x, pos):
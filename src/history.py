@@ -0,0 +1,80 @@
+""" Functions for tracking which commits have already been ingested, so reruns only parse new commits """
+import json
+import logging
+import os
+
+import gitlog
+
+STATE_FILENAME = 'history.json'
+
+
+def load_state(output):
+    """ Loads the ingestion state saved in the given output directory
+    :param str output: the output directory
+    :return: mapping of dataframe name to repository path to the ref tips seen when it was last ingested
+    :rtype: dict[str, dict[str, dict[str, str]]]
+    """
+    try:
+        with open(os.path.join(output, STATE_FILENAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(output, state):
+    """ Saves the ingestion state to the given output directory
+    :param str output: the output directory
+    :param dict state: the state, see load_state
+    """
+    with open(os.path.join(output, STATE_FILENAME), 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def save_refs(output, name, refs):
+    """ Records the ref tips a saved dataframe covers in the ingestion state
+    :param str output: the output directory
+    :param str name: the name of the dataframe, e.g. 'commits'
+    :param dict[str, dict[str, str]] refs: the ref tips per repository
+    """
+    state = load_state(output)
+    state[name] = refs
+    save_state(output, state)
+
+
+def select_refs(refs, all_refs):
+    """ Selects the refs whose history is ingested
+    :param dict[str, str] refs: all ref tips, see gitlog.read_refs
+    :param bool all_refs: True if the log covers all refs (git log --all), False if it only covers HEAD
+    :rtype: dict[str, str]
+    """
+    if all_refs:
+        return dict(refs)
+    return {ref: commit_hash for ref, commit_hash in refs.items() if 'HEAD' == ref}
+
+
+def compute_revisions(previous, current, all_refs, directory=None):
+    """ Computes the git log revision arguments which select only the commits not yet ingested
+    :param dict[str, str] previous: the ref tips at the last ingestion, or None if never ingested
+    :param dict[str, str] current: the current ref tips
+    :param bool all_refs: True if the log covers all refs (git log --all), False if it only covers HEAD
+    :param str directory: the repository, defaults to the current directory
+    :return: revision arguments to append to the git log arguments, an empty list to read the full log,
+        or None if history was rewritten and the repository must be rebuilt
+    :rtype: list[str]
+    """
+    if not previous:
+        return []
+    seen = set()
+    for ref, old_hash in previous.items():
+        new_hash = current.get(ref)
+        if new_hash is None:
+            # deleted refs leave their commits in place
+            continue
+        if old_hash != new_hash and not gitlog.is_ancestor(old_hash, new_hash, directory):
+            logging.info('{ref} was rewritten from {old} to {new}'.format(ref=ref, old=old_hash, new=new_hash))
+            return None
+        seen.add(old_hash)
+    if not seen:
+        return []
+    # git log reads HEAD by default, but not once a negative revision is given
+    return ([] if all_refs else ['HEAD']) + ['--not'] + sorted(seen)
@@ -0,0 +1,265 @@
+""" Delivery of emails
+
+Each message is serialised once, then delivered by a few threads over a pool of reused SMTP connections. Every batch of
+up to batch_size recipients of a message is sent in a single SMTP transaction, and temporary failures are retried.
+Instead of a mail server, messages can be written to a directory or kept in memory, e.g. to test throughput, see
+create_transport.
+"""
+import itertools
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import profiling
+
+logger1 = logging.getLogger('mailer')
+
+# a message to deliver: the envelope sender, the recipients and the serialised message
+Envelope = namedtuple('Envelope', ['sender', 'recipients', 'data'])
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 25
+# the maximum number of open connections, and of threads delivering over them
+DEFAULT_CONNECTIONS = 4
+# recipients per transaction, mail servers accept at least 100
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_RETRIES = 3
+# seconds to wait before the first retry, doubled for each further retry
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 30
+
+
+def build_message(sender, recipients, subject, html, plain):
+    """ Builds a message with a plain text and an html alternative
+    :param str sender: the sending address
+    :param list[str] recipients: the receiving addresses
+    :param str subject: the subject
+    :param str html: the html body
+    :param str plain: the plain text body
+    :return: the message, serialised once for all recipients and retries
+    :rtype: Envelope
+    """
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = ', '.join(recipients)
+    # the last alternative is preferred
+    msg.attach(MIMEText(plain, 'plain'))
+    msg.attach(MIMEText(html, 'html'))
+    return Envelope(sender, list(recipients), msg.as_bytes())
+
+
+def split_batches(envelopes, batch_size):
+    """ Splits the recipients of each message into batches sent in one transaction each
+    :rtype: list[Envelope]
+    """
+    return [envelope._replace(recipients=envelope.recipients[i:i + batch_size])
+            for envelope in envelopes for i in range(0, len(envelope.recipients), batch_size)]
+
+
+def is_temporary(code):
+    return 400 <= code < 500
+
+
+def format_error(code, message):
+    return '{code:d} {message}'.format(code=code, message=message.decode('utf-8', 'replace')
+                                       if isinstance(message, bytes) else message)
+
+
+class SMTPTransport(object):
+    """ Delivers messages over a pool of reused SMTP connections """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, connections=DEFAULT_CONNECTIONS,
+                 batch_size=DEFAULT_BATCH_SIZE, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param str host: the mail server
+        :param int port: the port of the mail server
+        :param int connections: the maximum number of connections, and of messages delivered at once
+        :param int batch_size: the maximum number of recipients per transaction
+        :param int retries: the number of times a temporarily failing transaction is retried
+        :param float backoff: the seconds to wait before the first retry, doubled for each further retry
+        :param float timeout: the seconds to wait for the mail server
+        """
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+    def release(self, connection):
+        self.pool.put(connection)
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def deliver(self, envelope):
+        """ Sends one batch, retrying the recipients which failed temporarily
+        :param Envelope envelope: the batch
+        :return: the refused recipients with their errors
+        :rtype: dict[str, str]
+        """
+        refused = {}
+        for attempt in itertools.count():
+            last_attempt = attempt >= self.retries
+            connection = None
+            retry = []
+            try:
+                connection = self.acquire()
+                errors = connection.sendmail(envelope.sender, envelope.recipients, envelope.data)
+                self.release(connection)
+                # some recipients may have been refused
+                for recipient, (code, message) in errors.items():
+                    if is_temporary(code) and not last_attempt:
+                        retry.append(recipient)
+                    else:
+                        refused[recipient] = format_error(code, message)
+            except smtplib.SMTPRecipientsRefused as e:
+                # smtplib resets the transaction, the connection can be reused
+                self.release(connection)
+                for recipient, (code, message) in e.recipients.items():
+                    if is_temporary(code) and not last_attempt:
+                        retry.append(recipient)
+                    else:
+                        refused[recipient] = format_error(code, message)
+            except (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected, OSError) as e:
+                # not connected, e.g. greeted with 421, or disconnected: connect again on the next attempt
+                if connection is not None:
+                    self.discard(connection)
+                if last_attempt:
+                    error = format_error(e.smtp_code, e.smtp_error) if isinstance(e, smtplib.SMTPConnectError) \
+                        else str(e)
+                    refused.update({recipient: error for recipient in envelope.recipients})
+                else:
+                    retry = envelope.recipients
+            except smtplib.SMTPResponseException as e:
+                self.release(connection)
+                if not is_temporary(e.smtp_code) or last_attempt:
+                    refused.update({recipient: format_error(e.smtp_code, e.smtp_error)
+                                    for recipient in envelope.recipients})
+                else:
+                    retry = envelope.recipients
+            except smtplib.SMTPException as e:
+                # e.g. a feature the server does not support, which retrying does not change
+                self.release(connection)
+                refused.update({recipient: str(e) for recipient in envelope.recipients})
+            if not retry:
+                return refused
+            logger1.warning('Retrying delivery to {no_recipients:d} recipients in {delay:g}s'.format(
+                no_recipients=len(retry), delay=self.backoff * 2 ** attempt))
+            time.sleep(self.backoff * 2 ** attempt)
+            envelope = envelope._replace(recipients=retry)
+
+    def send(self, envelopes):
+        """ Delivers the given messages concurrently
+        :param list[Envelope] envelopes: the messages, see build_message
+        :return: the recipients which could not be delivered to, with their errors
+        :rtype: dict[str, str]
+        """
+        batches = split_batches(envelopes, self.batch_size)
+        refused = {}
+        if not batches:
+            return refused
+        with profiling.span('send', rows=len(batches)):
+            with ThreadPoolExecutor(max_workers=min(self.connections, len(batches))) as executor:
+                for errors in executor.map(self.deliver, batches):
+                    refused.update(errors)
+        logger1.info('Delivered {no_messages:d} messages in {no_batches:d} transactions, {no_refused:d} recipients '
+                     'refused'.format(no_messages=len(envelopes), no_batches=len(batches), no_refused=len(refused)))
+        return refused
+
+    def close(self):
+        """ Closes the pooled connections """
+        while True:
+            try:
+                connection = self.pool.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                self.discard(connection)
+
+
+class FileSink(object):
+    """ Writes each message to an .eml file instead of sending it """
+
+    def __init__(self, directory):
+        """
+        :param str directory: the directory to write the messages to
+        """
+        self.directory = directory
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, envelopes):
+        """ Writes the given messages, see SMTPTransport.send
+        :rtype: dict[str, str]
+        """
+        for envelope in envelopes:
+            with self.lock:
+                number = next(self.counter)
+            path = os.path.join(self.directory, '{time:d}-{number:06d}.eml'.format(time=int(time.time()),
+                                                                                  number=number))
+            with open(path, 'wb') as f:
+                f.write(envelope.data)
+        logger1.info('Wrote {no_messages:d} messages to {directory}'.format(
+            no_messages=len(envelopes), directory=self.directory))
+        return {}
+
+    def close(self):
+        pass
+
+
+class MemorySink(object):
+    """ Keeps the messages in memory instead of sending them, e.g. for tests """
+
+    def __init__(self):
+        self.envelopes = []
+        self.lock = threading.Lock()
+
+    def send(self, envelopes):
+        """ Keeps the given messages, see SMTPTransport.send
+        :rtype: dict[str, str]
+        """
+        with self.lock:
+            self.envelopes.extend(envelopes)
+        return {}
+
+    def close(self):
+        pass
+
+
+def create_transport(config):
+    """ Creates the transport configured in the email section of the config
+    Messages are written to the directory given as sink, if any, and sent to the configured mail server otherwise.
+    :param dict[str, str] config: the email section, see util.read_config
+    :rtype: SMTPTransport
+    """
+    if config.get('sink'):
+        return FileSink(config['sink'])
+    return SMTPTransport(config.get('host', DEFAULT_HOST), int(config.get('port', DEFAULT_PORT)),
+                         int(config.get('connections', DEFAULT_CONNECTIONS)),
+                         int(config.get('batch_size', DEFAULT_BATCH_SIZE)),
+                         int(config.get('retries', DEFAULT_RETRIES)), float(config.get('backoff', DEFAULT_BACKOFF)))
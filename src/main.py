@@ -3,64 +3,174 @@ import datetime
 import htmls
 import logging
 import os
-import shutil
-import tempfile
-from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import itertools
 
 import click
-import numpy as np
-import pandas as pd
-import sklearn.preprocessing
 
+# pandas, matplotlib and the modules depending on them are imported where needed, so that runs which do not need them,
+# e.g. --help, start quickly
+import commitcache
+import formatparser
+import gitlog
 import gitparser
-import graphs
-import reporting
+import history
+import profiling
+import sitefiles
 import util
 
 logging.basicConfig(level=logging.INFO)
 
-# temporarily save the git log to this file and delete it afterwards
-GITMERGE_FILENAME = 'git_merges.log'
-GITCOMMIT_FILENAME = 'git_commits.log'
 
-
-@contextmanager
-def cd(directory):
-    current_dir = os.getcwd()
-    os.chdir(directory)
-    yield
-    os.chdir(current_dir)
-
-
-def load_pr_log():
-    """ Loads the pr commit log from the given directory
-    :return: the commit log
-    :rtype: str
+def select_log_args(args, revisions=(), hashes=None):
+    """ Appends the revisions to the given git log arguments, or selects the given commits only
+    :param list[str] args: the git log arguments, e.g. gitlog.COMMIT_LOG_ARGS
+    :param list[str] revisions: optional revision arguments limiting the log, see history.compute_revisions
+    :param list[str] hashes: optional commits to log instead of walking the history, see gitlog.select_commits
+    :rtype: list[str]
+    """
+    if hashes is not None:
+        return gitlog.select_commits(args)
+    return list(args) + list(revisions)
+
+
+def load_pr_log(directory=None, revisions=(), hashes=None, status=None):
+    """ Streams the pr commit log of the given repository
+    :param str directory: the repository, defaults to the current directory
+    :param list[str] revisions: optional revision arguments limiting the log, see history.compute_revisions
+    :param list[str] hashes: optional commits to log instead of walking the history
+    :param gitlog.LogStatus status: optional status of the log, see gitlog.stream_log
+    :return: a generator over the log lines
+    :rtype: collections.Iterator[str]
+    """
+    logging.info('Fetching pr log of {directory}'.format(directory=directory or os.getcwd()))
+    return gitlog.stream_log(select_log_args(gitlog.PR_LOG_ARGS, revisions, hashes), directory, hashes, status)
+
+
+def load_commit_log(directory=None, revisions=(), hashes=None, status=None):
+    """ Streams the commit log of the given repository
+    :param str directory: the repository, defaults to the current directory
+    :param list[str] revisions: optional revision arguments limiting the log, see history.compute_revisions
+    :param list[str] hashes: optional commits to log instead of walking the history
+    :param gitlog.LogStatus status: optional status of the log, see gitlog.stream_log
+    :return: a generator over the log lines
+    :rtype: collections.Iterator[str]
+    """
+    logging.info('Fetching commit log of {directory}'.format(directory=directory or os.getcwd()))
+    return gitlog.stream_log(select_log_args(gitlog.COMMIT_LOG_ARGS, revisions, hashes), directory, hashes, status)
+
+
+def stream_pull_requests(backend='stat', directory=None, revisions=(), processes=1, cache_path=None, hashes=None,
+                         status=None):
+    """ Streams the pull requests of the given repository
+    :param str backend: 'stat' to parse the human readable log, 'format' to parse machine readable output
+    :param str directory: the repository, defaults to the current directory
+    :param list[str] revisions: optional revision arguments limiting the log, see history.compute_revisions
+    :param int processes: the maximum number of worker processes to parse the stat log with
+    :param str cache_path: optional cache of parsed records, only the commits missing from it are logged
+    :param list[str] hashes: optional commits to log instead of walking the history, see commitcache
+    :param gitlog.LogStatus status: optional status of the log, see gitlog.stream_log
+    :return: a generator of pull request merge commits
+    :rtype: collections.Iterator[gitparser.PullRequest]
+    """
+    if cache_path is not None:
+        # the log reads HEAD by default, rev-list needs it named
+        return commitcache.stream_cached(cache_path, 'prs:' + backend,
+                                         gitlog.PR_REV_LIST_ARGS + (list(revisions) or ['HEAD']),
+                                         partial(stream_pull_requests, backend, directory, processes=processes),
+                                         directory)
+    if 'format' == backend:
+        logging.info('Fetching formatted pr log of {directory}'.format(directory=directory or os.getcwd()))
+        return formatparser.stream_pull_requests(gitlog.stream_records(
+            select_log_args(gitlog.FORMAT_PR_LOG_ARGS, revisions, hashes), gitlog.RECORD_SEPARATOR, directory,
+            stdin=hashes, status=status))
+    return gitparser.stream_pull_requests(load_pr_log(directory, revisions, hashes, status), processes)
+
+
+def stream_commits(backend='stat', directory=None, revisions=(), processes=1, cache_path=None, hashes=None,
+                   status=None):
+    """ Streams the commits of the given repository
+    :param str backend: 'stat' to parse the human readable log, 'format' to parse machine readable output
+    :param str directory: the repository, defaults to the current directory
+    :param list[str] revisions: optional revision arguments limiting the log, see history.compute_revisions
+    :param int processes: the maximum number of worker processes to parse the stat log with
+    :param str cache_path: optional cache of parsed records, only the commits missing from it are logged
+    :param list[str] hashes: optional commits to log instead of walking the history, see commitcache
+    :param gitlog.LogStatus status: optional status of the log, see gitlog.stream_log
+    :return: a generator of commits
+    :rtype: collections.Iterator[gitparser.Commit]
+    """
+    if cache_path is not None:
+        return commitcache.stream_cached(cache_path, 'commits:' + backend,
+                                         gitlog.COMMIT_REV_LIST_ARGS + list(revisions),
+                                         partial(stream_commits, backend, directory, processes=processes),
+                                         directory)
+    if 'format' == backend:
+        logging.info('Fetching formatted commit log of {directory}'.format(directory=directory or os.getcwd()))
+        return formatparser.stream_commits(gitlog.stream_records(
+            select_log_args(gitlog.FORMAT_COMMIT_LOG_ARGS, revisions, hashes), gitlog.RECORD_SEPARATOR, directory,
+            stdin=hashes, status=status))
+    return gitparser.stream_commits(load_commit_log(directory, revisions, hashes, status), processes)
+
+
+def drop_duplicates(records):
+    """ Drops the records of commits seen before, e.g. in another repository sharing their history
+    :param collections.Iterable records: the records, e.g. gitparser.Commits
+    :rtype: list
+    """
+    seen = set()
+    unique = []
+    for record in records:
+        if record.commit_hash not in seen:
+            seen.add(record.commit_hash)
+            unique.append(record)
+    return unique
+
+
+def ingest_repository(stream_fn, directory, revisions=(), processes=1):
+    """ Reads all records of the given repository, see ingest_repositories
+    :rtype: list
     """
-    tempdir = tempfile.gettempdir()
-    log_filename = os.path.join(tempdir, GITMERGE_FILENAME)
-    os.system('git log --use-mailmap > {log_filename}'.format(log_filename=log_filename))
-    with open(log_filename, 'r') as f:
-        result = f.read()
-    shutil.rmtree(tempdir, ignore_errors=True)
-    logging.info('Fetched pr log')
-    return result
+    return list(stream_fn(directory=directory, revisions=revisions, processes=processes))
 
 
-def load_commit_log():
-    """ Loads the commit log from the given directory
-    :return: the commit log
-    :rtype: str
+def ingest_repository_in_worker(stream_fn, directory, revisions=()):
+    """ Reads all records of the given repository in a worker process, see ingest_repositories
+    :return: the records, and the spans timing them for the parent to record
+    :rtype: tuple[list, list[dict]]
+    """
+    with profiling.collecting() as spans:
+        records = ingest_repository(stream_fn, directory, revisions)
+    return records, spans
+
+
+def ingest_repositories(stream_fn, directories, revisions=None, jobs=1):
+    """ Reads the records of each of the given repositories, in parallel if more than one job is allowed
+    :param stream_fn: function streaming the records of a repository, e.g. stream_commits
+    :param list[str] directories: the repository paths
+    :param list[list[str]] revisions: revision arguments per repository, defaults to the full log of each
+    :param int jobs: the maximum number of repositories to ingest at once
+    :return: the list of records per repository, in the order of directories
+    :rtype: list[list]
     """
-    tempdir = tempfile.gettempdir()
-    log_filename = os.path.join(tempdir, GITCOMMIT_FILENAME)
-    os.system('git log --use-mailmap --no-merges --all --stat > {log_filename}'.format(log_filename=log_filename))
-    with open(log_filename, 'r') as f:
-        result = f.read()
-    shutil.rmtree(tempdir, ignore_errors=True)
-    logging.info('Fetched commit log')
-    return result
+    if revisions is None:
+        revisions = [()] * len(directories)
+    with profiling.span('ingest', repositories=len(directories)) as s:
+        if jobs <= 1 or len(directories) <= 1:
+            # a single repository may still be parsed in parallel
+            results = [ingest_repository(stream_fn, d, r, jobs) for d, r in zip(directories, revisions)]
+        else:
+            results = []
+            with ProcessPoolExecutor(max_workers=min(jobs, len(directories))) as executor:
+                # workers cannot record their spans, they return them
+                for records, spans in executor.map(ingest_repository_in_worker, itertools.repeat(stream_fn),
+                                                   directories, revisions):
+                    for span in spans:
+                        profiling.record(span)
+                    results.append(records)
+        s.rows = sum(len(records) for records in results)
+    return results
 
 
 def convert_prs_to_dateframe(commits):
@@ -69,12 +179,13 @@ def convert_prs_to_dateframe(commits):
     :return: a pandas dataframe with a row per commit
     :rtype: pd.DataFrame
     """
-    df = pd.DataFrame(commits, columns=gitparser.PR_COLUMNS)
-    format_commit_df(df)
-    # one hot columns for reviewers
-    mlb = sklearn.preprocessing.MultiLabelBinarizer()
-    df = df.join(pd.DataFrame(mlb.fit_transform(df.pop(gitparser.REVIEWERS)),
-                              columns=mlb.classes_, index=df.index))
+    import pandas as pd
+
+    with profiling.span('dataframe', rows=len(commits), records='pull requests'):
+        df = pd.DataFrame.from_records(commits, columns=gitparser.PR_COLUMNS)
+        # reviewers are kept as a list per pull request, see aggregation.review_edges
+        df[gitparser.REVIEWERS] = df[gitparser.REVIEWERS].map(list)
+        format_commit_df(df)
     return df
 
 
@@ -84,21 +195,30 @@ def convert_commits_to_dateframe(commits):
     :return: a pandas dataframe with a row per commit
     :rtype: pd.DataFrame
     """
-    df = pd.DataFrame(commits, columns=gitparser.COMMIT_COLUMNS)
-    format_commit_df(df)
+    import pandas as pd
+
+    with profiling.span('dataframe', rows=len(commits), records='commits'):
+        df = pd.DataFrame.from_records(commits, columns=gitparser.COMMIT_COLUMNS)
+        format_commit_df(df)
     return df
 
 
 def format_commit_df(df):
-    # handle date
-    df[gitparser.DATE] = pd.to_datetime(df[gitparser.DATE], errors='coerce')
+    import numpy as np
+    import pandas as pd
+
+    # index by the UTC date, converted from the seconds since the epoch without parsing, the offsets are kept to
+    # compute local times, see aggregation.compute_local_dates
+    df[gitparser.DATE] = pd.to_datetime(df.pop(gitparser.TIMESTAMP).to_numpy(dtype=np.int64), unit='s')
     df.set_index([gitparser.DATE], inplace=True)
-    df['month'] = df['M'] = df.index.strftime("%b'%y")
-    df['week'] = df['W'] = df.index.strftime("%b'%U'%y")
 
 
-def compute_dateranges():
-    today = datetime.datetime.today()
+# tuples of directory, frequency and text per view
+VIEWS = [('', 'M', 'Monthly'), ('weekly/', 'W', 'Weekly'), ('daily/', 'D', 'Daily')]
+
+
+def compute_dateranges(today=None):
+    today = today or gitparser.utcnow()
     month_12 = (today - datetime.timedelta(days=365), '', '12 months')
     month_6 = (today - datetime.timedelta(days=183), '6_months/', '6 months')
     month_3 = (today - datetime.timedelta(days=92), '3_months/', '3 months')
@@ -114,111 +234,343 @@ def compute_dateranges():
 @click.option('--resume', is_flag=True, help='Load previously saved dataframe, if present')
 @click.option('--email/--no-email', default=True, help='Email last month\'s summary to this address if set')
 @click.option('--plotgraphs/--no-plotgraphs', default=True)
-def main(directory, output, srcpath='/opt/git-quality', resume=False, email=True, plotgraphs=True):
-    pr_df = fetch_pr_df(directory, output, resume).sort_index()
-    commit_df = fetch_commit_df(directory, output, resume).sort_index()
-
-    # copy web template to view them
-    home_url = util.read_config('server')['url']
-    repo_name = os.path.basename(directory)
-
-    # filter for author
-    recent_authors = compute_recent_authors(pr_df)
-
-    if email:
-        reporting.run_tracking(pr_df, commit_df, srcpath, output, repo_name, home_url, recent_authors)
-
+@click.option('--backend', type=click.Choice(['stat', 'format']), default='stat',
+              help='Parse the human readable git log (stat) or machine readable git log output (format)')
+@click.option('--incremental', is_flag=True,
+              help='Load previously saved dataframes and only parse commits made since they were saved')
+@click.option('--csv', is_flag=True, help='Also export the dataframes as csv')
+@click.option('--jobs', type=int, default=1,
+              help='Number of worker processes to ingest repositories and render charts with')
+@click.option('--output-mode', type=click.Choice(['static', 'dashboard']), default='static',
+              help='Render a page with charts per view, timeframe and author (static) or write a single data file '
+                   'and a page drawing all charts in the browser (dashboard)')
+@click.option('--titles/--no-titles', default=True,
+              help='Keep the commit and pull request titles in the dataframes, which no chart shows')
+@click.option('--sample-interval', type=float,
+              help='Sample the stacks of the hot loops every this many milliseconds of CPU time, see profiling')
+@click.option('--cache', help='Keep the parsed commits in this file, which repositories sharing history can share, '
+                              'defaults to the output directory')
+@click.option('--no-cache', is_flag=True, help='Parse every commit, without reading or writing the cache')
+def main(directory, output, srcpath='/opt/git-quality', resume=False, email=True, plotgraphs=True, backend='stat',
+         incremental=False, csv=False, jobs=1, output_mode='static', titles=True, sample_interval=None, cache=None,
+         no_cache=False):
+    run(directory, output, srcpath, resume, email, plotgraphs, backend, incremental, csv, jobs, output_mode, titles,
+        sample_interval, cache, no_cache)
+
+
+def run(directory, output, srcpath='/opt/git-quality', resume=False, email=True, plotgraphs=True, backend='stat',
+        incremental=False, csv=False, jobs=1, output_mode='static', titles=True, sample_interval=None, cache=None,
+        no_cache=False):
+    """ Ingests the given repositories and generates their site, see the options of main
+    :param str directory: comma separated repository paths
+    :param str output: the directory to write the site, dataframes and profile to
+    :param str srcpath: the installation directory holding the templates
+    :param str cache: the cache of parsed commits, see commitcache, defaults to the output directory
+    :param bool no_cache: True to parse every commit
+    """
+    cache_path = compute_cache_path(output, cache, no_cache)
+    if sample_interval is not None:
+        profiling.start_sampling(sample_interval / 1000.0)
+    try:
+        with profiling.span('run', directory=directory):
+            pr_df = fetch_pr_df(directory, output, resume, backend, incremental, csv, jobs, titles=titles,
+                                cache_path=cache_path).sort_index()
+            commit_df = fetch_commit_df(directory, output, resume, backend, incremental, csv, jobs, titles=titles,
+                                        cache_path=cache_path).sort_index()
+
+            # copy web template to view them
+            home_url = util.read_config('server')['url']
+            repo_name = os.path.basename(directory)
+
+            # filter for author
+            recent_authors = compute_recent_authors(pr_df)
+
+            if email:
+                import reporting
+                with profiling.span('email'):
+                    reporting.run_tracking(pr_df, commit_df, srcpath, output, repo_name, home_url, recent_authors)
+
+            generate_site(pr_df, commit_df, output, srcpath, repo_name, home_url, recent_authors, plotgraphs,
+                          output_mode, jobs)
+    finally:
+        # also when failing, to see where
+        profiling.write_profile(output)
+        profiling.stop_sampling()
+
+
+def compute_cache_path(output, cache=None, no_cache=False):
+    """ Selects the cache of parsed commits, see the cache options of main
+    :return: the cache file, or None to parse every commit
+    :rtype: str
+    """
+    if no_cache:
+        return None
+    os.makedirs(output, exist_ok=True)
+    return cache or os.path.join(output, commitcache.CACHE_FILENAME)
+
+
+def generate_site(pr_df, commit_df, output, srcpath, repo_name, home_url, recent_authors, plotgraphs=True,
+                  output_mode='static', jobs=1, authors=None, last_changes=None):
+    """ Writes the pages and charts of all views
+    :param pd.DataFrame pr_df: the pull request dataframe
+    :param pd.DataFrame commit_df: the commit dataframe
+    :param str output: the directory to write the site to
+    :param str srcpath: the installation directory holding the templates
+    :param str repo_name: the name of the repository
+    :param str home_url: the url the output directory is served at
+    :param list[str] recent_authors: the authors to write views for, see compute_recent_authors
+    :param bool plotgraphs: False to write the pages only
+    :param str output_mode: 'static' for pages with rendered charts, 'dashboard' for a single page and data file
+    :param int jobs: the maximum number of worker processes to render charts with
+    :param list[str] authors: optional subset of recent_authors to write the static views of, besides the team views
+    :param dict[str, datetime.datetime] last_changes: optional date of the latest changed record per author, to only
+        write the static views of timeframes holding changed records, see write_static_site
+    """
+    # aggregate once per frequency over the widest date range, each view slices these
+    # in UTC, as the date index
+    now = gitparser.utcnow()
+    dateranges = compute_dateranges(now)
+    start_date = min(date_from for date_from, _, _ in dateranges)
+    cubes = {}
+    if plotgraphs or 'dashboard' == output_mode:
+        cubes = compute_cubes(pr_df, commit_df, start_date, now)
+
+    if 'dashboard' == output_mode:
+        import dashboard
+        with profiling.span('dashboard'):
+            bundle = dashboard.compute_bundle(cubes, start_date, dateranges, VIEWS, recent_authors, repo_name)
+            dashboard.write_dashboard(bundle, output, srcpath, home_url)
+        return
+
+    charts = write_static_site(cubes, dateranges, output, srcpath, repo_name, home_url, recent_authors, plotgraphs,
+                               authors, last_changes)
+    if plotgraphs:
+        import graphs
+        # charts are independent of each other, render them all at once
+        with profiling.span('render_all', rows=len(charts)):
+            no_hits, no_misses = graphs.render_jobs(charts, jobs,
+                                                    os.path.join(output, graphs.RENDER_CACHE_FILENAME))
+        logging.info('Render cache: {no_hits:d} charts unchanged, {no_misses:d} rendered'.format(
+            no_hits=no_hits, no_misses=no_misses))
+
+
+def compute_cubes(pr_df, commit_df, start_date, now):
+    """ Aggregates the dataframes once per frequency of VIEWS, see aggregation.Cube
+    :rtype: dict[str, aggregation.Cube]
+    """
+    import aggregation
+
+    return {frequency: aggregation.Cube(pr_df, commit_df, frequency, start_date, now) for _, frequency, _ in VIEWS}
+
+
+def write_static_site(cubes, dateranges, output, srcpath, repo_name, home_url, recent_authors, plotgraphs=True,
+                      authors=None, last_changes=None):
+    """ Writes the page of every view, timeframe and author, and the data of their charts
+    :param dict[str, aggregation.Cube] cubes: the aggregated statistics per frequency, see compute_cubes
+    :param dateranges: tuples of start date, directory and text per timeframe, see compute_dateranges
+    :param list[str] authors: optional subset of recent_authors to write the views of, besides the team views
+    :param dict[str, datetime.datetime] last_changes: optional date of the latest changed record per author, views
+        of timeframes starting after it are left as they are, as are team views of timeframes starting after the
+        latest change of any author
+    :return: the render jobs of the charts, see graphs.render_jobs
+    :rtype: list[dict]
+    """
     with open(os.path.join(srcpath, 'templates', 'index.html'), 'r') as f:
         page_text = f.read()
 
+    # assets are shared by all views, pages and chart data are only written if changed
+    writer = sitefiles.SiteWriter(output)
+    writer.copy_static_assets(srcpath)
+    if plotgraphs:
+        import graphs
+    charts = []
+    if last_changes is not None:
+        last_changes = dict(last_changes, **{'': max(last_changes.values(), default=None)})
     for (date_from, timeframe, timeframe_text), (view, frequency, view_text), author in \
-            itertools.product(compute_dateranges(),
-                              [('', 'M', 'Monthly'), ('weekly/', 'W', 'Weekly'), ('daily/', 'D', 'Daily')],
-                              [''] + recent_authors):
+            itertools.product(dateranges, VIEWS, [''] + (recent_authors if authors is None else authors)):
+        if last_changes is not None and (last_changes.get(author) is None or last_changes[author] < date_from):
+            # nothing changed in the timeframe of this view
+            continue
 
         target_path = os.path.join(output, view, timeframe, author.replace(' ', '_'), 'index.html')
-        print(target_path)
+        logging.debug('Writing {path}'.format(path=target_path))
         dirname = os.path.dirname(target_path)
         os.makedirs(dirname, exist_ok=True)
-        shutil.copy(os.path.join(srcpath, 'templates', 'styles.css'), os.path.join(dirname, 'styles.css'))
-        shutil.copy(os.path.join(srcpath, 'templates', 'scripts.js'), os.path.join(dirname, 'scripts.js'))
-        with open(target_path, 'w') as f:
-            f.write(page_text.format(name=repo_name if '' == author else author,
-                                     nav=htmls.compute_nav(home_url, view, timeframe, recent_authors),
-                                     home_url=home_url, timeframe=timeframe, view=view,
-                                     author='' if '' == author else author.replace(' ', '_') + '/',
-                                     timeframe_text=timeframe_text, view_text=view_text))
-        # plot graphs
-        if plotgraphs:
-            graphs.plot_pr_stats(pr_df, dirname,
-                                 authors=recent_authors if '' == author else [author], start_date=date_from,
-                                 frequency=frequency, view_text=view_text, review_authors=recent_authors)
-            graphs.plot_commit_stats(commit_df, dirname, start_date=date_from,
-                                     frequency=frequency, view_text=view_text,
-                                     authors=recent_authors if '' == author else [author])
+        with profiling.span('view', frequency=frequency, timeframe=timeframe_text, author=author) as s, \
+                profiling.sampling('view'):
+            writer.write(target_path, page_text.format(
+                name=repo_name if '' == author else author,
+                nav=htmls.compute_nav(home_url, view, timeframe, recent_authors), home_url=home_url,
+                timeframe=timeframe, view=view, author='' if '' == author else author.replace(' ', '_') + '/',
+                timeframe_text=timeframe_text, view_text=view_text,
+                static=sitefiles.compute_static_prefix(output, dirname)))
+            # plot graphs
+            if plotgraphs:
+                view_charts = graphs.pr_render_jobs(cubes[frequency], dirname,
+                                                    authors=recent_authors if '' == author else [author],
+                                                    start_date=date_from, view_text=view_text,
+                                                    review_authors=recent_authors, writer=writer)
+                view_charts += graphs.commit_render_jobs(cubes[frequency], dirname, start_date=date_from,
+                                                         view_text=view_text,
+                                                         authors=recent_authors if '' == author else [author],
+                                                         writer=writer)
+                s.rows = len(view_charts)
+                charts += view_charts
+    writer.log_stats()
+    return charts
 
 
 def compute_recent_authors(pr_df):
     date_threshold = pr_df.index.max().to_pydatetime() - datetime.timedelta(days=365 / 3)
-    recent_authors = np.sort(pr_df[pr_df.index > date_threshold][gitparser.AUTHOR].unique())
+    recent_authors = sorted(pr_df[pr_df.index > date_threshold][gitparser.AUTHOR].astype(str).unique())
     recent_authors = [ra.strip().replace('\n', '') for ra in recent_authors]
     return recent_authors
 
 
-def fetch_commit_df(directory, output, resume):
-    results_path = os.path.join(output, 'commits.csv')
-    commit_df = None
-    if resume:
+def update_df(df, name, directory, output, stream_fn, convert_fn, all_refs, jobs=1):
+    """ Appends the commits made since the last ingestion of each repository to the given dataframe
+    :param pd.DataFrame df: the previously persisted dataframe, or None
+    :param str name: the name of the dataframe in the ingestion state, e.g. 'commits'
+    :param str directory: comma separated repository paths
+    :param str output: the output directory holding the ingestion state
+    :param stream_fn: function streaming the records of a repository, e.g. stream_commits
+    :param convert_fn: function converting a list of records to a dataframe
+    :param bool all_refs: True if stream_fn reads the history of all refs, False if only HEAD
+    :param int jobs: the maximum number of repositories to ingest at once
+    :return: the updated dataframe, and the ref tips per repository it covers, to save with history.save_refs once
+        the dataframe is saved, see save_fetched_df
+    :rtype: tuple[pd.DataFrame, dict[str, dict[str, str]]]
+    """
+    import pandas as pd
+
+    state = history.load_state(output)
+    if df is None or gitparser.REPO not in df.columns or gitparser.TZ_OFFSET not in df.columns:
+        # nothing to build upon, or saved without the timezone offsets
+        df = None
+        state[name] = {}
+    seen = state.setdefault(name, {})
+    frames = [] if df is None else [df]
+    repos, repo_refs, repo_revisions = [], [], []
+    for d in directory.split(','):
+        repo = os.path.abspath(d)
+        refs = history.select_refs(gitlog.read_refs(repo), all_refs)
+        if seen.get(repo) == refs:
+            logging.info('No new commits in {repo}'.format(repo=repo))
+            continue
+        revisions = history.compute_revisions(seen.get(repo), refs, all_refs, repo)
+        if revisions is None:
+            logging.info('Rebuilding {name} of {repo}'.format(name=name, repo=repo))
+            frames = [f[f[gitparser.REPO] != repo] for f in frames]
+            revisions = []
+        repos.append(repo)
+        repo_refs.append(refs)
+        repo_revisions.append(revisions)
+
+    for repo, refs, records in zip(repos, repo_refs, ingest_repositories(stream_fn, repos, repo_revisions, jobs)):
+        logging.info('Ingested {no_records:d} new {name} from {repo}'.format(
+            no_records=len(records), name=name, repo=repo))
+        if records:
+            new_df = convert_fn(records)
+            new_df[gitparser.REPO] = repo
+            frames.append(new_df)
+        seen[repo] = refs
+
+    if not frames:
+        empty_df = convert_fn([])
+        empty_df[gitparser.REPO] = ''
+        frames.append(empty_df)
+    df = pd.concat(frames, sort=False)
+    # ref tips which were deleted since the last run can make commits reappear, and repositories sharing history,
+    # e.g. forks, hold the same commits
+    df = df[~df[gitparser.HASH].duplicated(keep='first')]
+    return df, seen
+
+
+def save_fetched_df(df, output, name, csv, refs=None):
+    """ Saves a fetched dataframe, then the ref tips it covers if fetched incrementally
+    :param pd.DataFrame df: the dataframe
+    :param str output: the output directory
+    :param str name: the name of the dataframe, e.g. 'commits'
+    :param bool csv: also export the dataframe as csv
+    :param dict[str, dict[str, str]] refs: the ref tips per repository of an incremental fetch, see update_df
+    """
+    import storage
+
+    if refs is None:
         try:
-            commit_df = pd.read_csv(results_path, parse_dates=True, index_col=0)
+            storage.save_df(df, output, name, csv)
         except OSError:
             pass
-    if commit_df is None:
-        # load the git log and parse it
-        commits = []
-        for d in directory.split(','):
-            with cd(d):
-                log_text = load_commit_log()
-                commits += gitparser.extract_commits(log_text)
+        return
+    # the ingestion state must not claim commits which were not saved, so that the next run ingests them again
+    storage.save_df(df, output, name, csv)
+    history.save_refs(output, name, refs)
+
+
+def fetch_commit_df(directory, output, resume, backend='stat', incremental=False, csv=False, jobs=1, commit_df=None,
+                    titles=True, cache_path=None):
+    import storage
+
+    if commit_df is None and (resume or incremental):
+        commit_df = storage.load_df(output, 'commits')
+        if commit_df is not None and gitparser.TZ_OFFSET not in commit_df.columns:
+            # saved without the timezone offsets, rebuild
+            commit_df = None
+        if commit_df is not None and not incremental:
+            commit_df = storage.apply_dtypes(commit_df, titles)
+            storage.log_memory_usage(commit_df, 'commits')
+            return commit_df
+    refs = None
+    if incremental:
+        commit_df, refs = update_df(commit_df, 'commits', directory, output,
+                              partial(stream_commits, backend, cache_path=cache_path),
+                              convert_commits_to_dateframe, all_refs=True, jobs=jobs)
+    else:
+        # load the git logs and parse them
+        commits = drop_duplicates(itertools.chain.from_iterable(
+            ingest_repositories(partial(stream_commits, backend, cache_path=cache_path), directory.split(','),
+                                jobs=jobs)))
         commit_df = convert_commits_to_dateframe(commits)
 
-        # ensure output directory exists
-        os.makedirs(output, exist_ok=True)
-        try:
-            commit_df.to_csv(results_path)
-        except OSError:
-            pass
+    commit_df = storage.apply_dtypes(commit_df, titles)
+    storage.log_memory_usage(commit_df, 'commits')
+    save_fetched_df(commit_df, output, 'commits', csv, refs)
     return commit_df
 
 
-def fetch_pr_df(directory, output, resume):
-    results_path = os.path.join(output, 'prs.csv')
-    pr_df = None
-    if resume:
-        try:
-            pr_df = pd.read_csv(results_path, parse_dates=True, index_col=0)
-        except OSError:
-            pass
-    if pr_df is None:
-        # load the git log and parse it
-        merges = []
-        for d in directory.split(','):
-            with cd(d):
-                log_text = load_pr_log()
-                pr_commits = gitparser.extract_pull_requests(log_text)
-                merges += pr_commits
+def fetch_pr_df(directory, output, resume, backend='stat', incremental=False, csv=False, jobs=1, pr_df=None,
+                titles=True, cache_path=None):
+    import storage
+
+    if pr_df is None and (resume or incremental):
+        pr_df = storage.load_df(output, 'prs')
+        if pr_df is not None and (gitparser.REVIEWERS not in pr_df.columns or
+                                  gitparser.TZ_OFFSET not in pr_df.columns):
+            # saved with one hot reviewer columns or without the timezone offsets, rebuild
+            pr_df = None
+        if pr_df is not None and not incremental:
+            pr_df = storage.apply_dtypes(pr_df, titles)
+            storage.log_memory_usage(pr_df, 'prs')
+            return pr_df
+    refs = None
+    if incremental:
+        pr_df, refs = update_df(pr_df, 'prs', directory, output,
+                          partial(stream_pull_requests, backend, cache_path=cache_path),
+                          convert_prs_to_dateframe, all_refs=False, jobs=jobs)
+    else:
+        # load the git logs and parse them
+        merges = drop_duplicates(itertools.chain.from_iterable(
+            ingest_repositories(partial(stream_pull_requests, backend, cache_path=cache_path), directory.split(','),
+                                jobs=jobs)))
 
         logging.info("Extracted {no_merges:d} merged pull requests".format(no_merges=len(merges)))
 
         # convert to pandas dataframe
         pr_df = convert_prs_to_dateframe(merges)
 
-        # ensure output directory exists
-        os.makedirs(output, exist_ok=True)
-        try:
-            pr_df.to_csv(results_path)
-        except OSError:
-            pass
+    pr_df = storage.apply_dtypes(pr_df, titles)
+    storage.log_memory_usage(pr_df, 'prs')
+    save_fetched_df(pr_df, output, 'prs', csv, refs)
     return pr_df
 
 
@@ -0,0 +1,349 @@
+""" Instrumentation of the stages of a run
+
+Stages are timed with spans, which record their wall time, CPU time, the CPU time of the child processes which exited
+during the span (e.g. git), the peak resident memory of the process, how much that peak grew during the span and the
+number of rows handled:
+
+    with profiling.span('dataframe', records='commits') as s:
+        df = ...
+        s.rows = len(df)
+
+Stages which interleave, e.g. git writing the log a generator reads while its consumer parses it, are timed with
+stopwatches instead, which only count the time spent in their running sections, see Stopwatch.
+
+write_profile saves the spans of a run as a JSON profile, and as a Chrome trace which chrome://tracing and
+https://ui.perfetto.dev show as a timeline. Spans in worker processes are returned to the parent and recorded there,
+see collecting.
+
+Hot loops are additionally sampled when sampling is started, see start_sampling.
+"""
+import collections
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+PROFILE_FILENAME = 'profile.json'
+TRACE_FILENAME = 'profile.trace.json'
+SAMPLES_FILENAME = 'profile.samples.txt'
+
+_lock = threading.Lock()
+_spans = []
+_sampler = None
+# per thread: the stack of running stopwatches, and the list collecting recorded spans, see collecting
+_local = threading.local()
+
+
+def compute_peak_rss():
+    """ Reads the peak resident memory of this process
+    :return: the number of bytes, or None if unknown
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if 'darwin' == sys.platform else peak * 1024
+
+
+class Span(object):
+    """ A timed stage of a run, see span """
+
+    def __init__(self, name, rows=None, record=True, **args):
+        """
+        :param str name: the stage, e.g. 'parse'
+        :param int rows: the number of rows handled, can also be set while the span is open
+        :param bool record: False to only measure, e.g. in worker processes which return as_dict to their parent
+        :param args: details shown with the span, e.g. the repository
+        """
+        self.name = name
+        self.rows = rows
+        self.record = record
+        self.args = args
+        self.pid = self.tid = None
+        self.start = self.wall = self.cpu = self.child_cpu = self.peak_rss = self.peak_rss_growth = None
+
+    def __enter__(self):
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.start = time.time()
+        self._start_counter = time.perf_counter()
+        self._start_times = os.times()
+        self._start_peak_rss = compute_peak_rss()
+        return self
+
+    def __exit__(self, *exc_info):
+        times = os.times()
+        self.wall = round(time.perf_counter() - self._start_counter, 6)
+        # rounded, the sums of the os.times fields are not exact
+        self.cpu = round(max(0.0, times.user + times.system - self._start_times.user - self._start_times.system), 6)
+        self.child_cpu = round(max(0.0, times.children_user + times.children_system -
+                                   self._start_times.children_user - self._start_times.children_system), 6)
+        self.finish()
+        return False
+
+    def finish(self):
+        """ Measures the memory and records the span """
+        # the peak of the process, which only grows, so the growth is what the span added to it
+        self.peak_rss = compute_peak_rss()
+        if self.peak_rss is not None:
+            self.peak_rss_growth = self.peak_rss - self._start_peak_rss
+        if self.record:
+            record(self.as_dict())
+
+    def as_dict(self):
+        return {'name': self.name, 'start': self.start, 'wall': self.wall, 'cpu': self.cpu,
+                'child_cpu': self.child_cpu, 'peak_rss': self.peak_rss, 'peak_rss_growth': self.peak_rss_growth,
+                'rows': self.rows, 'pid': self.pid, 'tid': self.tid, 'args': self.args}
+
+
+class Stopwatch(Span):
+    """ A span of a stage which interleaves with others, e.g. a generator, counting the wall, CPU and child CPU time of
+    its running sections only. Entering a running section pauses the stopwatch running in the same thread, if any, so
+    the time of nested stages is not counted twice.
+    """
+
+    def __enter__(self):
+        super(Stopwatch, self).__enter__()
+        self.wall = self.cpu = self.child_cpu = 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = round(self.wall, 6)
+        self.cpu = round(self.cpu, 6)
+        self.child_cpu = round(self.child_cpu, 6)
+        self.finish()
+        return False
+
+    def resume(self):
+        self._start_counter = time.perf_counter()
+        self._resume_times = os.times()
+
+    def pause(self):
+        times = os.times()
+        self.wall += time.perf_counter() - self._start_counter
+        self.cpu += max(0.0, times.user + times.system - self._resume_times.user - self._resume_times.system)
+        # child processes are counted when they exit, e.g. git when waited for
+        self.child_cpu += max(0.0, times.children_user + times.children_system -
+                              self._resume_times.children_user - self._resume_times.children_system)
+
+    @contextmanager
+    def running(self):
+        """ Counts the enclosed code, which must not yield, to the stopwatch """
+        stack = _local.__dict__.setdefault('stopwatches', [])
+        if stack:
+            stack[-1].pause()
+        stack.append(self)
+        self.resume()
+        try:
+            yield
+        finally:
+            self.pause()
+            stack.pop()
+            if stack:
+                stack[-1].resume()
+
+
+def span(name, rows=None, **args):
+    """ Times the enclosed stage, see Span
+    :rtype: Span
+    """
+    return Span(name, rows, **args)
+
+
+def stopwatch(name, rows=None, **args):
+    """ Times the running sections of the enclosed stage, see Stopwatch
+    :rtype: Stopwatch
+    """
+    return Stopwatch(name, rows, **args)
+
+
+def timed(watch, iterable):
+    """ Iterates over the given iterable, counting the work of producing each item to the given stopwatch, but not the
+    work of the consumer between items
+    :param Stopwatch watch: the running stopwatch
+    :param collections.Iterable iterable: e.g. the lines git writes
+    :rtype: collections.Iterator
+    """
+    iterator = iter(iterable)
+    while True:
+        with watch.running():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def record(span_dict):
+    """ Records a finished span, e.g. one returned by a worker process
+    :param dict span_dict: the span, see Span.as_dict
+    """
+    collector = getattr(_local, 'collector', None)
+    if collector is not None:
+        collector.append(span_dict)
+        return
+    with _lock:
+        _spans.append(span_dict)
+
+
+@contextmanager
+def collecting():
+    """ Collects the spans recorded by the enclosed code in the current thread instead of recording them, e.g. in worker
+    processes which return them to their parent to record
+    :return: the list the spans are collected in
+    :rtype: list[dict]
+    """
+    previous = getattr(_local, 'collector', None)
+    _local.collector = []
+    try:
+        yield _local.collector
+    finally:
+        _local.collector = previous
+
+
+def reset():
+    """ Forgets the recorded spans and samples, e.g. at the start of a run of the daemon """
+    with _lock:
+        del _spans[:]
+    if _sampler is not None:
+        _sampler.counts.clear()
+
+
+def compute_summary(spans):
+    """ Sums the spans per stage
+    :param list[dict] spans: the recorded spans
+    :return: the number of spans, their total wall, cpu and child cpu time and rows, the highest peak resident
+        memory of the process and the largest growth of it per stage
+    :rtype: dict[str, dict]
+    """
+    summary = collections.OrderedDict()
+    for s in sorted(spans, key=lambda s: s['start']):
+        stage = summary.setdefault(s['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'rows': 0,
+                                               'peak_rss': None, 'peak_rss_growth': None})
+        stage['count'] += 1
+        for key in ['wall', 'cpu', 'child_cpu', 'rows']:
+            stage[key] += s[key] or 0
+        for key in ['peak_rss', 'peak_rss_growth']:
+            if s.get(key) is not None:
+                stage[key] = max(stage[key] or 0, s[key])
+    return summary
+
+
+def compute_trace(spans):
+    """ Converts spans to Chrome trace events
+    :param list[dict] spans: the recorded spans
+    :return: complete events of the Trace Event Format
+    :rtype: dict
+    """
+    origin = min([s['start'] for s in spans] or [0])
+    events = []
+    for s in spans:
+        args = dict(s['args'], rows=s['rows'], cpu=s['cpu'], child_cpu=s['child_cpu'], peak_rss=s['peak_rss'],
+                    peak_rss_growth=s.get('peak_rss_growth'))
+        events.append({'name': s['name'], 'cat': 'git-quality', 'ph': 'X', 'ts': (s['start'] - origin) * 1e6,
+                       'dur': s['wall'] * 1e6, 'pid': s['pid'], 'tid': s['tid'], 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_profile(output):
+    """ Writes the spans recorded since the last reset as a JSON profile and a Chrome trace, and the samples if
+    sampling, to the given directory
+    :param str output: the output directory
+    """
+    with _lock:
+        spans = list(_spans)
+    os.makedirs(output, exist_ok=True)
+    profile = {'argv': sys.argv, 'pid': os.getpid(), 'peak_rss': compute_peak_rss(),
+               'summary': compute_summary(spans), 'spans': spans}
+    with open(os.path.join(output, PROFILE_FILENAME), 'w') as f:
+        json.dump(profile, f, indent=1, default=str)
+    with open(os.path.join(output, TRACE_FILENAME), 'w') as f:
+        json.dump(compute_trace(spans), f, default=str)
+    if _sampler is not None:
+        _sampler.write(os.path.join(output, SAMPLES_FILENAME))
+    logging.info('Wrote profile of {no_spans:d} spans to {path}'.format(
+        no_spans=len(spans), path=os.path.join(output, PROFILE_FILENAME)))
+
+
+class Sampler(object):
+    """ Samples the stack of the main thread on SIGPROF, while a sampled section is active, see sampling """
+
+    def __init__(self, interval):
+        """
+        :param float interval: the CPU seconds between samples
+        """
+        self.interval = interval
+        self.sections = []
+        self.counts = collections.Counter()
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def sample(self, signum, frame):
+        if not self.sections:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{function} ({filename}:{line:d})'.format(
+                function=code.co_name, filename=os.path.basename(code.co_filename), line=code.co_firstlineno))
+            frame = frame.f_back
+        stack.append(self.sections[-1])
+        self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """ Writes the samples as collapsed stacks, one line per stack, which flamegraph.pl and speedscope read """
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write('{stack} {count:d}\n'.format(stack=stack, count=count))
+
+
+def start_sampling(interval=0.005):
+    """ Starts sampling the sections enclosed by sampling, on unix and from the main thread only
+    :param float interval: the CPU seconds between samples
+    """
+    global _sampler
+    if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        logging.warning('Sampling is only supported in the main thread on unix')
+        return
+    _sampler = Sampler(interval)
+    _sampler.start()
+
+
+def stop_sampling():
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
+@contextmanager
+def sampling(section):
+    """ Marks a hot loop to sample while sampling is started, samples are labelled with the innermost section
+    :param str section: the label of the samples, e.g. 'parse'
+    """
+    sampler = _sampler
+    if sampler is None:
+        yield
+        return
+    sampler.sections.append(section)
+    try:
+        yield
+    finally:
+        sampler.sections.remove(section)
@@ -6,13 +6,33 @@
 import math
 import numpy as np
 
-import cairocffi as cairo
+
+# hours before this are not drawn
+FIRST_HOUR = 5
+
+
+def compute_punchcard(dates):
+    """ Counts the given dates per day of week and hour in a single pass
+    :param pd.DatetimeIndex dates: the dates to count
+    :return: counts indexed by day of week (Monday first) and hour
+    :rtype: np.ndarray
+    """
+    dates = dates[~dates.isna()]
+    cells = np.asarray(dates.dayofweek, dtype=int) * 24 + np.asarray(dates.hour, dtype=int)
+    return np.bincount(cells, minlength=7 * 24).reshape(7, 24)
 
 
 def plot_punchcard(width, height, dates):
-    
-    def get_x_y_from_date(day, hour):
-        y = top + (days.index(day) + 1) * distance
+    return draw_punchcard(width, height, compute_punchcard(dates))
+
+
+def draw_punchcard(width, height, grid):
+    # cairo is only needed for drawing, not for counting
+    import cairocffi as cairo
+
+    def get_x_y_from_date(day_idx, hour):
+        # Sunday is drawn first
+        y = top + ((day_idx + 1) % 7 + 1) * distance
         x = left + (hour + 1) * distance
         return x, y
 
@@ -35,35 +55,14 @@ def plot_punchcard(width, height, dates):
     days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
     hours = ['12am'] + [str(x) for x in range(1, 12)] + ['12pm'] + [str(x) for x in range(1, 12)]
 
-    stats = {}
-    for day_idx, d in enumerate(days):
-        stats[d] = {}
-        for h in range(5, 29):
-            stats[d][h] = np.sum(np.logical_and(dates.dayofweek == day_idx, dates.hour == h))
-            if np.isnan(stats[d][h]):
-                stats[d][h] = np.sum = 0
-
     days = [days[-1]] + days[:-1]
 
-    def get_length(nr):
-        if nr == 0:
-            return 0
-        for i in range(1, int(distance/2)):
-            if i*i <= nr and nr < (i+1)*(i+1):
-                return i
-        if nr == max_range:
-            return distance/2-1
-    
-    # normalize
-    all_values = []
-    for d, hour_pair in stats.items():
-        for h, value in hour_pair.items():
-            all_values.append(value)
-    max_value = 1 + max(all_values)
-    final_data = []
-    for d, hour_pair in stats.items():
-        for h, value in hour_pair.items():
-            final_data.append( [ get_length(int( float(stats[d][h]) / max_value * max_range )), get_x_y_from_date(d, h) ] )
+    # normalize, the radius of a circle grows with the square root of its count
+    stats = grid[:, FIRST_HOUR:]
+    max_value = 1 + stats.max()
+    lengths = np.floor(np.sqrt((stats / max_value * max_range).astype(int)))
+    final_data = [[lengths[day_idx, h - FIRST_HOUR], get_x_y_from_date(day_idx, h)]
+                  for day_idx in range(7) for h in range(FIRST_HOUR, 24)]
     
     surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
     cr = cairo.Context(surface)
@@ -1,21 +1,56 @@
 """ Module for emailing notifications"""
 import datetime
+import logging
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 
 import html2text
+import numpy as np
 import pandas as pd
 
+import gitparser
 import htmls
+import mailer
+import sitefiles
 import util
 
+SUMMARY_SUBJECT = 'git-quality weekly summary'
 
-def email_awards(email_address, awards_df, repo_name, srcpath=os.getcwd()):
+
+def send_emails(envelopes, transport=None):
+    """ Delivers the given messages with the given transport, or with the configured one
+    :param list[mailer.Envelope] envelopes: the messages, see mailer.build_message
+    :param transport: e.g. a mailer.MemorySink, defaults to mailer.create_transport
+    :return: the recipients which could not be delivered to, with their errors
+    :rtype: dict[str, str]
+    """
+    own_transport = transport is None
+    if own_transport:
+        transport = mailer.create_transport(util.read_config('email'))
+    try:
+        refused = transport.send(envelopes)
+    finally:
+        if own_transport:
+            transport.close()
+    for recipient, error in refused.items():
+        logging.error('Could not email {recipient}: {error}'.format(recipient=recipient, error=error))
+    return refused
+
+
+def build_email(email_address, content, subject):
+    """ Builds an email with the given html content and its plain text rendering
+    :param str email_address: comma separated addresses to email
+    :rtype: mailer.Envelope
+    """
+    from_address = util.read_config('email')['from']
+    recipients = [e.strip() for e in email_address.split(',') if e.strip()]
+    return mailer.build_message(from_address, recipients, subject, content, html2text.html2text(content))
+
+
+def email_awards(email_address, awards_df, repo_name, srcpath=os.getcwd(), transport=None):
     """ Emails award winners to the given email address
     :param str email_address: the address to email
     :param pd.DataFrame awards_df: the awards dataframe
+    :param transport: the transport to send with, see send_emails
     """
     report_filename = os.path.join(srcpath, 'templates', 'email_report.html')
     with open(report_filename, 'r') as f:
@@ -23,43 +58,117 @@ def email_awards(email_address, awards_df, repo_name, srcpath=os.getcwd()):
     month = awards_df.index[0].split()[1]
     table = awards_df.to_html(col_space=5)
     content = content.format(repo=repo_name, month=month, table=table)
-
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = '{repo} quality stats awards for {month}'.format(repo=repo_name, month=month)
-    from_address = util.read_config('email')['from']
-    msg['From'] = from_address
-    msg['To'] = email_address
-    msg.attach(MIMEText(content, 'html'))
-    msg.attach(MIMEText(html2text.html2text(content), 'plain'))
-    s = smtplib.SMTP('localhost')
-    for e in email_address.split(','):
-        s.sendmail(from_address, [e], msg.as_string())
-    s.close()
+    subject = '{repo} quality stats awards for {month}'.format(repo=repo_name, month=month)
+    return send_emails([build_email(email_address, content, subject)], transport)
 
 
-def email_summary(email_address, content, subject):
+def email_summary(email_address, content, subject, transport=None):
     """ Emails award winners to the given email address
     :param str email_address: the address to email
+    :param transport: the transport to send with, see send_emails
     """
-    from_address = util.read_config('email')['from']
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = from_address
-    msg['To'] = email_address
-    msg.attach(MIMEText(html2text.html2text(content), 'plain'))
-    msg.attach(MIMEText(content, 'html'))
-    s = smtplib.SMTP('localhost')
-    for e in email_address.split(','):
-        s.sendmail(from_address, [e], msg.as_string())
-    s.close()
-
-
-def run_tracking(pr_df, commit_df, srcpath, output, repo_name, home_url, recent_authors):
+    return send_emails([build_email(email_address, content, subject)], transport)
+
+
+def compute_weekly_stats(pr_df, commit_df, today):
+    """ Computes the statistics of the weekly summary for all authors at once, grouping the last two weeks once
+    :param pd.DataFrame pr_df: the pull request dataframe
+    :param pd.DataFrame commit_df: the commit dataframe
+    :param datetime.datetime today: the end of the week
+    :return: frame indexed by author with the pull requests, reviews, commits and changed lines of the last week, and
+        the pull requests and reviews of the week before
+    :rtype: pd.DataFrame
+    """
+    week_start = np.datetime64(today - datetime.timedelta(days=7))
+    previous_week_start = np.datetime64(today - datetime.timedelta(days=14))
+
+    # compare as in aggregation.daterange_buckets, whether or not the index is timezone aware
+    dates = pr_df.index.values.astype('datetime64[ns]')
+    selected = dates >= previous_week_start
+    prs = pr_df[selected]
+    week = np.where(dates[selected] >= week_start, 'this', 'previous')
+    pr_stats = prs.groupby([prs[gitparser.AUTHOR].astype(str).values, week])[gitparser.NO_REVIEWS].agg(
+        ['size', 'sum']).unstack(fill_value=0)
+    pr_stats = pr_stats.reindex(columns=pd.MultiIndex.from_product([['size', 'sum'], ['this', 'previous']]),
+                                fill_value=0)
+    pr_stats.columns = ['no_prs', 'no_previous_prs', 'no_reviews', 'no_previous_reviews']
+
+    dates = commit_df.index.values.astype('datetime64[ns]')
+    commits = commit_df[dates >= week_start]
+    commit_stats = pd.DataFrame({'no_lines': commits[gitparser.INSERTIONS] + commits[gitparser.DELETIONS],
+                                 'no_code_lines': commits[gitparser.CODE_CHANGES]}).groupby(
+        commits[gitparser.AUTHOR].astype(str).values).agg(no_commits=('no_lines', 'size'),
+                                                        no_lines=('no_lines', 'sum'),
+                                                        no_code_lines=('no_code_lines', 'sum'))
+    return pr_stats.join(commit_stats, how='outer').fillna(0).astype(np.int64).rename_axis(gitparser.AUTHOR)
+
+
+def compute_review_text(stats):
+    """ Compares the mean reviews per pull request of the last week with the week before
+    :param dict stats: the statistics of an author or the team, see compute_weekly_stats
+    :rtype: str
+    """
+    if not stats['no_prs']:
+        return 'There were no pull requests to review in the last week'
+    this_mean = stats['no_reviews'] / stats['no_prs']
+    if not stats['no_previous_prs']:
+        return 'The mean reviews per pull request was {avg_review_week:.2f}, ' \
+               'there were no pull requests the previous week'.format(avg_review_week=this_mean)
+    last_mean = stats['no_previous_reviews'] / stats['no_previous_prs']
+    return 'The mean reviews per pull request was {avg_review_week:.2f}, ' \
+           '{status} previous week\'s which saw a mean rate of {avg_review_month:.2f}'.format(
+        avg_review_week=this_mean, avg_review_month=last_mean,
+        status='about the same as' if last_mean - 0.1 < this_mean < last_mean + 0.1 else
+        'higher than' if this_mean > last_mean else 'lower than')
+
+
+def render_summaries(page_text, stats, repo_name, home_url, authors):
+    """ Renders the summary of the team and the digest of each of the given authors from one template
+    :param str page_text: the summary template
+    :param pd.DataFrame stats: the statistics per author, see compute_weekly_stats
+    :param list[str] authors: the authors to write digests for
+    :return: the pages keyed by author, the team summary keyed by None
+    :rtype: dict[str, str]
+    """
+    rows = stats.reindex(authors, fill_value=0).to_dict('index')
+    rows[None] = stats.sum().to_dict()
+    return {author: page_text.format(
+        no_prs=row['no_prs'], no_commits=row['no_commits'], no_lines=row['no_lines'],
+        no_code_lines=row['no_code_lines'], review_text=compute_review_text(row),
+        name=repo_name if author is None else '{repo} {author}'.format(repo=repo_name, author=author),
+        link=home_url if author is None else '{home_url}{name_ref}/'.format(home_url=home_url,
+                                                                            name_ref=author.replace(' ', '_')))
+        for author, row in rows.items()}
+
+
+def select_authors(authors, recent_authors):
+    """ Parses the authors setting of the summary config
+    :param str authors: 'all' for the recent authors, or comma separated names
+    :rtype: list[str]
+    """
+    if 'all' == authors.strip().lower():
+        return list(recent_authors)
+    return [a.strip() for a in authors.split(',') if a.strip()]
+
+
+def read_addresses():
+    """ Reads the addresses to send the digests of authors to from the addresses section of the config
+    :return: the address per author name, in lower case as config keys are
+    :rtype: dict[str, str]
+    """
+    parser = util.load_config()
+    if not parser.has_section('addresses'):
+        return {}
+    return {author: address.strip() for author, address in parser.items('addresses') if address.strip()}
+
+
+def run_tracking(pr_df, commit_df, srcpath, output, repo_name, home_url, recent_authors, transport=None):
     config = util.read_config('summary')
     email = config['email']
     day = config['day']
-    today = datetime.datetime.today()
-    is_today = today.strftime('%A') == day
+    # the summary is sent on the configured local day, its weeks end now in UTC, as the date index
+    is_today = datetime.datetime.today().strftime('%A') == day
+    today = gitparser.utcnow()
     objectives = config['objectives']
     authors = config['authors']
 
@@ -73,39 +182,27 @@ def run_tracking(pr_df, commit_df, srcpath, output, repo_name, home_url, recent_
     with open(os.path.join(srcpath, 'templates', 'tracking.html'), 'r') as f:
         tracking_text = f.read()
     target_path = os.path.join(output, 'tracking.html')
-    with open(target_path, 'w') as f:
-        f.write(tracking_text.format(name=repo_name,
-                                     nav=htmls.compute_nav(home_url, view='', timeframe='',
-                                                           recent_authors=recent_authors),
-                                     home_url=home_url, timeframe='', view='',
-                                     author='', monitors=monitors_str))
+    sitefiles.write_if_changed(target_path, tracking_text.format(
+        name=repo_name, nav=htmls.compute_nav(home_url, view='', timeframe='', recent_authors=recent_authors),
+        home_url=home_url, timeframe='', view='', author='', monitors=monitors_str))
 
     if is_today:
-        month_start = today - datetime.timedelta(days=14)
-        week_start = today - datetime.timedelta(days=7)
-        last_month_prs = pr_df[(pr_df.index >= month_start) & (pr_df.index < week_start)]
-        last_week_prs = pr_df[pr_df.index >= week_start]
-        last_week_commits = commit_df[commit_df.index >= week_start]
-        last_mean = last_month_prs.no_reviews.mean()
-        this_mean = last_week_prs.no_reviews.mean()
-        review_text = 'The mean reviews per pull request was {avg_review_week:.2f}, ' \
-                      '{status} previous week\'s which saw a mean rate of {avg_review_month:.2f}'.format(
-            avg_review_week=this_mean, avg_review_month=last_mean,
-            status='about the same as' if last_mean - 0.1 < this_mean < last_mean + 0.1 else
-            'higher than' if this_mean > last_mean else 'lower than'
-        )
-
+        stats = compute_weekly_stats(pr_df, commit_df, today)
         with open(os.path.join(srcpath, 'templates', 'summary.html'), 'r') as f:
             page_text = f.read()
-        page_text = page_text.format(
-            no_prs=last_week_prs.shape[0], no_commits=last_week_commits.shape[0],
-            no_lines=last_week_commits.insertions.sum() + last_week_commits.deletions.sum(),
-            no_code_lines=last_week_commits.code_changes.sum(),
-            review_text=review_text, name=repo_name,
-            link=home_url
-        )
-        subject = 'git-quality weekly summary'
-        email_summary(email, page_text, subject)
+        addresses = read_addresses()
+        authors = select_authors(authors, recent_authors)
+        for author in authors:
+            if author.lower() not in addresses:
+                logging.warning('No address to send the digest of {author} to, see the addresses section of the '
+                                'config'.format(author=author))
+        authors = [author for author in authors if author.lower() in addresses]
+        pages = render_summaries(page_text, stats, repo_name, home_url, authors)
+        # the team summary to the monitoring address, then a digest to each monitored author
+        envelopes = [build_email(email, pages[None], SUMMARY_SUBJECT)]
+        envelopes.extend(build_email(addresses[author.lower()], pages[author], '{subject} for {author}'.format(
+            subject=SUMMARY_SUBJECT, author=author)) for author in authors)
+        send_emails(envelopes, transport)
 
 
 def compute_awards(merge_df):
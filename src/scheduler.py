@@ -0,0 +1,346 @@
+""" Runs the repositories configured in the repo sections of the config on their own schedules
+
+Each [repo:<name>] section configures a run of main.run, with the options of main:
+
+    [repo:core]
+    directory=/srv/git/core,/srv/git/core-plugins
+    output=/var/www/quality/core
+    interval=3600
+    priority=10
+    jobs=2
+
+Runs are forked from the scheduler, which imports the modules of a run before the first fork, see preload, so that runs
+share them rather than each importing them afresh. The [scheduler] section limits the number of concurrent runs, and
+the memory they may use together as estimated from the memory their last run added to the scheduler's. Due repositories start in order of priority, highest first, at least stagger seconds apart.
+Repositories whose HEAD did not move since their last successful run are skipped. The state and durations of the runs
+are kept in a JSON file, which --status lists slowest first.
+"""
+import datetime
+import importlib
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import subprocess
+import time
+
+import click
+
+import gitlog
+import main
+import profiling
+import sitefiles
+import util
+
+logging.basicConfig(level=logging.INFO)
+
+REPO_PREFIX = 'repo:'
+STATE_FILENAME = 'scheduler_state.json'
+DEFAULT_CONCURRENCY = 2
+# MiB all runs may use together, 0 for no limit
+DEFAULT_MEMORY = 0
+# MiB estimated for the first run of a repository
+DEFAULT_RUN_MEMORY = 512
+DEFAULT_INTERVAL = 86400
+DEFAULT_STAGGER = 10
+DEFAULT_POLL = 30
+# durations kept per repository
+HISTORY_SIZE = 20
+MIB = 1 << 20
+# the modules main imports lazily, imported once by the scheduler for all runs
+PRELOAD_MODULES = ['numpy', 'pandas', 'pyarrow.feather', 'storage', 'aggregation', 'graphs', 'dashboard', 'reporting']
+BOOLEAN_OPTIONS = ['resume', 'email', 'plotgraphs', 'incremental', 'csv', 'titles', 'no_cache']
+STRING_OPTIONS = ['backend', 'output_mode', 'cache']
+INTEGER_OPTIONS = ['jobs']
+
+# fork where possible, so that runs inherit the imported modules
+CONTEXT = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+
+
+class Repo(object):
+    """ A scheduled run, see read_repos """
+
+    def __init__(self, name, directory, output, interval=DEFAULT_INTERVAL, priority=0, options=None):
+        """
+        :param str name: the name of the repo section
+        :param str directory: comma separated repository paths
+        :param str output: the directory to write the site to
+        :param float interval: the seconds between runs
+        :param int priority: repositories with higher priorities start first
+        :param dict options: further keyword arguments of main.run
+        """
+        self.name = name
+        self.directory = directory
+        self.output = output
+        self.interval = interval
+        self.priority = priority
+        self.options = options or {}
+
+    def read_heads(self):
+        """ Reads the HEAD of each repository
+        :rtype: dict[str, str]
+        """
+        return {d: gitlog.read_head(d) for d in self.directory.split(',')}
+
+
+def read_repos(parser, default_interval=DEFAULT_INTERVAL):
+    """ Reads the repo sections of the config
+    :param configparser.ConfigParser parser: the config, see util.load_config
+    :param float default_interval: the seconds between runs of repositories which do not set an interval
+    :rtype: list[Repo]
+    """
+    repos = []
+    for section in parser.sections():
+        if not section.startswith(REPO_PREFIX):
+            continue
+        config = parser[section]
+        if 'directory' not in config or 'output' not in config:
+            raise ValueError('Section [{section}] needs a directory and an output'.format(section=section))
+        options = {key: config.getboolean(key) for key in BOOLEAN_OPTIONS if key in config}
+        options.update({key: config[key] for key in STRING_OPTIONS if key in config})
+        options.update({key: config.getint(key) for key in INTEGER_OPTIONS if key in config})
+        repos.append(Repo(section[len(REPO_PREFIX):].strip(), config['directory'], config['output'],
+                          config.getfloat('interval', default_interval), config.getint('priority', 0), options))
+    return repos
+
+
+def load_state(path):
+    """ Loads the state of the runs per repository, see Scheduler
+    :rtype: dict[str, dict]
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path, state):
+    sitefiles.write_if_changed(path, json.dumps(state, indent=1, sort_keys=True))
+
+
+def preload():
+    """ Imports the modules of a run, before forking runs which then share them """
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            # runs which need the module fail with the same error
+            logging.warning('Could not preload {name}: {error}'.format(name=name, error=e))
+
+
+def run_repo(repo, srcpath, connection):
+    """ Runs main.run for a repository in a forked process, and sends its memory and error, if any, back
+    :param Repo repo: the repository to run
+    :param str srcpath: the installation directory holding the templates
+    :param multiprocessing.connection.Connection connection: the pipe to the scheduler
+    """
+    # the pages inherited from the scheduler, e.g. the preloaded modules, are shared rather than used by the run
+    inherited_rss = profiling.compute_peak_rss()
+    result = {}
+    try:
+        main.run(repo.directory, repo.output, srcpath, **repo.options)
+    except Exception as e:
+        logging.exception('Could not run {name}'.format(name=repo.name))
+        result['error'] = '{type}: {message}'.format(type=type(e).__name__, message=e)
+    peak_rss = profiling.compute_peak_rss()
+    if peak_rss is not None:
+        result['peak_rss'] = peak_rss - (inherited_rss or 0)
+    connection.send(result)
+    connection.close()
+
+
+class Run(object):
+    """ A run in progress, see Scheduler.launch """
+
+    def __init__(self, repo, process, connection, start, heads, memory):
+        self.repo = repo
+        self.process = process
+        self.connection = connection
+        self.start = start
+        self.heads = heads
+        self.memory = memory
+
+
+class Scheduler(object):
+    """ Starts the runs of the due repositories as the concurrency and memory limits allow """
+
+    def __init__(self, repos, srcpath, state_path, concurrency=DEFAULT_CONCURRENCY, memory=DEFAULT_MEMORY,
+                 run_memory=DEFAULT_RUN_MEMORY, stagger=DEFAULT_STAGGER):
+        """
+        :param list[Repo] repos: the repositories to run
+        :param str srcpath: the installation directory holding the templates
+        :param str state_path: the JSON file to keep the state of the runs in
+        :param int concurrency: the maximum number of concurrent runs
+        :param float memory: the MiB all runs may use together, 0 for no limit
+        :param float run_memory: the MiB estimated for the first run of a repository
+        :param float stagger: the minimum seconds between the starts of two runs
+        """
+        self.repos = repos
+        self.srcpath = srcpath
+        self.state_path = state_path
+        self.concurrency = concurrency
+        self.memory = memory * MIB
+        self.run_memory = run_memory * MIB
+        self.stagger = stagger
+        self.state = load_state(state_path)
+        self.running = {}
+        self.last_start = 0.0
+
+    def repo_state(self, repo):
+        return self.state.setdefault(repo.name, {})
+
+    def compute_due(self, now):
+        """ Finds the repositories not running whose interval passed since they were last checked
+        :return: the due repositories, in the order to start them
+        :rtype: list[Repo]
+        """
+        due = [repo for repo in self.repos if repo.name not in self.running and
+               now >= self.repo_state(repo).get('last_check', 0.0) + repo.interval]
+        return sorted(due, key=lambda repo: (-repo.priority, self.repo_state(repo).get('last_check', 0.0)))
+
+    def estimate_memory(self, repo):
+        return self.repo_state(repo).get('peak_rss') or self.run_memory
+
+    def launch(self, repo, heads, now):
+        parent_connection, child_connection = CONTEXT.Pipe(duplex=False)
+        process = CONTEXT.Process(target=run_repo, args=(repo, self.srcpath, child_connection),
+                                  name='git-quality {name}'.format(name=repo.name))
+        process.start()
+        child_connection.close()
+        self.running[repo.name] = Run(repo, process, parent_connection, now, heads, self.estimate_memory(repo))
+        self.last_start = now
+        state = self.repo_state(repo)
+        state['last_check'] = state['last_start'] = now
+        state['status'] = 'running'
+        logging.info('Started {name}'.format(name=repo.name))
+
+    def collect(self):
+        """ Records the runs which finished """
+        for name, run in list(self.running.items()):
+            if run.process.is_alive() and not run.connection.poll():
+                continue
+            result = run.connection.recv() if run.connection.poll() else {}
+            run.process.join()
+            run.connection.close()
+            del self.running[name]
+
+            duration = round(time.time() - run.start, 3)
+            state = self.repo_state(run.repo)
+            state['duration'] = duration
+            state['durations'] = (state.get('durations', []) + [duration])[-HISTORY_SIZE:]
+            if result.get('peak_rss'):
+                state['peak_rss'] = result['peak_rss']
+            error = result.get('error') or (None if 0 == run.process.exitcode else
+                                            'Exited with code {code}'.format(code=run.process.exitcode))
+            if error is None:
+                state.update(status='ok', heads=run.heads, last_success=run.start, error=None)
+            else:
+                state.update(status='failed', error=error)
+            logging.info('{name} {status} in {duration:.1f}s, {mean:.1f}s on average'.format(
+                name=name, status='finished' if error is None else 'failed', duration=duration,
+                mean=sum(state['durations']) / len(state['durations'])))
+
+    def step(self, now=None):
+        """ Records the finished runs, skips the due repositories which did not change, and starts the others as the
+        limits allow
+        :return: the number of due repositories waiting for the limits
+        :rtype: int
+        """
+        now = now or time.time()
+        self.collect()
+        waiting = 0
+        for repo in self.compute_due(now):
+            state = self.repo_state(repo)
+            try:
+                heads = repo.read_heads()
+            except (subprocess.CalledProcessError, OSError) as e:
+                state.update(last_check=now, status='failed', error=str(e))
+                logging.warning('Could not read the HEAD of {name}: {error}'.format(name=repo.name, error=e))
+                continue
+            if 'ok' == state.get('status') and heads == state.get('heads'):
+                state.update(last_check=now)
+                logging.debug('Skipped {name}, its HEAD did not move'.format(name=repo.name))
+                continue
+
+            used = sum(run.memory for run in self.running.values())
+            if len(self.running) >= self.concurrency or now - self.last_start < self.stagger or \
+                    (self.running and self.memory and used + self.estimate_memory(repo) > self.memory):
+                waiting += 1
+                continue
+            self.launch(repo, heads, now)
+        save_state(self.state_path, self.state)
+        return waiting
+
+    def run(self, poll=DEFAULT_POLL, once=False):
+        """ Runs the due repositories until interrupted
+        :param float poll: the maximum seconds between checks for due repositories
+        :param bool once: True to return once the repositories due at the start ran
+        """
+        logging.info('Scheduling {no_repos:d} repositories, {concurrency:d} at a time'.format(
+            no_repos=len(self.repos), concurrency=self.concurrency))
+        while True:
+            waiting = self.step()
+            if once and not waiting and not self.running:
+                return
+            # wake up as soon as a run finishes, or the next run may start
+            timeout = poll
+            if waiting and time.time() < self.last_start + self.stagger:
+                timeout = min(poll, self.last_start + self.stagger - time.time())
+            multiprocessing.connection.wait([run.process.sentinel for run in self.running.values()], timeout)
+
+    def wait(self):
+        """ Waits for the runs in progress to finish """
+        for run in self.running.values():
+            run.process.join()
+        self.collect()
+        save_state(self.state_path, self.state)
+
+
+def format_status(state):
+    """ Lists the state of the runs per repository, slowest first
+    :param dict[str, dict] state: the state, see Scheduler
+    :rtype: str
+    """
+    lines = ['{name:<24} {status:<8} {duration:>10} {mean:>10} {memory:>8} {last_success}'.format(
+        name='repository', status='status', duration='last (s)', mean='mean (s)', memory='MiB',
+        last_success='last success')]
+    for name, s in sorted(state.items(), key=lambda item: -(item[1].get('duration') or 0.0)):
+        durations = s.get('durations') or [0.0]
+        lines.append('{name:<24} {status:<8} {duration:>10.1f} {mean:>10.1f} {memory:>8.0f} {last_success}'.format(
+            name=name, status=s.get('status', ''), duration=s.get('duration') or 0.0,
+            mean=sum(durations) / len(durations), memory=(s.get('peak_rss') or 0) / MIB,
+            last_success=datetime.datetime.fromtimestamp(s['last_success']).strftime('%Y-%m-%d %H:%M')
+            if s.get('last_success') else 'never'))
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--srcpath')
+@click.option('--once', is_flag=True, help='Exit once the due repositories ran, e.g. when run from cron')
+@click.option('--status', is_flag=True, help='List the state and durations of the last runs, slowest first')
+def schedule(srcpath='/opt/git-quality', once=False, status=False):
+    parser = util.load_config()
+    config = parser['scheduler'] if parser.has_section('scheduler') else {}
+    state_path = config.get('state') or os.path.join(os.path.dirname(util.CONFIG_INI), STATE_FILENAME)
+    if status:
+        click.echo(format_status(load_state(state_path)))
+        return
+    repos = read_repos(parser, float(config.get('interval', DEFAULT_INTERVAL)))
+    if not repos:
+        raise click.ClickException('No [{prefix}<name>] sections in {path}'.format(prefix=REPO_PREFIX,
+                                                                                  path=util.CONFIG_INI))
+    preload()
+    scheduler = Scheduler(repos, srcpath, state_path, int(config.get('concurrency', DEFAULT_CONCURRENCY)),
+                          float(config.get('memory', DEFAULT_MEMORY)),
+                          float(config.get('run_memory', DEFAULT_RUN_MEMORY)),
+                          float(config.get('stagger', DEFAULT_STAGGER)))
+    try:
+        scheduler.run(float(config.get('poll', DEFAULT_POLL)), once)
+    finally:
+        scheduler.wait()
+
+
+if __name__ == '__main__':
+    schedule()
@@ -0,0 +1,156 @@
+""" Functions for writing the generated site with as little file system churn as possible
+
+Files are only written when their content changed, always atomically via a temporary file in the same directory, so
+that readers of the web root never see partial files. Files with the same content as one written before are hard
+links to it rather than copies.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+# templates shared by all pages, placed once at the root of the site
+STATIC_ASSETS = ['styles.css', 'scripts.js']
+
+
+def compute_static_prefix(output, dirname):
+    """ Computes the relative reference from a page to the root of the site, where the shared assets are
+    :param str output: the root of the site
+    :param str dirname: the directory of the page
+    :return: e.g. '../../', or '' for pages at the root
+    :rtype: str
+    """
+    relpath = os.path.relpath(output, dirname)
+    return '' if os.curdir == relpath else relpath.replace(os.sep, '/') + '/'
+
+
+def has_content(path, data):
+    """ Checks whether the file at the given path holds exactly the given bytes
+    :rtype: bool
+    """
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def temporary_path(path):
+    """ Creates an empty temporary file next to the given path, to be moved onto it
+    The extension is kept, for writers which infer the file format from it.
+    :rtype: str
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix=os.path.splitext(path)[1],
+                                    dir=os.path.dirname(path) or None)
+    os.close(fd)
+    return tmp_path
+
+
+def replace_if_changed(tmp_path, path):
+    """ Moves a temporary file onto the given path unless the path already holds the same content
+    :return: True if the file was replaced
+    :rtype: bool
+    """
+    with open(tmp_path, 'rb') as f:
+        data = f.read()
+    if has_content(path, data):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+def write_if_changed(path, data):
+    """ Atomically writes the given content unless the file already holds it
+    :param str path: the file to write
+    :param str|bytes data: the content, text is encoded as utf-8
+    :return: True if the file was written
+    :rtype: bool
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if has_content(path, data):
+        return False
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def link_if_changed(source, path):
+    """ Atomically makes the given path a hard link to the source file, copying it where links are not supported
+    :return: True if the path was changed
+    :rtype: bool
+    """
+    try:
+        if os.path.samefile(source, path):
+            return False
+    except OSError:
+        pass
+    tmp_path = temporary_path(path)
+    os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        # e.g. across devices
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+class SiteWriter(object):
+    """ Writes the files of the site, hard linking files with identical content to the first one written """
+
+    def __init__(self, output):
+        """
+        :param str output: the root of the site
+        """
+        self.output = output
+        self.paths = {}
+        self.no_written = self.no_linked = self.no_unchanged = 0
+
+    def write(self, path, data):
+        """ Writes the given content to the given path, see write_if_changed
+        :param str path: the file to write
+        :param str|bytes data: the content, text is encoded as utf-8
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        source = self.paths.setdefault(digest, path)
+        if source != path:
+            changed = link_if_changed(source, path)
+            self.no_linked += changed
+        else:
+            changed = write_if_changed(path, data)
+            self.no_written += changed
+        self.no_unchanged += not changed
+
+    def link(self, source, path):
+        """ Makes the given path hold the same content as an already written file, see link_if_changed """
+        if link_if_changed(source, path):
+            self.no_linked += 1
+        else:
+            self.no_unchanged += 1
+
+    def copy_static_assets(self, srcpath):
+        """ Places the shared assets at the root of the site
+        :param str srcpath: the installation directory holding the templates
+        """
+        os.makedirs(self.output, exist_ok=True)
+        for asset in STATIC_ASSETS:
+            with open(os.path.join(srcpath, 'templates', asset), 'rb') as f:
+                self.write(os.path.join(self.output, asset), f.read())
+
+    def log_stats(self):
+        logging.info('Site: {no_written:d} files written, {no_linked:d} linked, {no_unchanged:d} unchanged'.format(
+            no_written=self.no_written, no_linked=self.no_linked, no_unchanged=self.no_unchanged))
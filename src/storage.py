@@ -0,0 +1,122 @@
+""" Functions for persisting the commit and pull request dataframes in a typed columnar format """
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import gitparser
+import profiling
+
+# columns holding few distinct values
+CATEGORICAL_COLUMNS = [gitparser.AUTHOR, gitparser.REPO]
+# columns holding counts
+COUNT_COLUMNS = [gitparser.NO_REVIEWS, gitparser.FILES, gitparser.INSERTIONS, gitparser.DELETIONS,
+                 gitparser.CODE_FILES, gitparser.CODE_CHANGES]
+# minutes east of UTC, within a day
+OFFSET_COLUMNS = [gitparser.TZ_OFFSET]
+# columns holding strings, stored in one arrow buffer per column rather than as a python object per row
+STRING_COLUMNS = [gitparser.HASH, gitparser.TITLE]
+STRING_DTYPE = pd.StringDtype('pyarrow')
+# columns holding lists of strings
+LIST_COLUMNS = [gitparser.REVIEWERS]
+LIST_DTYPE = pd.ArrowDtype(pa.list_(pa.string()))
+# bucket labels saved by earlier versions, buckets are computed per view by aggregation.daterange_buckets
+LEGACY_COLUMNS = ['month', 'M', 'week', 'W']
+
+
+def compute_path(output, name, extension='feather'):
+    return os.path.join(output, '{name}.{extension}'.format(name=name, extension=extension))
+
+
+def apply_dtypes(df, titles=True):
+    """ Converts the columns of a commit or pull request dataframe to compact types
+    :param pd.DataFrame df: the dataframe to convert, indexed by date
+    :param bool titles: False to drop the titles, which no chart or report shows
+    :return: the converted dataframe
+    :rtype: pd.DataFrame
+    """
+    dropped = [c for c in LEGACY_COLUMNS + ([] if titles else [gitparser.TITLE]) if c in df.columns]
+    df = df.drop(columns=dropped)
+    dtypes = {}
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            dtypes[column] = 'category'
+        elif column in COUNT_COLUMNS:
+            dtypes[column] = np.int32
+        elif column in OFFSET_COLUMNS:
+            dtypes[column] = np.int16
+        elif column in STRING_COLUMNS:
+            dtypes[column] = STRING_DTYPE
+        elif column in LIST_COLUMNS:
+            dtypes[column] = LIST_DTYPE
+    df = df.astype(dtypes)
+    df.index = pd.to_datetime(df.index, errors='coerce')
+    if df.index.tz is not None:
+        # saved by earlier versions, which parsed the dates with their offsets
+        df.index = df.index.tz_convert(None)
+    return df
+
+
+def compute_memory_usage(df):
+    """ Computes the memory held by each column of a dataframe, including its index and the strings it refers to
+    :param pd.DataFrame df: the dataframe
+    :return: the number of bytes per column, largest first
+    :rtype: pd.Series
+    """
+    return df.memory_usage(index=True, deep=True).sort_values(ascending=False)
+
+
+def log_memory_usage(df, name):
+    """ Logs the memory held by a dataframe and its largest columns
+    :param pd.DataFrame df: the dataframe
+    :param str name: the name of the dataframe, e.g. 'commits'
+    """
+    usage = compute_memory_usage(df)
+    logging.info('{name} dataframe holds {no_rows:d} rows in {size:.1f} MiB ({columns})'.format(
+        name=name, no_rows=df.shape[0], size=usage.sum() / 2 ** 20,
+        columns=', '.join('{column} {size:.1f}'.format(column=column, size=size / 2 ** 20)
+                          for column, size in usage.items())))
+
+
+def save_df(df, output, name, csv=False):
+    """ Saves the given dataframe to the output directory as a feather file
+    :param pd.DataFrame df: the dataframe to save, indexed by date and typed by apply_dtypes
+    :param str output: the output directory
+    :param str name: the name of the dataframe, e.g. 'commits'
+    :param bool csv: also export the dataframe as csv
+    """
+    os.makedirs(output, exist_ok=True)
+    df.index.name = gitparser.DATE
+    with profiling.span('save', rows=len(df), dataframe=name):
+        # replaced at once, so that an interrupted save leaves the previous dataframe
+        path = compute_path(output, name)
+        df.reset_index().to_feather(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        if csv:
+            if gitparser.REVIEWERS in df.columns:
+                df = df.assign(**{gitparser.REVIEWERS: df[gitparser.REVIEWERS].map(', '.join)})
+            df.to_csv(compute_path(output, name, 'csv'))
+
+
+def load_df(output, name):
+    """ Loads a dataframe previously saved with save_df
+    :param str output: the output directory
+    :param str name: the name of the dataframe, e.g. 'commits'
+    :return: the dataframe indexed by date, or None if it has not been saved
+    :rtype: pd.DataFrame
+    """
+    path = compute_path(output, name)
+    with profiling.span('load', dataframe=name) as s:
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except OSError:
+            return None
+        # the pandas metadata cannot restore arrow list columns, the date index was saved as a column
+        df = table.to_pandas(types_mapper=lambda t: LIST_DTYPE if pa.types.is_list(t) else None,
+                             ignore_metadata=True)
+        s.rows = len(df)
+    logging.info('Loaded {no_rows:d} rows from {path}'.format(no_rows=df.shape[0], path=path))
+    return df.set_index(gitparser.DATE)
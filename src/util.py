@@ -10,9 +10,27 @@ except:
     CONFIG_INI = '/opt/git-quality/quality_config.ini'
 
 
+# parsed configs by path, with the modification time they were parsed at
+_parsers = {}
+
+
+def load_config():
+    """ Parses the config, again only once it changed on disk, e.g. for the many reads of a scheduler
+    :rtype: ConfigParser
+    """
+    try:
+        mtime = os.path.getmtime(CONFIG_INI)
+    except OSError:
+        mtime = None
+    cached = _parsers.get(CONFIG_INI)
+    if cached is None or cached[0] != mtime:
+        parser = ConfigParser()
+        parser.read(CONFIG_INI)
+        cached = _parsers[CONFIG_INI] = (mtime, parser)
+    return cached[1]
+
+
 def read_config(section):
-    parser = ConfigParser()
-    parser.read(CONFIG_INI)
-    config_params = {param[0]: param[1] for param in parser.items(section)}
+    config_params = {param[0]: param[1] for param in load_config().items(section)}
     logging.debug("Loaded %d parameters for section %s", len(config_params), section)
     return config_params
@@ -0,0 +1,371 @@
+'use strict';
+
+/**
+ * git-quality dashboard
+ *
+ * Functionality:
+ * - Load the pre-aggregated statistics written by dashboard.py
+ * - Build the view, timeframe and author menus
+ * - - The selection is kept in the location hash, so views can be linked to
+ * - Sum the statistics of the selection and draw its charts
+ */
+(function() {
+    var DATA_URL = 'data.json';
+
+    // Tick labels are shown for every n-th bucket, as in aggregation.generate_xtick
+    var LABEL_EVERY = {M: 3, W: 9, D: 70};
+    var MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+
+    // Same colour map as the rendered charts (tab10)
+    var COLOURS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                   '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+
+    // Punchcard layout, as in punchcard.py
+    var DAYS = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'];
+    var FIRST_HOUR = 5;
+
+    var data = null;
+    var charts = {};
+
+    /**
+     * Read the selected view, timeframe and author from the location hash
+    */
+    function readSelection() {
+        var selection = {
+            view: data.views[0].frequency,
+            timeframe: data.timeframes[0].key,
+            author: ''
+        };
+
+        window.location.hash.replace(/^#/, '').split('&').forEach(function(pair) {
+            var parts = pair.split('=');
+
+            if (parts.length === 2 && parts[0] in selection) {
+                selection[parts[0]] = decodeURIComponent(parts[1]);
+            }
+        });
+        return selection;
+    }
+
+    /**
+     * Compute the location hash of the current selection with the given changes applied
+    */
+    function selectionHash(changes) {
+        var selection = Object.assign(readSelection(), changes);
+
+        return '#' + ['view', 'timeframe', 'author'].map(function(key) {
+            return key + '=' + encodeURIComponent(selection[key]);
+        }).join('&');
+    }
+
+    /**
+     * Add a link per option to the given menu, keeping the separator
+    */
+    function fillMenu(id, options) {
+        var menu = document.getElementById(id);
+
+        options.forEach(function(option) {
+            var item = document.createElement('li');
+            var link = document.createElement('a');
+
+            link.textContent = option.text;
+            link.addEventListener('click', function(event) {
+                event.preventDefault();
+                window.location.hash = selectionHash(option.changes);
+            });
+            link.href = '#';
+            item.appendChild(link);
+            menu.appendChild(item);
+        });
+    }
+
+    /**
+     * Build the menus from the views, timeframes and authors in the data
+    */
+    function initialiseMenus() {
+        fillMenu('view-nav', data.views.map(function(view) {
+            return {text: view.text, changes: {view: view.frequency}};
+        }));
+
+        fillMenu('timeframe-nav', data.timeframes.map(function(timeframe) {
+            return {text: timeframe.text, changes: {timeframe: timeframe.key}};
+        }));
+
+        fillMenu('author-nav', [{text: 'Team', changes: {author: ''}}].concat(
+            data.recent_authors.map(function(id) {
+                return {text: data.authors[id], changes: {author: data.authors[id]}};
+            })));
+    }
+
+    /**
+     * Create an array of the given size filled with zeros
+    */
+    function zeros(size) {
+        var values = new Array(size);
+
+        values.fill(0);
+        return values;
+    }
+
+    /**
+     * Sum a column of a table per bucket and per value of the key column, over the rows of the given authors
+     *
+     * Returns the sums by key id, for the most recent [size] buckets only
+    */
+    function sumByKey(table, column, keyColumn, authors, start, size) {
+        var sums = {};
+
+        for (var i = 0; i < table.bucket.length; i++) {
+            var bucket = table.bucket[i] - start;
+
+            if (bucket >= 0 && bucket < size && authors.has(table.author[i])) {
+                var key = table[keyColumn][i];
+
+                if (!(key in sums)) {
+                    sums[key] = zeros(size);
+                }
+                sums[key][bucket] += table[column][i];
+            }
+        }
+        return sums;
+    }
+
+    /**
+     * Sum a column of a table per bucket, over the rows of the given authors
+    */
+    function sum(table, column, authors, start, size) {
+        var sums = zeros(size);
+        var byAuthor = sumByKey(table, column, 'author', authors, start, size);
+
+        Object.keys(byAuthor).forEach(function(author) {
+            byAuthor[author].forEach(function(value, bucket) {
+                sums[bucket] += value;
+            });
+        });
+        return sums;
+    }
+
+    /**
+     * Compute the mean and sample standard deviation per bucket from the summed count, sum and sum of squares,
+     * as in aggregation.compute_mean_std
+    */
+    function meanStd(table, authors, start, size) {
+        var counts = sum(table, 'count', authors, start, size);
+        var sums = sum(table, 'sum', authors, start, size);
+        var sumsqs = sum(table, 'sumsq', authors, start, size);
+
+        return counts.map(function(n, bucket) {
+            var mean = n > 0 ? sums[bucket] / n : null;
+            var variance = n > 1 ? (sumsqs[bucket] - sums[bucket] * mean) / (n - 1) : null;
+
+            return {mean: mean, std: variance === null ? null : Math.sqrt(Math.max(variance, 0))};
+        });
+    }
+
+    /**
+     * Label every n-th bucket with its month, as in aggregation.generate_xtick
+    */
+    function tickLabels(buckets, frequency) {
+        return buckets.map(function(bucket, i) {
+            if (i % LABEL_EVERY[frequency] !== 0) {
+                return '';
+            }
+            return MONTHS[parseInt(bucket.slice(5, 7), 10) - 1] + '\'' + bucket.slice(2, 4);
+        });
+    }
+
+    /**
+     * Convert sums by key id to one dataset per key, in the order of the given ids
+    */
+    function datasets(sums, ids, transform) {
+        return ids.map(function(id, i) {
+            return {
+                label: data.authors[id],
+                data: (sums[id] || []).map(transform || function(value) { return value; }),
+                backgroundColor: COLOURS[i % COLOURS.length]
+            };
+        });
+    }
+
+    /**
+     * (Re)draw the chart on the canvas with the given id
+    */
+    function draw(id, config) {
+        if (charts[id]) {
+            charts[id].destroy();
+        }
+        config.options = Object.assign({responsive: false, animation: false}, config.options);
+        charts[id] = new Chart(document.getElementById(id), config);
+    }
+
+    /**
+     * Draw a bar chart per author, stacked unless told otherwise
+    */
+    function drawStackedBar(id, labels, series, title, stacked) {
+        stacked = stacked !== false;
+        draw(id, {
+            type: 'bar',
+            data: {labels: labels, datasets: series},
+            options: {
+                plugins: {title: {display: true, text: title}},
+                scales: {x: {stacked: stacked}, y: {stacked: stacked, beginAtZero: true}}
+            }
+        });
+    }
+
+    /**
+     * Draw the mean per bucket with error bars of one standard deviation
+    */
+    function drawErrorbar(id, labels, stats, title) {
+        draw(id, {
+            type: 'bar',
+            data: {
+                labels: labels,
+                datasets: [{
+                    type: 'line',
+                    label: 'mean',
+                    data: stats.map(function(s) { return s.mean; }),
+                    showLine: false,
+                    pointRadius: 5,
+                    backgroundColor: COLOURS[0]
+                }, {
+                    label: 'std',
+                    data: stats.map(function(s) {
+                        return s.std === null ? null : [Math.max(s.mean - s.std, 0), s.mean + s.std];
+                    }),
+                    barThickness: 2,
+                    backgroundColor: COLOURS[0]
+                }]
+            },
+            options: {
+                plugins: {title: {display: true, text: title}, legend: {display: false}},
+                scales: {y: {beginAtZero: true}}
+            }
+        });
+    }
+
+    /**
+     * Draw the commit punchcard of the given authors: a circle per day and hour, sized by the number of commits
+    */
+    function drawPunchcard(authors) {
+        var canvas = document.getElementById('punchcard');
+        var context = canvas.getContext('2d');
+        var grid = zeros(7 * 24);
+
+        authors.forEach(function(author) {
+            (data.punchcards[author] || []).forEach(function(value, cell) {
+                grid[cell] += value;
+            });
+        });
+
+        var max = Math.max.apply(null, grid) || 1;
+        var distance = Math.min(canvas.width / (24 - FIRST_HOUR + 2), canvas.height / (7 + 2));
+
+        context.clearRect(0, 0, canvas.width, canvas.height);
+        context.fillStyle = getComputedStyle(document.body).color;
+        context.textAlign = 'center';
+        context.textBaseline = 'middle';
+
+        for (var hour = FIRST_HOUR; hour < 24; hour++) {
+            context.fillText(hour, (hour - FIRST_HOUR + 2) * distance, distance / 2);
+        }
+        for (var day = 0; day < 7; day++) {
+            // Monday is the first day of the data, Sunday is drawn first
+            var row = (day + 1) % 7 + 1;
+
+            context.fillText(DAYS[row - 1], distance / 2, row * distance);
+
+            for (hour = FIRST_HOUR; hour < 24; hour++) {
+                var value = grid[day * 24 + hour];
+
+                if (value > 0) {
+                    context.beginPath();
+                    context.arc((hour - FIRST_HOUR + 2) * distance, row * distance,
+                                Math.sqrt(value / max) * distance / 2, 0, 2 * Math.PI);
+                    context.fill();
+                }
+            }
+        }
+    }
+
+    /**
+     * Draw all charts of the selection in the location hash
+    */
+    function render() {
+        var selection = readSelection();
+        var view = data.views.find(function(v) { return v.frequency === selection.view; }) || data.views[0];
+        var timeframe = data.timeframes.find(function(t) { return t.key === selection.timeframe; }) ||
+            data.timeframes[0];
+        var frequency = data.frequencies[view.frequency];
+        var tables = frequency.tables;
+
+        // A narrower timeframe shows the most recent buckets
+        var size = timeframe.buckets[view.frequency];
+        var start = frequency.buckets.length - size;
+        var labels = tickLabels(frequency.buckets.slice(start), view.frequency);
+        var freqText = view.text.toLowerCase().slice(0, -2).replace('i', 'y');
+
+        var authorId = data.authors.indexOf(selection.author);
+        var authorIds = authorId < 0 ? data.recent_authors : [authorId];
+        var authors = new Set(authorIds);
+
+        document.getElementById('name').textContent = authorId < 0 ? data.name : selection.author;
+        document.getElementById('view-text').textContent = view.text;
+        document.getElementById('timeframe-text').textContent = timeframe.text;
+
+        var prs = sumByKey(tables.prs, 'count', 'author', authors, start, size);
+        drawStackedBar('prs', labels, datasets(prs, authorIds),
+                       'No. merged pull requests by author per ' + freqText);
+        drawStackedBar('authors', labels, datasets(prs, authorIds, function(value) { return Math.min(value, 1); }),
+                       'No. authors per ' + freqText);
+        drawStackedBar('reviews', labels,
+                       datasets(sumByKey(tables.reviews, 'count', 'reviewer', authors, start, size),
+                                data.recent_authors),
+                       'No. reviews received by reviewer per ' + freqText);
+        drawErrorbar('avg_reviews', labels, meanStd(tables.no_reviews, authors, start, size),
+                     'Avg reviews per ' + freqText);
+
+        drawStackedBar('commits', labels,
+                       datasets(sumByKey(tables.commits, 'count', 'author', authors, start, size), authorIds),
+                       'No. commits by author per ' + freqText);
+
+        var insertions = sumByKey(tables.commits, 'insertions', 'author', authors, start, size);
+        var deletions = sumByKey(tables.commits, 'deletions', 'author', authors, start, size);
+        var net = {};
+        authorIds.forEach(function(id) {
+            net[id] = (insertions[id] || zeros(size)).map(function(value, bucket) {
+                return value - (deletions[id] || zeros(size))[bucket];
+            });
+        });
+        drawStackedBar('changes_by_author', labels, datasets(net, authorIds),
+                       'Net insertions / deletions by author per ' + freqText, false);
+
+        drawStackedBar('code', labels,
+                       datasets(sumByKey(tables.commits, 'code_changes', 'author', authors, start, size), authorIds),
+                       'LOC changed by author per ' + freqText);
+        drawErrorbar('avg_changes', labels, meanStd(tables.code_changes, authors, start, size),
+                     'Average LOC changed per commit');
+
+        drawPunchcard(authorIds);
+    }
+
+    /**
+     * Load the data and draw the selection, redrawing whenever it changes
+    */
+    function initialiseDashboard() {
+        fetch(DATA_URL).then(function(response) {
+            return response.json();
+        }).then(function(json) {
+            data = json;
+            initialiseMenus();
+            render();
+            window.addEventListener('hashchange', render);
+        }).catch(function(error) {
+            // Uh-oh...
+            console.warn('I can\'t load the dashboard data', error);
+        });
+    }
+
+    // Let's go!
+    initialiseDashboard();
+}());
@@ -0,0 +1,130 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregation
+import gitparser
+
+NOW = datetime.datetime(2024, 4, 2, 15, 30)
+START = datetime.datetime(2023, 4, 2)
+
+
+def daterange_groupby(labels, ranges):
+    """ The per row bucketing which daterange_buckets replaces """
+    def mapping_fn(index):
+        for i, (from_dt, to_dt) in enumerate(ranges):
+            if from_dt <= index < to_dt:
+                return labels[i]
+    return mapping_fn
+
+
+def compute_dates(ranges):
+    rng = np.random.default_rng(7)
+    dates = [START + datetime.timedelta(seconds=int(s)) for s in rng.integers(0, 366 * 86400, 500)]
+    # the edges of every range, and just before and after them
+    for from_dt, to_dt in ranges:
+        dates += [from_dt, to_dt, from_dt - datetime.timedelta(microseconds=1),
+                  to_dt - datetime.timedelta(microseconds=1)]
+    # outside of all ranges
+    dates += [ranges[0][0] - datetime.timedelta(days=400), ranges[-1][1] + datetime.timedelta(days=1)]
+    return pd.DatetimeIndex(dates + [pd.NaT])
+
+
+@pytest.mark.parametrize('frequency', ['M', 'W', 'D'])
+def test_daterange_buckets_match_daterange_groupby(frequency):
+    xticks, ranges, _ = aggregation.generate_xticks(START, frequency, NOW)
+    index = compute_dates(ranges)
+
+    buckets = aggregation.daterange_buckets(index, xticks, ranges)
+
+    mapping_fn = daterange_groupby(xticks, ranges)
+    expected = [mapping_fn(date) for date in index]
+    assert [None if pd.isna(b) else pd.Timestamp(b).to_pydatetime() for b in buckets] == expected
+    # every kind of date occurs
+    assert any(e is None for e in expected) and len({e for e in expected if e is not None}) > 1
+
+
+@pytest.mark.parametrize('frequency', ['M', 'W', 'D'])
+def test_daterange_buckets_group_as_daterange_groupby(frequency):
+    xticks, ranges, _ = aggregation.generate_xticks(START, frequency, NOW)
+    index = compute_dates(ranges)
+    df = pd.DataFrame({'n': np.arange(len(index))}, index=index)
+
+    expected = df.groupby(daterange_groupby(xticks, ranges))['n'].sum()
+    actual = df.groupby(aggregation.daterange_buckets(df.index, xticks, ranges))['n'].sum()
+    assert expected.to_dict() == {k.to_pydatetime(): v for k, v in actual.items()}
+
+
+AUTHORS = ['Ann Bee', 'Cy Dee', 'Ed Eff']
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(11)
+    pr_dates = pd.DatetimeIndex(sorted(START + datetime.timedelta(seconds=int(s))
+                                       for s in rng.integers(0, 366 * 86400, 300)), name=gitparser.DATE)
+    pr_authors = rng.choice(AUTHORS, len(pr_dates))
+    reviewers = [sorted(rng.choice([a for a in AUTHORS if a != author], rng.integers(0, 3), replace=False))
+                 for author in pr_authors]
+    pr_df = pd.DataFrame({gitparser.HASH: ['pr{i:d}'.format(i=i) for i in range(len(pr_dates))],
+                          gitparser.AUTHOR: pr_authors, gitparser.REVIEWERS: reviewers,
+                          gitparser.NO_REVIEWS: [len(r) for r in reviewers]}, index=pr_dates)
+    commit_dates = pd.DatetimeIndex(sorted(START + datetime.timedelta(seconds=int(s))
+                                           for s in rng.integers(0, 366 * 86400, 600)), name=gitparser.DATE)
+    commit_df = pd.DataFrame({gitparser.HASH: ['c{i:d}'.format(i=i) for i in range(len(commit_dates))],
+                              gitparser.AUTHOR: rng.choice(AUTHORS, len(commit_dates)),
+                              gitparser.INSERTIONS: rng.integers(0, 200, len(commit_dates)),
+                              gitparser.DELETIONS: rng.integers(0, 200, len(commit_dates)),
+                              gitparser.CODE_CHANGES: rng.integers(0, 300, len(commit_dates))}, index=commit_dates)
+    return pr_df, commit_df
+
+
+def baseline_pr_frames(pr_df, authors, review_authors, start_date, frequency):
+    """ The pull request statistics as each view grouped the raw rows before the cube """
+    xticks, ranges, _ = aggregation.generate_xticks(start_date, frequency, NOW)
+    mapping_fn = daterange_groupby(xticks, ranges)
+    df = pr_df[pr_df[gitparser.AUTHOR].isin(authors)]
+    df_prs = df.groupby([mapping_fn, gitparser.AUTHOR]).size().unstack(fill_value=0).reindex(
+        index=xticks, columns=authors, fill_value=0)
+    edges = df.explode(gitparser.REVIEWERS).dropna(subset=[gitparser.REVIEWERS])
+    df_reviews = edges.groupby([mapping_fn, gitparser.REVIEWERS]).size().unstack(fill_value=0).reindex(
+        index=xticks, columns=review_authors, fill_value=0)
+    df_avg_reviews = df.groupby(mapping_fn)[gitparser.NO_REVIEWS].agg(['mean', 'std']).reindex(xticks)
+    return {'prs': df_prs, 'authors': df_prs.clip(upper=1), 'reviews': df_reviews, 'avg_reviews': df_avg_reviews}
+
+
+def baseline_commit_frames(commit_df, authors, start_date, frequency):
+    """ The commit statistics as each view grouped the raw rows before the cube """
+    xticks, ranges, _ = aggregation.generate_xticks(start_date, frequency, NOW)
+    mapping_fn = daterange_groupby(xticks, ranges)
+    df = commit_df[commit_df[gitparser.AUTHOR].isin(authors)]
+    sums = df.groupby([mapping_fn, gitparser.AUTHOR])
+
+    def matrix(series):
+        return series.unstack(fill_value=0).reindex(index=xticks, columns=authors, fill_value=0)
+    insertions, deletions = matrix(sums[gitparser.INSERTIONS].sum()), matrix(sums[gitparser.DELETIONS].sum())
+    return {'commits': matrix(sums.size()), 'insertions': (insertions - deletions).clip(lower=0),
+            'deletions': (deletions - insertions).clip(lower=0), 'code': matrix(sums[gitparser.CODE_CHANGES].sum()),
+            'avg_changes': df.groupby(mapping_fn)[gitparser.CODE_CHANGES].agg(['mean', 'std']).reindex(xticks)}
+
+
+def assert_frames_equal(expected, actual):
+    assert expected.keys() == actual.keys()
+    for name in expected:
+        pd.testing.assert_frame_equal(expected[name], actual[name], check_dtype=False, check_names=False,
+                                      check_index_type=False, check_column_type=False, obj=name)
+
+
+@pytest.mark.parametrize('frequency', ['M', 'W', 'D'])
+@pytest.mark.parametrize('authors', [AUTHORS, ['Cy Dee']])
+def test_cube_slices_match_daterange_groupby(frames, frequency, authors):
+    pr_df, commit_df = frames
+    cube = aggregation.Cube(pr_df, commit_df, frequency, START, NOW)
+    # the widest view, and a narrower one sliced from the same cube
+    for start_date in [START, NOW - datetime.timedelta(days=45)]:
+        assert_frames_equal(baseline_pr_frames(pr_df, authors, AUTHORS, start_date, frequency),
+                            cube.pr_frames(authors, AUTHORS, start_date))
+        assert_frames_equal(baseline_commit_frames(commit_df, authors, start_date, frequency),
+                            cube.commit_frames(authors, start_date))
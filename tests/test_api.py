@@ -0,0 +1,110 @@
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+import aggregation
+import api
+import gitparser
+import storage
+
+README_QUERY = '/api/prs?authors=Ann%20Bee&frequency=W&start=2024-01-01&end=2024-04-01'
+
+
+@pytest.fixture
+def store():
+    dates = pd.DatetimeIndex(['2024-01-01 09:00', '2024-01-31 23:00', '2024-02-01 10:00', '2024-03-31 12:00',
+                              '2024-04-01 08:00'], name=gitparser.DATE)
+    pr_df = pd.DataFrame({gitparser.HASH: ['a', 'b', 'c', 'd', 'e'],
+                          gitparser.AUTHOR: ['Ann Bee', 'Ann Bee', 'Cy Dee', 'Ann Bee', 'Ann Bee'],
+                          gitparser.REVIEWERS: [['Cy Dee'], [], ['Ann Bee'], ['Cy Dee'], []],
+                          gitparser.NO_REVIEWS: [1, 0, 1, 1, 0]}, index=dates)
+    commit_df = pd.DataFrame({gitparser.HASH: ['f'], gitparser.AUTHOR: ['Ann Bee'], gitparser.CODE_CHANGES: [3]},
+                             index=pd.DatetimeIndex(['2024-02-02 10:00'], name=gitparser.DATE))
+    store = api.MetricStore()
+    store.update(pr_df, commit_df)
+    return store
+
+
+@pytest.fixture
+def server(store):
+    server = api.create_server(store, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{port:d}'.format(port=server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_weekly_buckets_start_on_mondays_across_months():
+    # the 1st of april 2024 is a monday, the monday of the week of the 2nd as well
+    for end in [datetime.datetime(2024, 4, 1), datetime.datetime(2024, 4, 2, 12)]:
+        assert datetime.datetime(2024, 3, 31, 23, 59, 59) == aggregation.compute_penultimate_datetime(end, 'W')
+
+
+def test_readme_query(store):
+    result = json.loads(store.query(api.parse_query(README_QUERY)))
+    assert 'W' == result['frequency']
+    assert ['Ann Bee'] == list(result['values'])
+    # the pull requests of the range, not the one at its end
+    assert 3 == sum(result['values']['Ann Bee'])
+    assert len(result['buckets']) == len(result['values']['Ann Bee'])
+
+
+def test_readme_query_over_http(server):
+    with urllib.request.urlopen(server + README_QUERY) as response:
+        assert 200 == response.status
+        assert 3 == sum(json.loads(response.read())['values']['Ann Bee'])
+
+
+def test_end_before_start_is_rejected(server):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(server + '/api/prs?frequency=W&start=2024-04-01&end=2024-01-01')
+    assert 400 == e.value.code
+
+
+def test_nothing_loaded_is_unavailable(tmp_path):
+    server = api.create_server(api.MetricStore(str(tmp_path)), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen('http://127.0.0.1:{port:d}{query}'.format(port=server.server_address[1],
+                                                                             query=README_QUERY))
+        assert 503 == e.value.code
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_requests_reload_once(store, tmp_path, monkeypatch):
+    storage.save_df(store.pr_df, str(tmp_path), 'prs')
+    storage.save_df(store.commit_df, str(tmp_path), 'commits')
+    loads = []
+    load_df = storage.load_df
+    monkeypatch.setattr(storage, 'load_df', lambda *args: loads.append(args) or load_df(*args))
+    saved = api.MetricStore(str(tmp_path))
+
+    threads = [threading.Thread(target=saved.query, args=(api.parse_query(README_QUERY),)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 2 == len(loads)
+    assert 5 == len(saved.pr_df)
+
+
+def test_unreadable_dataframes_keep_the_loaded_ones(store, tmp_path, monkeypatch):
+    storage.save_df(store.pr_df, str(tmp_path), 'prs')
+    storage.save_df(store.commit_df, str(tmp_path), 'commits')
+    saved = api.MetricStore(str(tmp_path))
+    saved.refresh()
+    loaded = saved.pr_df
+
+    # replaced while reading
+    saved.mtimes = None
+    monkeypatch.setattr(storage, 'load_df', lambda *args: None)
+    saved.refresh()
+    assert saved.pr_df is loaded